@@ -1,11 +1,23 @@
 --ddl
 -- DDL: criar esquema consistente (idempotente)
+DROP MATERIALIZED VIEW IF EXISTS resumo_consumo_usuario;
+DROP TABLE IF EXISTS alertas_estouro CASCADE;
+DROP TABLE IF EXISTS faturamento_mensal CASCADE;
+DROP TABLE IF EXISTS watermark_faturamento CASCADE;
+DROP TABLE IF EXISTS sketches_consumo CASCADE;
+DROP TABLE IF EXISTS eventos_anomalia CASCADE;
+DROP TABLE IF EXISTS estado_anomalia_usuario CASCADE;
+DROP TABLE IF EXISTS watermark_detector CASCADE;
+DROP TABLE IF EXISTS feature_store_consumo CASCADE;
+DROP TABLE IF EXISTS log_uso_mensal CASCADE;
+DROP TABLE IF EXISTS log_uso_diario CASCADE;
 DROP TABLE IF EXISTS log_uso_sim CASCADE;
 DROP TABLE IF EXISTS usuario CASCADE;
 DROP TABLE IF EXISTS altera_excesso CASCADE;
 DROP TABLE IF EXISTS eventos_especiais CASCADE;
 DROP TABLE IF EXISTS situacao CASCADE;
 DROP TABLE IF EXISTS dispositivos CASCADE;
+DROP TABLE IF EXISTS localizacoes CASCADE;
 DROP TABLE IF EXISTS cargos CASCADE;
 DROP TABLE IF EXISTS departamentos CASCADE;
 DROP TABLE IF EXISTS empresas CASCADE;
@@ -37,6 +49,8 @@ CREATE TABLE usuario (
     FOREIGN KEY (id_empresa) REFERENCES empresas(id_empresa)
 );
 
+CREATE INDEX idx_usuario_empresa ON usuario (id_empresa, id_departamento, id_cargo);
+
 CREATE TABLE situacao (
     id_situacao SERIAL PRIMARY KEY,
     situacao VARCHAR(100) NOT NULL
@@ -57,8 +71,20 @@ CREATE TABLE dispositivos(
     nome_dispositivo VARCHAR(100) NOT NULL
 );
 
+-- Dimensão de localização: cada cidade uma vez, com chave inteira no log
+-- (migracao_localizacoes.sql converte bancos com a coluna de texto antiga)
+CREATE TABLE localizacoes (
+    id_localizacao SERIAL PRIMARY KEY,
+    nome VARCHAR(255) NOT NULL UNIQUE,
+    latitude DOUBLE PRECISION,
+    longitude DOUBLE PRECISION
+);
+
+-- Particionada por empresa (tenant): consultas com id_empresa leem só a partição do cliente.
+-- id_empresa repete o de usuario para permitir o particionamento.
 CREATE TABLE log_uso_sim (
-    id_log SERIAL PRIMARY KEY,
+    id_log SERIAL,
+    id_empresa INT NOT NULL,
     id_usuario INT NOT NULL,
     id_situacao INT NOT NULL,
     id_alerta INT NOT NULL,
@@ -67,11 +93,260 @@ CREATE TABLE log_uso_sim (
     data_uso TIMESTAMP NOT NULL,
     consumo_dados_gb NUMERIC(10,2) NOT NULL,
     custo_total NUMERIC(10,2),
-    localizacao VARCHAR(255),
+    id_localizacao INT,
     data_referencia DATE,
+    -- Transação que inseriu o registro (PostgreSQL 13+): cursor dos consumidores incrementais,
+    -- que ao contrário do id_log não recebe valores menores depois de confirmados
+    id_transacao xid8 NOT NULL DEFAULT pg_current_xact_id(),
+    PRIMARY KEY (id_empresa, id_log),
+    FOREIGN KEY (id_empresa) REFERENCES empresas(id_empresa),
     FOREIGN KEY (id_usuario) REFERENCES usuario(id_usuario),
     FOREIGN KEY (id_situacao) REFERENCES situacao(id_situacao),
     FOREIGN KEY (id_alerta) REFERENCES altera_excesso(id_alerta),
     FOREIGN KEY (id_evento) REFERENCES eventos_especiais(id_evento),
-    FOREIGN KEY (id_dispositivo) REFERENCES dispositivos(id_dispositivo)
+    FOREIGN KEY (id_dispositivo) REFERENCES dispositivos(id_dispositivo),
+    FOREIGN KEY (id_localizacao) REFERENCES localizacoes(id_localizacao)
+) PARTITION BY LIST (id_empresa);
+
+-- Empresas sem partição própria caem aqui
+CREATE TABLE log_uso_sim_padrao PARTITION OF log_uso_sim DEFAULT;
+
+-- Cria a partição de uma empresa nova (chamada por popula_banco.py antes de inserir os logs)
+CREATE OR REPLACE FUNCTION cria_particao_empresa(p_id_empresa INT) RETURNS void AS $$
+BEGIN
+    EXECUTE format(
+        'CREATE TABLE IF NOT EXISTS %I PARTITION OF log_uso_sim FOR VALUES IN (%s)',
+        'log_uso_sim_empresa_' || p_id_empresa, p_id_empresa
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+-- Leitura ordenada por usuário (treino em streaming e features por usuário)
+CREATE INDEX idx_log_uso_usuario_data ON log_uso_sim (id_usuario, data_uso);
+-- Leitura incremental por transação (detector de anomalias)
+CREATE INDEX idx_log_uso_transacao ON log_uso_sim (id_transacao, id_log);
+-- Filtros por período dentro da empresa
+CREATE INDEX idx_log_uso_data ON log_uso_sim (id_empresa, data_uso);
+-- Consumo por localização dentro da empresa (agrupa pela chave inteira)
+CREATE INDEX idx_log_uso_localizacao ON log_uso_sim (id_empresa, id_localizacao);
+
+-- Histórico compactado (compactacao.py): registros brutos além da retenção viram uma linha
+-- por usuário e dia e uma por usuário e mês, e saem de log_uso_sim. Leitores unem bruto e
+-- resumo (compactacao.uso_diario / uso_mensal); as partes nunca se sobrepõem.
+-- Atributos do dia (evento, dispositivo, situação, localização) são os do último registro.
+CREATE TABLE log_uso_diario (
+    id_empresa INT NOT NULL,
+    id_usuario INT NOT NULL,
+    data_uso DATE NOT NULL,
+    consumo_dados_gb NUMERIC(12,2) NOT NULL,
+    custo_total NUMERIC(12,2) NOT NULL,
+    registros INT NOT NULL,
+    id_evento INT,
+    id_dispositivo INT,
+    id_situacao INT,
+    id_localizacao INT,
+    PRIMARY KEY (id_empresa, id_usuario, data_uso),
+    FOREIGN KEY (id_usuario) REFERENCES usuario(id_usuario),
+    FOREIGN KEY (id_localizacao) REFERENCES localizacoes(id_localizacao)
+);
+
+CREATE INDEX idx_log_uso_diario_data ON log_uso_diario (id_empresa, data_uso);
+
+-- data_uso = primeiro dia do mês; departamento e cargo do usuário na compactação
+CREATE TABLE log_uso_mensal (
+    id_empresa INT NOT NULL,
+    id_usuario INT NOT NULL,
+    data_uso DATE NOT NULL,
+    id_departamento INT NOT NULL,
+    id_cargo INT NOT NULL,
+    consumo_dados_gb NUMERIC(14,2) NOT NULL,
+    custo_total NUMERIC(14,2) NOT NULL,
+    registros INT NOT NULL,
+    dias_com_uso INT NOT NULL,
+    PRIMARY KEY (id_empresa, id_usuario, data_uso),
+    FOREIGN KEY (id_usuario) REFERENCES usuario(id_usuario)
+);
+
+CREATE INDEX idx_log_uso_mensal_segmento ON log_uso_mensal (id_empresa, id_departamento, id_cargo, data_uso);
+
+-- Feature store: uma linha por registro de uso com as features de engenharia, com os mesmos
+-- lags por registro do treino (mantido por atualiza_feature_store.py)
+CREATE TABLE feature_store_consumo (
+    id_usuario INT NOT NULL,
+    data DATE NOT NULL,
+    seq INT NOT NULL,  -- ordem do registro no dia
+    consumo_dados_gb DOUBLE PRECISION NOT NULL,
+    lag_1 DOUBLE PRECISION,
+    lag_7 DOUBLE PRECISION,
+    lag_30 DOUBLE PRECISION,
+    rolling_7 DOUBLE PRECISION,
+    rolling_30 DOUBLE PRECISION,
+    cargo VARCHAR(100),
+    departamento VARCHAR(100),
+    evento VARCHAR(100),
+    dispositivo VARCHAR(100),
+    situacao VARCHAR(100),
+    atualizado_em TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (id_usuario, data, seq),
+    FOREIGN KEY (id_usuario) REFERENCES usuario(id_usuario)
+);
+
+CREATE INDEX idx_feature_store_segmento ON feature_store_consumo (departamento, cargo, id_usuario, data);
+
+-- Detector contínuo de anomalias (detector_anomalias.py)
+-- Estado online por usuário: Welford (n, media, m2) + EWMA
+CREATE TABLE estado_anomalia_usuario (
+    id_usuario INT PRIMARY KEY,
+    n BIGINT NOT NULL,
+    media DOUBLE PRECISION NOT NULL,
+    m2 DOUBLE PRECISION NOT NULL,
+    ewma DOUBLE PRECISION NOT NULL,
+    ewm_var DOUBLE PRECISION NOT NULL,
+    atualizado_em TIMESTAMP NOT NULL DEFAULT NOW(),
+    FOREIGN KEY (id_usuario) REFERENCES usuario(id_usuario)
+);
+
+CREATE TABLE eventos_anomalia (
+    id_anomalia SERIAL PRIMARY KEY,
+    id_empresa INT NOT NULL,
+    id_usuario INT NOT NULL,
+    id_log INT NOT NULL,
+    data_uso TIMESTAMP NOT NULL,
+    consumo_dados_gb DOUBLE PRECISION NOT NULL,
+    media_usuario DOUBLE PRECISION NOT NULL,
+    zscore DOUBLE PRECISION,
+    desvio_ewma DOUBLE PRECISION,
+    severidade VARCHAR(20) NOT NULL,
+    detectado_em TIMESTAMP NOT NULL DEFAULT NOW(),
+    FOREIGN KEY (id_usuario) REFERENCES usuario(id_usuario)
+);
+
+CREATE INDEX idx_eventos_anomalia_usuario ON eventos_anomalia (id_usuario, data_uso DESC);
+-- Data de referência ("últimos N dias") e leitura por empresa
+CREATE INDEX idx_eventos_anomalia_empresa_data ON eventos_anomalia (id_empresa, data_uso DESC);
+
+CREATE TABLE watermark_detector (
+    nome VARCHAR(50) PRIMARY KEY,
+    ultimo_id_transacao xid8 NOT NULL DEFAULT '0',
+    ultimo_id_log INT NOT NULL,
+    atualizado_em TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+-- Avisa o detector a cada INSERT (modo --modo listen). Uma notificação por comando, com
+-- payload constante: o PostgreSQL junta as repetidas na mesma transação, e o detector lê
+-- os registros pelo watermark de qualquer forma
+CREATE OR REPLACE FUNCTION notifica_log_uso_sim() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('log_uso_sim_novo', '');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_notifica_log_uso_sim
+AFTER INSERT ON log_uso_sim
+FOR EACH STATEMENT EXECUTE FUNCTION notifica_log_uso_sim();
+
+-- Sketches de maiores consumidores (heavy_hitters.py): Space-Saving + Count-Min
+-- por dia, empresa, segmento (departamento|cargo) e dimensão (usuario, dispositivo, localizacao)
+CREATE TABLE sketches_consumo (
+    bucket DATE NOT NULL,
+    id_empresa INT NOT NULL,
+    segmento VARCHAR(201) NOT NULL,
+    dimensao VARCHAR(30) NOT NULL,
+    sketch BYTEA NOT NULL,  -- .npz sem pickle (HeavyHitters.to_bytes)
+    volume_total DOUBLE PRECISION NOT NULL,
+    atualizado_em TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (bucket, id_empresa, segmento, dimensao)
 );
+
+CREATE INDEX idx_sketches_dimensao_bucket ON sketches_consumo (id_empresa, dimensao, bucket);
+
+-- Faturamento por usuário e mês (faturamento.py): consumo contra o plano do cargo,
+-- excedente e seu custo. Atualizado incrementalmente pelo watermark_faturamento (só os
+-- usuário-mês com registros novos são recalculados).
+CREATE TABLE faturamento_mensal (
+    id_empresa INT NOT NULL,
+    id_usuario INT NOT NULL,
+    mes DATE NOT NULL,
+    consumo_gb DOUBLE PRECISION NOT NULL,
+    limite_gb DOUBLE PRECISION,
+    excedente_gb DOUBLE PRECISION NOT NULL,
+    custo_total DOUBLE PRECISION NOT NULL,
+    custo_excedente DOUBLE PRECISION NOT NULL,
+    dia_estouro DATE,
+    registros INT NOT NULL,
+    atualizado_em TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (id_empresa, id_usuario, mes),
+    FOREIGN KEY (id_usuario) REFERENCES usuario(id_usuario)
+);
+
+-- Leitura do mês inteiro de uma empresa, maiores excedentes primeiro
+CREATE INDEX idx_faturamento_mes ON faturamento_mensal (id_empresa, mes, excedente_gb DESC);
+
+-- Linha única: todas as transações de log_uso_sim anteriores a xid_limite já entraram
+-- em faturamento_mensal (ver o cursor do detector em log_uso_sim.id_transacao)
+CREATE TABLE watermark_faturamento (
+    unica BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (unica),
+    xid_limite xid8 NOT NULL,
+    atualizado_em TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+-- Alertas de estouro do plano no mês (alertas_estouro.py): acumulado real + projeção
+-- diária até o fim do mês, no mês do último registro de cada empresa. Cada execução substitui
+-- as linhas desse mês da empresa; ranking por empresa (1 = estouro mais próximo). Lido pelo card "Alertas de Excesso".
+CREATE TABLE alertas_estouro (
+    id_empresa INT NOT NULL,
+    id_usuario INT NOT NULL,
+    mes DATE NOT NULL,
+    ranking INT NOT NULL,
+    severidade VARCHAR(20) NOT NULL,
+    data_estouro DATE NOT NULL,
+    dias_para_estouro INT NOT NULL,
+    consumo_mes_gb DOUBLE PRECISION NOT NULL,
+    projecao_mes_gb DOUBLE PRECISION NOT NULL,
+    limite_gb DOUBLE PRECISION NOT NULL,
+    excedente_projetado_gb DOUBLE PRECISION NOT NULL,
+    data_referencia DATE NOT NULL,
+    calculado_em TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (id_empresa, id_usuario, mes),
+    FOREIGN KEY (id_usuario) REFERENCES usuario(id_usuario)
+);
+
+CREATE INDEX idx_alertas_estouro_ranking ON alertas_estouro (mes, id_empresa, ranking);
+
+-- Resumo por usuário para o detalhamento paginado do dashboard (detalhe_usuarios.py).
+-- Janelas contadas a partir do último registro da empresa; atualizado com
+-- REFRESH MATERIALIZED VIEW CONCURRENTLY (exige o índice único em id_usuario).
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE MATERIALIZED VIEW resumo_consumo_usuario AS
+WITH ref AS (
+    SELECT id_empresa, MAX(data_uso) AS fim FROM log_uso_sim GROUP BY id_empresa
+)
+SELECT
+    u.id_usuario,
+    u.id_empresa,
+    u.id_departamento,
+    u.id_cargo,
+    u.nome,
+    COALESCE(SUM(l.consumo_dados_gb) FILTER (WHERE l.data_uso > r.fim - INTERVAL '7 days'), 0)::float AS consumo_7d,
+    COALESCE(SUM(l.consumo_dados_gb) FILTER (WHERE l.data_uso > r.fim - INTERVAL '30 days'), 0)::float AS consumo_30d,
+    COALESCE(SUM(l.consumo_dados_gb), 0)::float AS consumo_90d,
+    MAX(l.data_uso) AS ultimo_uso,
+    -- Momento do último REFRESH (o mesmo em todas as linhas): o dashboard mostra a defasagem
+    NOW()::timestamp AS atualizado_em
+FROM usuario u
+LEFT JOIN ref r ON r.id_empresa = u.id_empresa
+LEFT JOIN log_uso_sim l ON l.id_usuario = u.id_usuario
+    AND l.id_empresa = u.id_empresa
+    AND l.data_uso > r.fim - INTERVAL '90 days'
+GROUP BY u.id_usuario, u.id_empresa, u.id_departamento, u.id_cargo, u.nome;
+
+CREATE UNIQUE INDEX idx_resumo_usuario_id ON resumo_consumo_usuario (id_usuario);
+-- Paginação keyset: (empresa, chave de ordenação, id_usuario)
+CREATE INDEX idx_resumo_usuario_7d ON resumo_consumo_usuario (id_empresa, consumo_7d, id_usuario);
+CREATE INDEX idx_resumo_usuario_30d ON resumo_consumo_usuario (id_empresa, consumo_30d, id_usuario);
+CREATE INDEX idx_resumo_usuario_90d ON resumo_consumo_usuario (id_empresa, consumo_90d, id_usuario);
+CREATE INDEX idx_resumo_usuario_nome ON resumo_consumo_usuario (id_empresa, nome, id_usuario);
+-- Busca por trecho do nome (ILIKE '%...%')
+CREATE INDEX idx_resumo_usuario_nome_trgm ON resumo_consumo_usuario USING gin (nome gin_trgm_ops);
@@ -0,0 +1,283 @@
+# alertas_estouro.py
+import argparse
+import calendar
+import os
+import pickle
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import psycopg2
+from psycopg2.extras import execute_values
+
+from conexao import DB_PARAMS
+from kpis import FILTRO_EMPRESA
+from metricas import incr, timed
+from treina_lightgbm_db import CATEGORICAL_COLS, FEATURES
+
+MODEL_PATH = "modelo_lightgbm_consumo.pkl"
+# Dias anteriores à data de referência necessários para lag_30 / rolling_30
+CONTEXTO_DIAS = 30
+# Estouro projetado em até CRITICO_DIAS dias a partir da referência é crítico
+CRITICO_DIAS = 7
+TOP_ALERTAS = 10
+
+# Consumo diário por usuário no intervalo, com os atributos do último registro do dia
+HISTORY_QUERY = """
+SELECT
+    l.id_empresa,
+    l.id_usuario,
+    l.data_uso::date AS data_uso,
+    SUM(l.consumo_dados_gb)::float AS consumo,
+    (ARRAY_AGG(evt.nome_eventos ORDER BY l.data_uso DESC))[1] AS evento,
+    (ARRAY_AGG(disp.nome_dispositivo ORDER BY l.data_uso DESC))[1] AS dispositivo,
+    (ARRAY_AGG(s.situacao ORDER BY l.data_uso DESC))[1] AS situacao
+FROM log_uso_sim l
+JOIN eventos_especiais evt ON l.id_evento = evt.id_evento
+JOIN dispositivos disp ON l.id_dispositivo = disp.id_dispositivo
+JOIN situacao s ON l.id_situacao = s.id_situacao
+WHERE l.id_empresa = ANY(%(empresas)s)
+  AND l.data_uso >= %(inicio)s AND l.data_uso < %(fim)s::date + 1
+GROUP BY l.id_empresa, l.id_usuario, l.data_uso::date;
+"""
+
+USERS_QUERY = """
+SELECT u.id_usuario, dep.nome AS departamento, c.nome AS cargo, c.limite_gigas::float AS limite_gigas
+FROM usuario u
+JOIN departamentos dep ON u.id_departamento = dep.id_departamento
+JOIN cargos c ON u.id_cargo = c.id_cargo
+WHERE c.limite_gigas IS NOT NULL;
+"""
+
+ALERTS_QUERY = f"""
+SELECT
+    a.ranking,
+    u.nome AS usuario,
+    dep.nome AS departamento,
+    c.nome AS cargo,
+    a.severidade,
+    a.data_estouro,
+    a.dias_para_estouro,
+    a.consumo_mes_gb,
+    a.projecao_mes_gb,
+    a.limite_gb,
+    a.excedente_projetado_gb
+FROM alertas_estouro a
+JOIN usuario u ON a.id_usuario = u.id_usuario
+JOIN departamentos dep ON u.id_departamento = dep.id_departamento
+JOIN cargos c ON u.id_cargo = c.id_cargo
+WHERE {FILTRO_EMPRESA.format(col='a.id_empresa')}
+  AND a.mes = (SELECT MAX(mes) FROM alertas_estouro WHERE {FILTRO_EMPRESA.format(col='id_empresa')})
+ORDER BY a.ranking, a.id_empresa
+LIMIT %(limite)s;
+"""
+
+ALERT_COLS = [
+    "id_empresa", "id_usuario", "mes", "ranking", "severidade", "data_estouro", "dias_para_estouro",
+    "consumo_mes_gb", "projecao_mes_gb", "limite_gb", "excedente_projetado_gb", "data_referencia",
+]
+
+
+def reference_dates(cursor):
+    """
+    Último dia com registros de cada empresa: os dados são simulados, então "hoje" vem do
+    próprio log, e uma empresa cujo log termina antes não é avaliada no mês de outra.
+    Retorna {data de referência: [id_empresa, ...]}.
+    """
+    cursor.execute("SELECT id_empresa, MAX(data_uso)::date FROM log_uso_sim GROUP BY id_empresa;")
+    por_data = {}
+    for id_empresa, ref in cursor.fetchall():
+        por_data.setdefault(ref, []).append(id_empresa)
+    return por_data
+
+
+def load_model(path=MODEL_PATH):
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+@timed("alertas.matriz")
+def build_matrix(df_daily, df_users, inicio, ref):
+    """
+    Matriz usuários x dias (inicio..ref, dias sem registro = 0) e os atributos de cada
+    usuário (último dia com registro). Só entram usuários com plano definido.
+    """
+    dias = pd.date_range(inicio, ref)
+    df_daily = df_daily.assign(data_uso=pd.to_datetime(df_daily['data_uso']))
+    matriz = (df_daily.pivot_table(index='id_usuario', columns='data_uso', values='consumo', aggfunc='sum')
+              .reindex(columns=dias).fillna(0.0))
+    ultimo = df_daily.sort_values('data_uso').groupby('id_usuario').last()
+    meta = ultimo[['id_empresa', 'evento', 'dispositivo', 'situacao']].join(
+        df_users.set_index('id_usuario'), how='inner'
+    )
+    matriz = matriz.loc[meta.index]
+    return matriz, meta.loc[matriz.index]
+
+
+@timed("alertas.previsao")
+def forecast_fleet(historico, meta, future_dates, modelo):
+    """
+    Previsão diária de todos os usuários de uma vez: a recursão é por dia (uma chamada
+    ao modelo por dia restante do mês), não por usuário. Mesmas features de forecast_user,
+    sem o ruído de simulação (aqui interessa o valor esperado).
+    Sem modelo, projeta a média dos últimos 7 dias.
+    """
+    n, h = historico.shape
+    buf = np.zeros((n, h + len(future_dates)))
+    buf[:, :h] = historico
+    if modelo is None:
+        buf[:, h:] = historico[:, -7:].mean(axis=1)[:, None]
+        return buf[:, h:]
+
+    base = pd.DataFrame({c: meta[c].astype('category').values for c in CATEGORICAL_COLS})
+    for i, dia in enumerate(future_dates):
+        t = h + i
+        X = base.assign(
+            year=dia.year, month=dia.month, day=dia.day, dayofweek=dia.dayofweek,
+            weekofyear=dia.isocalendar()[1], is_weekend=int(dia.dayofweek >= 5),
+            lag_1=buf[:, t - 1], lag_7=buf[:, t - 7], lag_30=buf[:, t - 30],
+            rolling_7=buf[:, t - 7:t].mean(axis=1), rolling_30=buf[:, t - 30:t].mean(axis=1),
+        )
+        buf[:, t] = np.clip(modelo.predict(X[FEATURES]), 0, None)
+    incr("predict_chamadas", len(future_dates), modo="alertas")
+    incr("linhas_previstas", n * len(future_dates), modo="alertas")
+    return buf[:, h:]
+
+
+def first_crossing(acumulado, limite):
+    # Índice da primeira coluna em que o acumulado passa do limite (-1 se não passar)
+    acima = acumulado > limite[:, None]
+    return np.where(acima.any(axis=1), acima.argmax(axis=1), -1)
+
+
+@timed("alertas.calculo")
+def compute_alerts(matriz, meta, ref, modelo):
+    """
+    Acumulado do mês até `ref` (real) seguido do acumulado projetado até o fim do mês.
+    Retorna um DataFrame só com os usuários que já passaram ou vão passar do plano,
+    ranqueados por empresa: primeiro quem estoura antes, depois o maior excedente.
+    """
+    mes = ref.replace(day=1)
+    fim_mes = ref.replace(day=calendar.monthrange(ref.year, ref.month)[1])
+    future_dates = pd.date_range(ref + timedelta(days=1), fim_mes)
+    dias_mes = matriz.columns[matriz.columns >= pd.Timestamp(mes)]
+    limite = meta['limite_gigas'].to_numpy(float)
+
+    acum_real = matriz[dias_mes].to_numpy().cumsum(axis=1)
+    consumo_mes = acum_real[:, -1]
+    previsto = forecast_fleet(matriz.to_numpy(), meta, future_dates, modelo)
+    acum_proj = consumo_mes[:, None] + previsto.cumsum(axis=1)
+    projecao = acum_proj[:, -1] if len(future_dates) else consumo_mes
+
+    idx_real = first_crossing(acum_real, limite)
+    idx_proj = first_crossing(acum_proj, limite) if len(future_dates) else np.full(len(limite), -1)
+    # Estouro já ocorrido prevalece sobre o projetado
+    estouro = np.full(len(limite), None, dtype=object)
+    projetado, real = idx_proj >= 0, idx_real >= 0
+    estouro[projetado] = np.asarray(future_dates.date)[idx_proj[projetado]]
+    estouro[real] = np.asarray(dias_mes.date)[idx_real[real]]
+
+    df = pd.DataFrame({
+        "id_empresa": meta['id_empresa'].to_numpy(),
+        "id_usuario": matriz.index.to_numpy(),
+        "mes": mes,
+        "data_estouro": estouro,
+        "consumo_mes_gb": consumo_mes.round(3),
+        "projecao_mes_gb": np.maximum(projecao, consumo_mes).round(3),
+        "limite_gb": limite,
+        "data_referencia": ref,
+    })
+    df = df[df['data_estouro'].notna()].copy()
+    df['excedente_projetado_gb'] = (df['projecao_mes_gb'] - df['limite_gb']).clip(lower=0).round(3)
+    df['dias_para_estouro'] = [(d - ref).days for d in df['data_estouro']]
+    df['severidade'] = np.select(
+        [df['dias_para_estouro'] <= 0, df['dias_para_estouro'] <= CRITICO_DIAS],
+        ["ESTOURADO", "CRITICO"], "AVISO"
+    )
+    df = df.sort_values(['id_empresa', 'data_estouro', 'excedente_projetado_gb'], ascending=[True, True, False])
+    df['ranking'] = df.groupby('id_empresa').cumcount() + 1
+    return df[ALERT_COLS].reset_index(drop=True)
+
+
+def refresh_alerts(conn, ref=None, model_path=MODEL_PATH):
+    """
+    Recalcula os alertas de cada empresa no mês da sua data de referência (padrão: último dia
+    do log da empresa; `ref` vale para todas) e substitui os desse mês da empresa, tudo numa
+    transação. Empresas com a mesma referência são calculadas juntas, numa só matriz.
+    Retorna o nº de alertas gravados.
+    """
+    cursor = conn.cursor()
+    por_data = reference_dates(cursor)
+    por_data.pop(None, None)
+    if ref is not None and por_data:
+        por_data = {ref: [e for empresas in por_data.values() for e in empresas]}
+    if not por_data:
+        print("[OK] Log vazio, nenhum alerta calculado.")
+        cursor.close()
+        return 0
+
+    df_users = pd.read_sql_query(USERS_QUERY, conn)
+    modelo = load_model(model_path)
+    if modelo is None:
+        print(f"[ERRO] {model_path} não encontrado: projetando pela média dos últimos 7 dias.")
+
+    total = 0
+    for ref_empresas, empresas in sorted(por_data.items()):
+        inicio = min(ref_empresas.replace(day=1), ref_empresas - timedelta(days=CONTEXTO_DIAS - 1))
+        df_daily = pd.read_sql_query(HISTORY_QUERY, conn, params={
+            "empresas": empresas, "inicio": inicio, "fim": ref_empresas
+        })
+        df_alerts = pd.DataFrame(columns=ALERT_COLS)
+        n_usuarios = 0
+        if not df_daily.empty and not df_users.empty:
+            matriz, meta = build_matrix(df_daily, df_users, inicio, ref_empresas)
+            n_usuarios = len(matriz)
+            if n_usuarios:
+                df_alerts = compute_alerts(matriz, meta, ref_empresas, modelo)
+
+        # Só o mês das próprias empresas: as outras podem estar em outro mês
+        cursor.execute("DELETE FROM alertas_estouro WHERE mes = %s AND id_empresa = ANY(%s);",
+                       (ref_empresas.replace(day=1), empresas))
+        if not df_alerts.empty:
+            execute_values(cursor, f"INSERT INTO alertas_estouro ({', '.join(ALERT_COLS)}) VALUES %s;",
+                           list(df_alerts.astype(object).itertuples(index=False, name=None)), page_size=5000)
+        n_estourados = int((df_alerts['severidade'] == "ESTOURADO").sum())
+        print(f"[OK] {len(df_alerts)} alertas para {ref_empresas:%m/%Y} ({n_estourados} já acima do plano) "
+              f"entre {n_usuarios} usuários de {len(empresas)} empresa(s).")
+        total += len(df_alerts)
+
+    conn.commit()
+    cursor.close()
+    return total
+
+
+def fetch_alerts(conn, id_empresa=None, limite=TOP_ALERTAS):
+    # Alertas mais urgentes do último mês calculado (card "Alertas de Excesso")
+    return pd.read_sql_query(ALERTS_QUERY, conn, params={"id_empresa": id_empresa, "limite": limite})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Alertas de estouro do plano no mês, com a data projetada.")
+    parser.add_argument("--data-ref", type=lambda s: datetime.strptime(s, "%Y-%m-%d").date(),
+                        help="Data de referência (AAAA-MM-DD) para todas as empresas; padrão: último dia do log de cada uma.")
+    parser.add_argument("--modelo", default=MODEL_PATH, help="Modelo diário usado na projeção.")
+    parser.add_argument("--mostrar", type=int, default=0, metavar="N", help="Lista os N alertas mais urgentes.")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**DB_PARAMS)
+    try:
+        refresh_alerts(conn, args.data_ref, args.modelo)
+        if args.mostrar:
+            print(fetch_alerts(conn, limite=args.mostrar).to_string(index=False))
+    except Exception as e:
+        conn.rollback()
+        print("[ERRO] Falha ao calcular os alertas de estouro:", e)
+        raise
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
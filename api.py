@@ -0,0 +1,367 @@
+# api.py
+import argparse
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from datetime import date
+
+import pandas as pd
+from psycopg2.pool import ThreadedConnectionPool
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from conexao import DB_PARAMS
+from exportacao import FORMATOS_EXPORTACAO, export_filename, stream_export
+from faturamento import NIVEIS_FATURAMENTO, fetch_billing, parse_month
+from kpis import AGGREGATE_DIMENSIONS, fetch_aggregate, fetch_kpis, fetch_location_aggregate
+from metricas import incr, registry, span
+
+# --- CONFIGURAÇÃO ---
+POOL_MIN = int(os.getenv("FULLTIME_API_POOL_MIN", "2"))
+POOL_MAX = int(os.getenv("FULLTIME_API_POOL_MAX", "10"))
+RESPONSE_CACHE_ENTRIES = 512
+TTL_KPIS = 30
+TTL_AGREGADOS = 300
+TTL_PREVISAO = 600
+TTL_FATURAMENTO = 300
+# Exportações seguram uma conexão do pool durante todo o download: no máximo estas ao
+# mesmo tempo (as demais esperam), para sobrar pool para os outros endpoints
+EXPORTACOES_SIMULTANEAS = int(os.getenv("FULLTIME_API_EXPORTACOES", "2"))
+
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+MODOS_API = {"recursivo": "MODO_RECURSIVO", "direto": "MODO_DIRETO", "hierarquico": "MODO_HIERARQUICO"}
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+# --- BANCO ---
+_pool = None
+# O pool levanta erro quando esgota; o semáforo faz as threads excedentes esperarem
+_pool_slots = threading.BoundedSemaphore(POOL_MAX)
+_export_slots = threading.BoundedSemaphore(max(1, min(EXPORTACOES_SIMULTANEAS, POOL_MAX - 1)))
+
+
+@contextmanager
+def borrow_conn():
+    with _pool_slots:
+        conn = _pool.getconn()
+        try:
+            yield conn
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            _pool.putconn(conn)
+
+
+# --- CACHE DE RESPOSTAS ---
+class ResponseCache:
+    """
+    LRU em memória de respostas já serializadas, com TTL por entrada.
+    Requisições iguais simultâneas esperam a mesma computação (uma ida ao banco por chave).
+    """
+
+    def __init__(self, max_entries=RESPONSE_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.inflight = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get_or_compute(self, key, compute, ttl):
+        entry = self.entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            self.entries.move_to_end(key)
+            self.hits += 1
+            incr("cache_respostas", resultado="acerto")
+            return entry[1]
+        self.misses += 1
+        incr("cache_respostas", resultado="erro")
+
+        if key in self.inflight:
+            return await asyncio.shield(self.inflight[key])
+
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        try:
+            value = await compute()
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # evita o aviso de exceção não consumida se ninguém estiver esperando
+            raise
+        finally:
+            self.inflight.pop(key, None)
+        future.set_result(value)
+
+        self.entries[key] = (time.monotonic() + ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return value
+
+
+_responses = ResponseCache()
+
+
+def parse_empresa(request):
+    # Empresa (tenant) da requisição; None = plataforma inteira
+    valor = request.query_params.get("empresa")
+    if valor is None:
+        return None
+    if not valor.isdigit():
+        raise ApiError(400, "empresa deve ser o id numérico da empresa")
+    return int(valor)
+
+
+# --- SERIALIZAÇÃO ---
+def wants_arrow(request):
+    formato = request.query_params.get("formato")
+    if formato:
+        return formato == "arrow"
+    return ARROW_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def serialize(df, arrow):
+    """
+    DataFrame -> (corpo, media type). Arrow IPC (stream) ou JSON orientado a registros.
+    """
+    if arrow:
+        import pyarrow as pa
+
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes(), ARROW_MEDIA_TYPE
+    return df.to_json(orient="records", date_format="iso", force_ascii=False).encode("utf-8"), "application/json"
+
+
+async def cached_response(request, compute_df, ttl):
+    arrow = wants_arrow(request)
+    key = (request.url.path, tuple(sorted(request.query_params.multi_items())), arrow)
+
+    def compute_timed():
+        with span(f"api{request.url.path}"):
+            return compute_df()
+
+    async def compute():
+        df = await run_in_threadpool(compute_timed)
+        return serialize(df, arrow)
+
+    try:
+        body, media_type = await _responses.get_or_compute(key, compute, ttl)
+    except ApiError as e:
+        return JSONResponse({"erro": str(e)}, status_code=e.status)
+    return Response(body, media_type=media_type, headers={"Cache-Control": f"max-age={ttl}"})
+
+
+# --- ENDPOINTS ---
+async def kpis(request):
+    try:
+        id_empresa = parse_empresa(request)
+    except ApiError as e:
+        return JSONResponse({"erro": str(e)}, status_code=e.status)
+
+    def compute():
+        with borrow_conn() as conn:
+            return pd.DataFrame([fetch_kpis(conn, id_empresa)])
+    return await cached_response(request, compute, TTL_KPIS)
+
+
+async def agregados(request):
+    dimensao = request.query_params.get("dimensao", "departamento")
+    if dimensao not in AGGREGATE_DIMENSIONS:
+        return JSONResponse({"erro": f"dimensao deve ser uma de {sorted(AGGREGATE_DIMENSIONS)}"}, status_code=400)
+    inicio = request.query_params.get("inicio")
+    fim = request.query_params.get("fim")
+    try:
+        id_empresa = parse_empresa(request)
+    except ApiError as e:
+        return JSONResponse({"erro": str(e)}, status_code=e.status)
+
+    def compute():
+        with borrow_conn() as conn:
+            return fetch_aggregate(conn, dimensao, inicio, fim, id_empresa)
+    return await cached_response(request, compute, TTL_AGREGADOS)
+
+
+async def localizacoes(request):
+    """
+    Consumo por localização com coordenadas. Parâmetros: empresa, inicio, fim (AAAA-MM-DD).
+    """
+    inicio = request.query_params.get("inicio")
+    fim = request.query_params.get("fim")
+    try:
+        id_empresa = parse_empresa(request)
+    except ApiError as e:
+        return JSONResponse({"erro": str(e)}, status_code=e.status)
+
+    def compute():
+        with borrow_conn() as conn:
+            return fetch_location_aggregate(conn, id_empresa, inicio, fim)
+    return await cached_response(request, compute, TTL_AGREGADOS)
+
+
+async def previsao(request):
+    """
+    Previsão mensal (mesmo cálculo e cache compartilhado do dashboard) seguida do histórico mensal.
+    Parâmetros: empresa, departamentos (separados por vírgula), cargo, horizonte (1-12), modo.
+    """
+    params = request.query_params
+    try:
+        id_empresa = parse_empresa(request)
+    except ApiError as e:
+        return JSONResponse({"erro": str(e)}, status_code=e.status)
+    departamentos = tuple(sorted(d for d in params.get("departamentos", "").split(",") if d))
+    cargo = params.get("cargo")
+    modo = params.get("modo", "direto")
+    try:
+        horizonte = int(params.get("horizonte", "6"))
+    except ValueError:
+        horizonte = 0
+    if id_empresa is None or not departamentos or not cargo or modo not in MODOS_API or not 1 <= horizonte <= 12:
+        return JSONResponse({"erro": "informe empresa, departamentos, cargo, horizonte (1-12) e modo "
+                                     f"({', '.join(MODOS_API)})"}, status_code=400)
+
+    def compute():
+        # Importa o dashboard só na primeira previsão: o restante da API não precisa do LightGBM
+        import dashboard
+
+        with borrow_conn() as conn:
+            try:
+                result = dashboard.cached_forecast(
+                    conn, id_empresa, departamentos, cargo, horizonte, getattr(dashboard, MODOS_API[modo])
+                )
+            except dashboard.ForecastUnavailable as e:
+                raise ApiError(404, str(e))
+        df = pd.concat([result['fc_monthly'], result['hist_monthly']], ignore_index=True)
+        return df.rename(columns={"Data": "data", "Consumo": "consumo", "Tipo": "tipo"})
+    return await cached_response(request, compute, TTL_PREVISAO)
+
+
+async def faturamento(request):
+    """
+    Faturamento mensal já materializado (faturamento.py) por usuário, departamento ou cargo.
+    Parâmetros: empresa, mes (AAAA-MM; padrão o mais recente), nivel.
+    """
+    nivel = request.query_params.get("nivel", "usuario")
+    if nivel not in NIVEIS_FATURAMENTO:
+        return JSONResponse({"erro": f"nivel deve ser um de {sorted(NIVEIS_FATURAMENTO)}"}, status_code=400)
+    try:
+        id_empresa = parse_empresa(request)
+        mes = parse_month(request.query_params.get("mes"))
+    except ApiError as e:
+        return JSONResponse({"erro": str(e)}, status_code=e.status)
+    except ValueError:
+        return JSONResponse({"erro": "mes deve estar no formato AAAA-MM"}, status_code=400)
+
+    def compute():
+        with borrow_conn() as conn:
+            return fetch_billing(conn, id_empresa, mes, nivel)
+    return await cached_response(request, compute, TTL_FATURAMENTO)
+
+
+def parse_lista(request, nome):
+    return [v for v in request.query_params.get(nome, "").split(",") if v]
+
+
+async def exportacao(request):
+    """
+    Registros de uso do filtro em CSV ou Parquet, enviados em pedaços enquanto são lidos
+    do cursor server-side (memória limitada a um lote). Sem cache: cada download lê o banco.
+    Parâmetros: empresa, formato (csv/parquet), departamentos, cargos (separados por vírgula),
+    inicio, fim (AAAA-MM-DD, inclusive).
+    """
+    params = request.query_params
+    formato = params.get("formato", "csv")
+    if formato not in FORMATOS_EXPORTACAO:
+        return JSONResponse({"erro": f"formato deve ser um de {sorted(FORMATOS_EXPORTACAO)}"}, status_code=400)
+    try:
+        id_empresa = parse_empresa(request)
+        inicio, fim = (params.get(p) for p in ("inicio", "fim"))
+        for valor in (inicio, fim):
+            if valor:
+                date.fromisoformat(valor)
+    except ApiError as e:
+        return JSONResponse({"erro": str(e)}, status_code=e.status)
+    except ValueError:
+        return JSONResponse({"erro": "inicio e fim devem estar no formato AAAA-MM-DD"}, status_code=400)
+    if id_empresa is None:
+        return JSONResponse({"erro": "informe a empresa"}, status_code=400)
+    departamentos, cargos = parse_lista(request, "departamentos"), parse_lista(request, "cargos")
+
+    def chunks():
+        # Iterado pelo Starlette no threadpool, um pedaço por vez; a conexão volta ao
+        # pool quando o download termina ou é cancelado
+        with _export_slots, borrow_conn() as conn:
+            incr("exportacoes", formato=formato)
+            for pedaco in stream_export(conn, formato, id_empresa, departamentos, cargos, inicio, fim):
+                incr("exportacao_bytes", len(pedaco), formato=formato)
+                yield pedaco
+
+    media_type, _ = FORMATOS_EXPORTACAO[formato]
+    nome = export_filename(id_empresa, formato, inicio, fim)
+    return StreamingResponse(chunks(), media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{nome}"'})
+
+
+async def saude(request):
+    return JSONResponse({
+        "status": "ok",
+        "cache_respostas": {"entradas": len(_responses.entries), "acertos": _responses.hits, "erros": _responses.misses},
+    })
+
+
+async def metricas(request):
+    # Formato texto do Prometheus; vazio se a API rodar sem FULLTIME_METRICAS=1
+    return PlainTextResponse(registry.prometheus_text(), media_type="text/plain; version=0.0.4")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global _pool
+    _pool = ThreadedConnectionPool(POOL_MIN, POOL_MAX, **DB_PARAMS)
+    try:
+        yield
+    finally:
+        _pool.closeall()
+
+
+app = Starlette(
+    routes=[
+        Route("/kpis", kpis),
+        Route("/agregados", agregados),
+        Route("/localizacoes", localizacoes),
+        Route("/previsao", previsao),
+        Route("/faturamento", faturamento),
+        Route("/exportacao", exportacao),
+        Route("/saude", saude),
+        Route("/metricas", metricas),
+    ],
+    lifespan=lifespan,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API HTTP (JSON/Arrow) de KPIs, agregados, previsões, faturamento e exportação.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--porta", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1, help="Processos uvicorn (cada um com seu pool).")
+    args = parser.parse_args()
+
+    import uvicorn
+    uvicorn.run("api:app", host=args.host, port=args.porta, workers=args.workers, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
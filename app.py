@@ -1,8 +1,5 @@
 import streamlit as st
 import os
-import pandas as pd
-import random
-from datetime import datetime
 
 # --- 1. CONFIGURAÇÃO DA PÁGINA ---
 st.set_page_config(
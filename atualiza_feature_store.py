@@ -0,0 +1,143 @@
+# atualiza_feature_store.py
+import argparse
+import psycopg2
+import pandas as pd
+from datetime import date
+from psycopg2.extras import execute_values
+
+from compactacao import uso_diario
+from conexao import DB_PARAMS
+from treina_lightgbm_db import feature_engineering
+
+# Registros anteriores ao watermark necessários para recalcular lag_30 / rolling_30
+CONTEXT_ROWS = 30
+
+STORE_COLS = [
+    "id_usuario", "data", "seq", "consumo_dados_gb",
+    "lag_1", "lag_7", "lag_30", "rolling_7", "rolling_30",
+    "cargo", "departamento", "evento", "dispositivo", "situacao"
+]
+
+# Mesmos registros e ordem do treino (treina_lightgbm_db.STREAM_QUERY): uma linha por registro,
+# com o histórico compactado em resolução diária. `seq` numera os registros do dia.
+# Contexto (últimos CONTEXT_ROWS registros antes de `desde`) + tudo a partir de `desde`,
+# só para usuários com registros novos.
+RECORDS_QUERY = f"""
+WITH novos AS (
+    SELECT DISTINCT id_usuario FROM log_uso_sim WHERE data_uso >= %(desde)s
+),
+registros AS (
+    SELECT
+        l.id_usuario,
+        l.data_uso,
+        l.consumo_dados_gb AS consumo,
+        ROW_NUMBER() OVER (
+            PARTITION BY l.id_usuario, l.data_uso::date ORDER BY l.data_uso, l.consumo_dados_gb
+        ) AS seq,
+        evt.nome_eventos AS evento,
+        disp.nome_dispositivo AS dispositivo,
+        s.situacao AS situacao
+    FROM {uso_diario()} l
+    JOIN novos n ON l.id_usuario = n.id_usuario
+    JOIN eventos_especiais evt ON l.id_evento = evt.id_evento
+    JOIN dispositivos disp ON l.id_dispositivo = disp.id_dispositivo
+    JOIN situacao s ON l.id_situacao = s.id_situacao
+),
+contexto AS (
+    SELECT r.*, ROW_NUMBER() OVER (
+        PARTITION BY r.id_usuario ORDER BY r.data_uso DESC, r.consumo DESC
+    ) AS rn
+    FROM registros r
+    WHERE r.data_uso < %(desde)s
+),
+selecao AS (
+    SELECT id_usuario, data_uso, consumo, seq, evento, dispositivo, situacao
+    FROM contexto WHERE rn <= %(contexto)s
+    UNION ALL
+    SELECT id_usuario, data_uso, consumo, seq, evento, dispositivo, situacao
+    FROM registros WHERE data_uso >= %(desde)s
+)
+SELECT
+    sel.data_uso,
+    sel.consumo::float AS consumo,
+    sel.seq,
+    u.id_usuario,
+    dep.nome AS departamento,
+    c.nome AS cargo,
+    sel.evento,
+    sel.dispositivo,
+    sel.situacao
+FROM selecao sel
+JOIN usuario u ON sel.id_usuario = u.id_usuario
+JOIN departamentos dep ON u.id_departamento = dep.id_departamento
+JOIN cargos c ON u.id_cargo = c.id_cargo
+ORDER BY u.id_usuario, sel.data_uso, sel.consumo;
+"""
+
+INSERT_QUERY = f"""
+INSERT INTO feature_store_consumo ({", ".join(STORE_COLS)})
+VALUES %s;
+"""
+
+
+def get_watermark(cursor):
+    cursor.execute("SELECT MAX(data) FROM feature_store_consumo;")
+    return cursor.fetchone()[0]
+
+
+def update_feature_store(conn, full=False):
+    """
+    Atualiza o feature store só para os dias novos.
+    O último dia já gravado é refeito (apagado e regravado), pois pode ter recebido registros
+    depois e a numeração `seq` dos registros do dia muda.
+    """
+    cursor = conn.cursor()
+    watermark = None if full else get_watermark(cursor)
+    desde = watermark if watermark else date(1900, 1, 1)
+
+    df = pd.read_sql_query(RECORDS_QUERY, conn, params={"desde": desde, "contexto": CONTEXT_ROWS})
+    if df.empty:
+        print("[OK] Nenhum dia novo para o feature store.")
+        cursor.close()
+        return 0
+
+    # Mesmas definições de lag/rolling (por registro) usadas no treino
+    df_fe = feature_engineering(df)
+    df_fe = df_fe[df_fe['data'] >= pd.Timestamp(desde)]
+    if df_fe.empty:
+        print("[OK] Nenhuma linha com histórico suficiente para os lags.")
+        cursor.close()
+        return 0
+
+    df_fe = df_fe.assign(data=df_fe['data'].dt.date)
+    rows = list(df_fe[STORE_COLS].itertuples(index=False, name=None))
+    cursor.execute(
+        "DELETE FROM feature_store_consumo WHERE id_usuario = ANY(%s) AND data >= %s;",
+        (sorted(int(u) for u in df_fe['id_usuario'].unique()), desde)
+    )
+    execute_values(cursor, INSERT_QUERY, rows, page_size=5000)
+    conn.commit()
+    cursor.close()
+    print(f"[OK] {len(rows)} linhas gravadas no feature store (a partir de {desde}).")
+    return len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Atualiza incrementalmente o feature store de consumo.")
+    parser.add_argument("--completo", action="store_true",
+                        help="Recalcula todo o histórico em vez de só os dias novos.")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**DB_PARAMS)
+    try:
+        update_feature_store(conn, full=args.completo)
+    except Exception as e:
+        conn.rollback()
+        print("[ERRO] Falha ao atualizar o feature store:", e)
+        raise
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+# benchmark_escala.py
+import argparse
+import json
+import os
+import pickle
+import re
+import sqlite3
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from popula_banco import (
+    HIERARQUIA_VALIDA, pesos_departamento, pesos_cargo, limites_cargo,
+    DISPOSITIVOS, SITUACOES, EVENTOS, ALERTAS, fake
+)
+
+DADOS_DIR = "bench_dados"
+RESULTS_PATH = "benchmark_escala_resultados.json"
+BASELINE_PATH = "benchmark_escala_baseline.json"
+MODEL_PATH = "modelo_lightgbm_consumo.pkl"
+
+# logs:usuarios — 10^7 / 100k gera um SQLite de alguns GB e leva vários minutos
+ESCALAS_PADRAO = "10000:50,100000:1000,1000000:10000"
+DIAS_HISTORICO = 540
+DATA_INICIO = pd.Timestamp("2024-01-01")
+HORIZONTE = 6
+# Muda o nome dos SQLite gerados quando o esquema muda (os antigos não são reaproveitados)
+ESQUEMA_VERSAO = 3
+
+
+# --- GERAÇÃO SINTÉTICA (mesmas distribuições do popula_banco.py, vetorizadas) ---
+def gerar_dataset(n_logs, n_usuarios, seed=42):
+    """
+    Retorna as tabelas do esquema (dict nome -> DataFrame) para uma empresa.
+    A autocorrelação com o dia anterior do popula_banco é aproximada em ordem (usuário, dia).
+    """
+    rng = np.random.default_rng(seed)
+    departamentos = list(HIERARQUIA_VALIDA)
+    cargos = sorted({c for lista in HIERARQUIA_VALIDA.values() for c in lista})
+    cidades = {}
+    for _ in range(200):
+        lat, lon, cidade, _, _ = fake.local_latlng(country_code="BR")
+        cidades[cidade] = (float(lat), float(lon))
+
+    dep_idx = rng.integers(0, len(departamentos), n_usuarios)
+    cargo_nome = [HIERARQUIA_VALIDA[departamentos[d]][rng.integers(0, len(HIERARQUIA_VALIDA[departamentos[d]]))]
+                  for d in dep_idx]
+    usuario = pd.DataFrame({
+        "id_usuario": np.arange(1, n_usuarios + 1),
+        "nome": [f"Usuario {i:06d}" for i in range(1, n_usuarios + 1)],
+        "id_departamento": dep_idx + 1,
+        "id_cargo": [cargos.index(c) + 1 for c in cargo_nome],
+        "id_empresa": 1,
+    })
+
+    uid = rng.integers(0, n_usuarios, n_logs)
+    dias = rng.integers(0, DIAS_HISTORICO + 1, n_logs)
+    ordem = np.lexsort((dias, uid))
+    uid, dias = uid[ordem], dias[ordem]
+
+    base = rng.lognormal(mean=0.4, sigma=0.55, size=n_logs)
+    ajuste_dep = np.array([pesos_departamento.get(d, 1.0) for d in departamentos])[dep_idx[uid]]
+    ajuste_cg = np.array([pesos_cargo.get(c, 1.0) for c in cargo_nome])[uid]
+    data_uso = DATA_INICIO + pd.to_timedelta(dias, unit="D")
+    saz = np.where(data_uso.dayofweek < 5, 1.25, 0.75)
+    tendencia = 1 + dias * 0.002
+
+    ontem = np.r_[False, (uid[1:] == uid[:-1]) & (dias[1:] - dias[:-1] == 1)]
+    anterior = np.r_[base[:1], base[:-1]]
+    consumo = base + 0.3 * np.where(ontem, anterior, base)
+    consumo = np.maximum(np.round(consumo * ajuste_dep * ajuste_cg * saz * tendencia, 2), 0.01)
+
+    log = pd.DataFrame({
+        "id_log": np.arange(1, n_logs + 1),
+        "id_empresa": 1,
+        "id_usuario": uid + 1,
+        "id_situacao": rng.integers(1, len(SITUACOES) + 1, n_logs),
+        "id_alerta": rng.integers(1, len(ALERTAS) + 1, n_logs),
+        "id_evento": rng.integers(1, len(EVENTOS) + 1, n_logs),
+        "id_dispositivo": rng.integers(1, len(DISPOSITIVOS) + 1, n_logs),
+        "data_uso": data_uso.strftime("%Y-%m-%d %H:%M:%S"),
+        "consumo_dados_gb": consumo,
+        "custo_total": np.round(consumo * rng.uniform(1.5, 3.5, n_logs), 2),
+        "id_localizacao": rng.integers(1, len(cidades) + 1, n_logs),
+    })
+
+    return {
+        "empresas": pd.DataFrame({"id_empresa": [1], "nome": ["Empresa X"]}),
+        "departamentos": pd.DataFrame({"id_departamento": range(1, len(departamentos) + 1), "nome": departamentos}),
+        "cargos": pd.DataFrame({"id_cargo": range(1, len(cargos) + 1), "nome": cargos,
+                                "limite_gigas": [limites_cargo.get(c, 50.0) for c in cargos]}),
+        "situacao": pd.DataFrame({"id_situacao": range(1, len(SITUACOES) + 1), "situacao": SITUACOES}),
+        "eventos_especiais": pd.DataFrame({"id_evento": range(1, len(EVENTOS) + 1), "nome_eventos": EVENTOS}),
+        "dispositivos": pd.DataFrame({"id_dispositivo": range(1, len(DISPOSITIVOS) + 1),
+                                      "nome_dispositivo": DISPOSITIVOS}),
+        "localizacoes": pd.DataFrame({"id_localizacao": range(1, len(cidades) + 1), "nome": list(cidades),
+                                      "latitude": [c[0] for c in cidades.values()],
+                                      "longitude": [c[1] for c in cidades.values()]}),
+        "usuario": usuario,
+        "log_uso_sim": log,
+        # Histórico compactado (compactacao.py) vazio: o stand-in é todo bruto, mas as
+        # consultas do dashboard leem a união
+        "log_uso_diario": log.iloc[:0][["id_empresa", "id_usuario", "data_uso", "consumo_dados_gb", "custo_total",
+                                        "id_evento", "id_dispositivo", "id_situacao", "id_localizacao"]]
+                          .assign(registros=pd.Series(dtype="int64")),
+        "log_uso_mensal": log.iloc[:0][["id_empresa", "id_usuario", "data_uso", "consumo_dados_gb", "custo_total"]]
+                          .assign(registros=pd.Series(dtype="int64")),
+    }
+
+
+def build_standin(n_logs, n_usuarios, seed=42):
+    """
+    Banco SQLite em arquivo com o mesmo esquema do PostgreSQL, reaproveitado entre execuções.
+    """
+    os.makedirs(DADOS_DIR, exist_ok=True)
+    path = os.path.join(DADOS_DIR, f"escala_v{ESQUEMA_VERSAO}_{n_logs}_{n_usuarios}_{seed}.sqlite")
+    if os.path.exists(path):
+        return path
+    tmp = path + ".tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    conn = sqlite3.connect(tmp)
+    for nome, df in gerar_dataset(n_logs, n_usuarios, seed).items():
+        df.to_sql(nome, conn, index=False, chunksize=100_000)
+    conn.execute("CREATE INDEX idx_log_uso_data ON log_uso_sim (id_empresa, data_uso);")
+    conn.commit()
+    conn.close()
+    os.replace(tmp, path)
+    return path
+
+
+def to_sqlite(query):
+    # Placeholders do psycopg2 (%(nome)s) -> sqlite3 (:nome)
+    return re.sub(r"%\((\w+)\)s", r":\1", query)
+
+
+# --- ESTÁGIOS ---
+def load_forecast_model(df_fe):
+    # Modelo de produção se existir; senão um modelo pequeno treinado na amostra
+    if os.path.exists(MODEL_PATH):
+        with open(MODEL_PATH, "rb") as f:
+            return pickle.load(f)
+    import lightgbm as lgb
+    from treina_lightgbm_db import FEATURES, TARGET, CATEGORICAL_COLS
+
+    amostra = df_fe.sample(min(len(df_fe), 200_000), random_state=0).copy()
+    for c in CATEGORICAL_COLS:
+        amostra[c] = amostra[c].astype("category")
+    return lgb.LGBMRegressor(n_estimators=200, random_state=42, verbose=-1).fit(
+        amostra[FEATURES], amostra[TARGET], categorical_feature=CATEGORICAL_COLS
+    )
+
+
+def build_stages(db_path, max_usuarios_previsao):
+    """
+    Lista de (nome, função, unidade, preparo) na ordem do dashboard. Cada função devolve a
+    quantidade processada (linhas ou usuários) para o cálculo de vazão. O estado entre
+    estágios fica em `ctx`; `preparo` roda depois do estágio, fora das medições.
+    """
+    import dashboard
+    from composicao import compute_composition
+    from previsao import forecast_recursive
+    from treina_lightgbm_db import feature_engineering
+
+    ctx = {}
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    params = {"id_empresa": 1}
+
+    def carga_principal():
+        ctx["main"] = dashboard.prepare_main_frame(pd.read_sql_query(to_sqlite(dashboard.MAIN_QUERY), conn, params=params))
+        return len(ctx["main"])
+
+    def carga_ml():
+        ctx["ml"] = pd.read_sql_query(to_sqlite(dashboard.ML_QUERY), conn, params=params)
+        # Filtro do dashboard: o maior grupo departamento x cargo
+        grupo = ctx["ml"].groupby(["departamento", "cargo"]).size().idxmax()
+        ctx["selecao"] = ctx["ml"][(ctx["ml"]["departamento"] == grupo[0]) & (ctx["ml"]["cargo"] == grupo[1])]
+        return len(ctx["ml"])
+
+    def engenharia_features():
+        ctx["fe"] = feature_engineering(ctx["ml"].copy())
+        return len(ctx["fe"])
+
+    def previsao():
+        fe_sel = dashboard.prepare_features(ctx["selecao"])
+        usuarios = fe_sel["id_usuario"].drop_duplicates().head(max_usuarios_previsao)
+        seeds = fe_sel[fe_sel["id_usuario"].isin(usuarios)]
+        np.random.seed(0)
+        fc = forecast_recursive(seeds, HORIZONTE, ctx["modelo"])
+        ctx["fc_mean"] = float(fc.mean()) if fc is not None else 0.0
+        hist = seeds.groupby("data")["consumo_dados_gb"].sum().resample("MS").sum().reset_index()
+        hist.columns = ["Data", "Consumo"]
+        ctx["hist"] = hist
+        return len(usuarios)
+
+    def composicao():
+        ctx["composicao"] = compute_composition(ctx["selecao"])
+        return len(ctx["selecao"])
+
+    def diagnostico():
+        dashboard.analyze_root_cause(ctx["hist"], ctx["fc_mean"], ctx["composicao"])
+        return 1
+
+    def preparar_previsao():
+        ctx["modelo"] = load_forecast_model(ctx["fe"])
+
+    return ctx, [
+        ("carga_principal", carga_principal, "linhas", None),
+        ("carga_ml", carga_ml, "linhas", None),
+        ("feature_engineering", engenharia_features, "linhas", preparar_previsao),
+        ("previsao_recursiva", previsao, "usuarios", None),
+        ("composicao", composicao, "linhas", None),
+        ("diagnostico", diagnostico, "chamadas", None),
+    ]
+
+
+def measure(func, repeticoes):
+    """
+    Mediana do tempo em `repeticoes` execuções e, numa execução à parte, o pico de
+    memória alocada (tracemalloc), para que o rastreamento não distorça o tempo.
+    """
+    tempos = []
+    for _ in range(repeticoes):
+        t = time.perf_counter()
+        quantidade = func()
+        tempos.append(time.perf_counter() - t)
+    tracemalloc.start()
+    func()
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(tempos), quantidade, pico / 1024 ** 2
+
+
+def run_scale(n_logs, n_usuarios, repeticoes, max_usuarios_previsao):
+    t = time.perf_counter()
+    db_path = build_standin(n_logs, n_usuarios)
+    print(f"\n[escala] {n_logs} logs / {n_usuarios} usuários (dados prontos em {time.perf_counter() - t:.1f}s)")
+
+    _, stages = build_stages(db_path, max_usuarios_previsao)
+    resultado = {}
+    for nome, func, unidade, preparo in stages:
+        tempo, quantidade, pico_mb = measure(func, repeticoes)
+        resultado[nome] = {
+            "tempo_s": tempo, "quantidade": quantidade, "unidade": unidade,
+            "vazao_por_s": quantidade / tempo if tempo > 0 else None, "pico_mb": pico_mb,
+        }
+        print(f"  {nome:22s} {tempo:9.3f}s  {quantidade / tempo if tempo > 0 else 0:14,.0f} {unidade}/s  "
+              f"pico {pico_mb:9.1f} MB")
+        if preparo:
+            preparo()
+    return resultado
+
+
+def compare(resultado, baseline, tolerancia_tempo, tolerancia_memoria):
+    """
+    Regressões: estágios mais lentos ou com pico de memória maior que o baseline além da tolerância.
+    """
+    regressoes = []
+    for escala, estagios in resultado["escalas"].items():
+        for nome, medida in estagios.items():
+            base = baseline.get("escalas", {}).get(escala, {}).get(nome)
+            if not base:
+                continue
+            if medida["tempo_s"] > base["tempo_s"] * (1 + tolerancia_tempo):
+                regressoes.append(f"{escala} {nome}: {medida['tempo_s']:.3f}s vs baseline {base['tempo_s']:.3f}s")
+            if medida["pico_mb"] > base["pico_mb"] * (1 + tolerancia_memoria):
+                regressoes.append(f"{escala} {nome}: pico {medida['pico_mb']:.1f} MB vs baseline {base['pico_mb']:.1f} MB")
+    return regressoes
+
+
+def parse_escalas(texto):
+    escalas = []
+    for item in texto.split(","):
+        logs, usuarios = item.split(":")
+        escalas.append((int(float(logs)), int(float(usuarios))))
+    return escalas
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de escala dos estágios de dados, features, previsão e diagnóstico.")
+    parser.add_argument("--escalas", default=ESCALAS_PADRAO,
+                        help="Lista logs:usuarios separada por vírgulas (ex.: 1e4:50,1e7:100000).")
+    parser.add_argument("--repeticoes", type=int, default=3)
+    parser.add_argument("--max-usuarios-previsao", type=int, default=50,
+                        help="Usuários do filtro previstos no estágio recursivo (vazão em usuários/s).")
+    parser.add_argument("--saida", default=RESULTS_PATH, help="Histórico de resultados (JSON).")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--gravar-baseline", action="store_true", help="Grava esta execução como baseline.")
+    parser.add_argument("--tolerancia-tempo", type=float, default=0.25)
+    parser.add_argument("--tolerancia-memoria", type=float, default=0.15)
+    args = parser.parse_args()
+
+    resultado = {"data": datetime.now().isoformat(timespec="seconds"), "python": sys.version.split()[0],
+                 "pandas": pd.__version__, "escalas": {}}
+    for n_logs, n_usuarios in parse_escalas(args.escalas):
+        resultado["escalas"][f"{n_logs}x{n_usuarios}"] = run_scale(
+            n_logs, n_usuarios, args.repeticoes, args.max_usuarios_previsao
+        )
+
+    regressoes = []
+    if args.gravar_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, ensure_ascii=False, indent=2)
+        print(f"\n[OK] Baseline gravado em {args.baseline}.")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressoes = compare(resultado, json.load(f), args.tolerancia_tempo, args.tolerancia_memoria)
+    resultado["regressoes"] = regressoes
+
+    try:
+        with open(args.saida, "r", encoding="utf-8") as f:
+            historico = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        historico = []
+    historico.append(resultado)
+    with open(args.saida, "w", encoding="utf-8") as f:
+        json.dump(historico, f, ensure_ascii=False, indent=2)
+
+    if regressoes:
+        print("\n[ERRO] Regressões em relação ao baseline:")
+        for r in regressoes:
+            print(f"  - {r}")
+        sys.exit(1)
+    print("\n[OK] Sem regressões.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+# benchmark_startup.py
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from datetime import datetime
+
+BUDGET_PATH = "startup_budget.json"
+RESULTS_PATH = "startup_resultados.json"
+
+# Cada medição roda num processo novo, como a partida de uma réplica
+IMPORT_SNIPPET = """
+import sys, time, json
+t = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - t
+print(json.dumps({{"tempo": elapsed, "carregados": [m for m in {lazy!r} if m in sys.modules]}}))
+"""
+
+PAGE_SNIPPET = """
+import time, json
+from streamlit.testing.v1 import AppTest
+t = time.perf_counter()
+at = AppTest.from_file({script!r}, default_timeout=120)
+at.run()
+elapsed = time.perf_counter() - t
+print(json.dumps({{"tempo": elapsed, "excecoes": [str(e.value) for e in at.exception]}}))
+"""
+
+
+def _run(snippet):
+    out = subprocess.run([sys.executable, "-c", snippet], capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def top_imports(module, n=10):
+    """
+    Módulos mais caros no import (tempo cumulativo de `python -X importtime`).
+    """
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                         capture_output=True, text=True)
+    custos = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulativo, nome = [p.strip() for p in line[len("import time:"):].split("|")]
+        custos.append((int(cumulativo) / 1e6, nome))
+    return sorted(custos, reverse=True)[:n]
+
+
+def run_benchmark(budget):
+    repeticoes = budget.get("repeticoes", 3)
+    lazy = budget.get("modulos_lazy", [])
+    resultado = {"data": datetime.now().isoformat(timespec="seconds"), "import_s": {}, "primeira_pagina_s": {}}
+    falhas = []
+
+    for module, limite in budget.get("import_s", {}).items():
+        medidas = [_run(IMPORT_SNIPPET.format(module=module, lazy=lazy)) for _ in range(repeticoes)]
+        tempo = statistics.median(m["tempo"] for m in medidas)
+        carregados = medidas[0]["carregados"]
+        resultado["import_s"][module] = tempo
+        print(f"[import] {module}: {tempo:.3f}s (limite {limite}s)")
+        if tempo > limite:
+            falhas.append(f"import {module} levou {tempo:.3f}s (limite {limite}s)")
+        if carregados:
+            falhas.append(f"import {module} carregou módulos que deveriam ser lazy: {', '.join(carregados)}")
+
+    for script, limite in budget.get("primeira_pagina_s", {}).items():
+        medidas = [_run(PAGE_SNIPPET.format(script=script)) for _ in range(repeticoes)]
+        tempo = statistics.median(m["tempo"] for m in medidas)
+        resultado["primeira_pagina_s"][script] = tempo
+        print(f"[página] {script}: {tempo:.3f}s (limite {limite}s)")
+        if tempo > limite:
+            falhas.append(f"primeira página de {script} levou {tempo:.3f}s (limite {limite}s)")
+        if medidas[0]["excecoes"]:
+            falhas.append(f"{script} gerou exceções: {medidas[0]['excecoes']}")
+
+    resultado["falhas"] = falhas
+    return resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mede o tempo de partida do app e compara com o orçamento.")
+    parser.add_argument("--orcamento", default=BUDGET_PATH, help="Arquivo JSON com os limites.")
+    parser.add_argument("--saida", default=RESULTS_PATH, help="Histórico de resultados (JSON).")
+    parser.add_argument("--detalhar", metavar="MODULO", help="Lista os imports mais caros de MODULO.")
+    args = parser.parse_args()
+
+    if args.detalhar:
+        for segundos, nome in top_imports(args.detalhar):
+            print(f"{segundos:8.3f}s  {nome}")
+        return
+
+    with open(args.orcamento, "r", encoding="utf-8") as f:
+        budget = json.load(f)
+    resultado = run_benchmark(budget)
+
+    try:
+        with open(args.saida, "r", encoding="utf-8") as f:
+            historico = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        historico = []
+    historico.append(resultado)
+    with open(args.saida, "w", encoding="utf-8") as f:
+        json.dump(historico, f, ensure_ascii=False, indent=2)
+
+    if resultado["falhas"]:
+        print("\n[ERRO] Orçamento de partida estourado:")
+        for falha in resultado["falhas"]:
+            print(f"  - {falha}")
+        sys.exit(1)
+    print("\n[OK] Partida dentro do orçamento.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+# cache_compartilhado.py
+import argparse
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+
+from metricas import incr
+
+# --- CONFIGURAÇÃO ---
+# FULLTIME_CACHE=sqlite (padrão) usa um arquivo SQLite compartilhado pelos processos do host;
+# FULLTIME_CACHE=nenhum desliga a camada (só sobra o st.cache_data de cada processo).
+CACHE_BACKEND = os.getenv("FULLTIME_CACHE", "sqlite")
+CACHE_PATH = os.getenv("FULLTIME_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache_compartilhado.db"))
+CACHE_MAX_BYTES = int(float(os.getenv("FULLTIME_CACHE_MAX_MB", "512")) * 1024 * 1024)
+LEASE_SEGUNDOS = 120      # tempo máximo de um carregamento antes de outro processo assumir
+ESPERA_INTERVALO = 0.1
+
+
+class SQLiteCache:
+    """
+    Cache chave -> valor (pickle) num arquivo SQLite em modo WAL, visível para todas as
+    réplicas do host. Limite em bytes com despejo LRU, carregamento single-flight
+    (só um processo recalcula uma chave expirada) e contadores de acerto/erro.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_bytes=CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.dono = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._local = threading.local()
+        self._setup()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL;")
+            conn.execute("PRAGMA synchronous=NORMAL;")
+            self._local.conn = conn
+        return conn
+
+    def _setup(self):
+        conn = self._conn()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS entradas (
+                chave TEXT PRIMARY KEY,
+                valor BLOB NOT NULL,
+                tamanho INTEGER NOT NULL,
+                expira_em REAL NOT NULL,
+                ultimo_acesso REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_entradas_acesso ON entradas (ultimo_acesso);
+            CREATE TABLE IF NOT EXISTS carregando (
+                chave TEXT PRIMARY KEY,
+                dono TEXT NOT NULL,
+                desde REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS contadores (
+                nome TEXT PRIMARY KEY,
+                valor INTEGER NOT NULL
+            );
+        """)
+
+    def _incr(self, nome, n=1):
+        self._conn().execute("""
+            INSERT INTO contadores (nome, valor) VALUES (?, ?)
+            ON CONFLICT (nome) DO UPDATE SET valor = valor + excluded.valor;
+        """, (nome, n))
+
+    def get(self, chave):
+        """
+        Retorna (encontrado, valor). Entradas expiradas contam como ausentes.
+        """
+        conn = self._conn()
+        agora = time.time()
+        row = conn.execute("SELECT valor, expira_em FROM entradas WHERE chave = ?;", (chave,)).fetchone()
+        if row is None or row[1] < agora:
+            return False, None
+        conn.execute("UPDATE entradas SET ultimo_acesso = ? WHERE chave = ?;", (agora, chave))
+        return True, pickle.loads(row[0])
+
+    def set(self, chave, valor, ttl):
+        blob = pickle.dumps(valor, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(blob) > self.max_bytes:
+            # Maior que o cache inteiro: não vale a pena guardar
+            self._incr("rejeitados")
+            return
+        agora = time.time()
+        conn = self._conn()
+        conn.execute("""
+            INSERT INTO entradas (chave, valor, tamanho, expira_em, ultimo_acesso) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (chave) DO UPDATE SET
+                valor = excluded.valor, tamanho = excluded.tamanho,
+                expira_em = excluded.expira_em, ultimo_acesso = excluded.ultimo_acesso;
+        """, (chave, blob, len(blob), agora + ttl, agora))
+        self._evict()
+
+    def _evict(self):
+        # Remove expiradas e depois as menos acessadas até caber no limite
+        conn = self._conn()
+        conn.execute("DELETE FROM entradas WHERE expira_em < ?;", (time.time(),))
+        total = conn.execute("SELECT COALESCE(SUM(tamanho), 0) FROM entradas;").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        removidos = 0
+        for chave, tamanho in conn.execute("SELECT chave, tamanho FROM entradas ORDER BY ultimo_acesso;").fetchall():
+            if total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM entradas WHERE chave = ?;", (chave,))
+            total -= tamanho
+            removidos += 1
+        self._incr("despejos", removidos)
+
+    def _acquire(self, chave):
+        conn = self._conn()
+        agora = time.time()
+        cur = conn.execute("""
+            INSERT INTO carregando (chave, dono, desde) VALUES (?, ?, ?)
+            ON CONFLICT (chave) DO UPDATE SET dono = excluded.dono, desde = excluded.desde
+            WHERE carregando.desde < ?;
+        """, (chave, self.dono, agora, agora - LEASE_SEGUNDOS))
+        return cur.rowcount == 1
+
+    def _release(self, chave):
+        self._conn().execute("DELETE FROM carregando WHERE chave = ? AND dono = ?;", (chave, self.dono))
+
+    def _loading(self, chave):
+        row = self._conn().execute("SELECT desde FROM carregando WHERE chave = ?;", (chave,)).fetchone()
+        return row is not None and row[0] >= time.time() - LEASE_SEGUNDOS
+
+    def get_or_load(self, chave, loader, ttl):
+        """
+        Single-flight: no erro de cache, só quem obtém a "lease" da chave executa `loader`;
+        os demais processos esperam o valor aparecer (ou a lease vencer).
+        """
+        encontrado, valor = self.get(chave)
+        if encontrado:
+            self._incr("acertos")
+            incr("cache_compartilhado", resultado="acerto")
+            return valor
+        self._incr("erros")
+        incr("cache_compartilhado", resultado="erro")
+
+        while True:
+            if self._acquire(chave):
+                try:
+                    encontrado, valor = self.get(chave)
+                    if not encontrado:
+                        valor = loader()
+                        self.set(chave, valor, ttl)
+                        self._incr("carregamentos")
+                    return valor
+                finally:
+                    self._release(chave)
+
+            self._incr("esperas")
+            while self._loading(chave):
+                time.sleep(ESPERA_INTERVALO)
+            encontrado, valor = self.get(chave)
+            if encontrado:
+                return valor
+
+    def stats(self):
+        conn = self._conn()
+        stats = dict(conn.execute("SELECT nome, valor FROM contadores;").fetchall())
+        entradas, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(tamanho), 0) FROM entradas;").fetchone()
+        stats.update({"entradas": entradas, "bytes": total, "limite_bytes": self.max_bytes})
+        return stats
+
+    def clear(self):
+        conn = self._conn()
+        conn.execute("DELETE FROM entradas;")
+        conn.execute("DELETE FROM carregando;")
+        conn.execute("DELETE FROM contadores;")
+
+
+class NullCache:
+    # Backend desligado: sempre carrega
+    def get_or_load(self, chave, loader, ttl):
+        return loader()
+
+    def stats(self):
+        return {}
+
+    def clear(self):
+        pass
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = SQLiteCache() if CACHE_BACKEND == "sqlite" else NullCache()
+    return _cache
+
+
+def make_key(prefix, *parts):
+    return prefix + ":" + hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()
+
+
+def shared_cache(ttl):
+    """
+    Decorador no estilo do st.cache_data: a chave usa o nome da função e os argumentos,
+    ignorando os que começam com "_" (ex.: a conexão `_conn`).
+    """
+    def decorator(func):
+        assinatura = inspect.signature(func)
+        prefixo = f"{func.__module__}.{func.__qualname__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = assinatura.bind(*args, **kwargs)
+            bound.apply_defaults()
+            chave_args = tuple((k, v) for k, v in bound.arguments.items() if not k.startswith("_"))
+            chave = make_key(prefixo, chave_args)
+            return get_cache().get_or_load(chave, lambda: func(*args, **kwargs), ttl)
+        return wrapper
+    return decorator
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspeciona o cache compartilhado entre réplicas.")
+    parser.add_argument("--limpar", action="store_true", help="Remove todas as entradas e zera os contadores.")
+    args = parser.parse_args()
+
+    cache = get_cache()
+    if args.limpar:
+        cache.clear()
+        print("[OK] Cache limpo.")
+    for nome, valor in sorted(cache.stats().items()):
+        print(f"{nome}: {valor}")
+
+
+if __name__ == "__main__":
+    main()
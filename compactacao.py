@@ -0,0 +1,261 @@
+# compactacao.py
+import argparse
+import os
+from datetime import datetime, timedelta
+
+import psycopg2
+
+from conexao import DB_PARAMS
+from detalhe_usuarios import refresh_summary
+
+# --- CONFIGURAÇÃO ---
+# Registros brutos mais antigos que isto (contado do último registro, alinhado ao início do mês)
+# viram linhas diárias e mensais em log_uso_diario / log_uso_mensal e saem de log_uso_sim.
+RETENCAO_DIAS = int(os.getenv("FULLTIME_RETENCAO_DIAS", "180"))
+# Linhas diárias mais antigas que isto são apagadas; o resumo mensal é mantido sempre.
+# Quem lê em resolução diária (uso_diario: dados de ML do dashboard, treino, composição,
+# exportação) enxerga só esta janela; totais mensais (uso_mensal) continuam completos.
+RETENCAO_DIARIO_DIAS = int(os.getenv("FULLTIME_RETENCAO_DIARIO_DIAS", "730"))
+# Resumo por usuário (90 dias), contexto do feature store e alertas leem só o bruto
+RETENCAO_MINIMA_DIAS = 92
+ARQUIVO_LOTE = 50000
+
+# Leitura transparente: bruto + compactado, com as mesmas colunas. As partes não se
+# sobrepõem (um registro está no bruto ou já foi compactado), então somas e contagens
+# podem ser feitas direto sobre a união. `filtro` vale para as duas partes e só pode usar
+# id_empresa, id_usuario e data_uso. Sem casts do PostgreSQL: o dashboard roda as
+# consultas principais também no SQLite dos benchmarks.
+USO_DIARIO = """(
+    SELECT id_empresa, id_usuario, data_uso, consumo_dados_gb, custo_total, 1 AS registros,
+           id_evento, id_dispositivo, id_situacao, id_localizacao
+    FROM log_uso_sim WHERE {filtro}
+    UNION ALL
+    SELECT id_empresa, id_usuario, data_uso, consumo_dados_gb, custo_total, registros,
+           id_evento, id_dispositivo, id_situacao, id_localizacao
+    FROM log_uso_diario WHERE {filtro}
+)"""
+
+USO_MENSAL = """(
+    SELECT id_empresa, id_usuario, data_uso, consumo_dados_gb, custo_total, 1 AS registros
+    FROM log_uso_sim WHERE {filtro}
+    UNION ALL
+    SELECT id_empresa, id_usuario, data_uso, consumo_dados_gb, custo_total, registros
+    FROM log_uso_mensal WHERE {filtro}
+)"""
+
+
+def uso_diario(filtro="1 = 1"):
+    # Uso com resolução diária nos períodos compactados (atributos do último registro do dia).
+    # Limitado a RETENCAO_DIARIO_DIAS: antes disso só existe o resumo mensal
+    return USO_DIARIO.format(filtro=filtro)
+
+
+def uso_mensal(filtro="1 = 1"):
+    # Uso com resolução mensal nos períodos compactados (data_uso = primeiro dia do mês)
+    return USO_MENSAL.format(filtro=filtro)
+
+
+ROLLUP_DIARIO_QUERY = """
+INSERT INTO log_uso_diario (
+    id_empresa, id_usuario, data_uso, consumo_dados_gb, custo_total, registros,
+    id_evento, id_dispositivo, id_situacao, id_localizacao
+)
+SELECT
+    id_empresa,
+    id_usuario,
+    data_uso::date,
+    SUM(consumo_dados_gb),
+    COALESCE(SUM(custo_total), 0),
+    COUNT(*),
+    (ARRAY_AGG(id_evento ORDER BY data_uso DESC))[1],
+    (ARRAY_AGG(id_dispositivo ORDER BY data_uso DESC))[1],
+    (ARRAY_AGG(id_situacao ORDER BY data_uso DESC))[1],
+    (ARRAY_AGG(id_localizacao ORDER BY data_uso DESC))[1]
+FROM log_uso_sim
+WHERE id_empresa = %(id_empresa)s AND data_uso < %(corte)s
+GROUP BY id_empresa, id_usuario, data_uso::date
+ON CONFLICT (id_empresa, id_usuario, data_uso) DO UPDATE SET
+    consumo_dados_gb = log_uso_diario.consumo_dados_gb + EXCLUDED.consumo_dados_gb,
+    custo_total = log_uso_diario.custo_total + EXCLUDED.custo_total,
+    registros = log_uso_diario.registros + EXCLUDED.registros;
+"""
+
+ROLLUP_MENSAL_QUERY = """
+INSERT INTO log_uso_mensal (
+    id_empresa, id_usuario, data_uso, id_departamento, id_cargo,
+    consumo_dados_gb, custo_total, registros, dias_com_uso
+)
+SELECT
+    l.id_empresa,
+    l.id_usuario,
+    DATE_TRUNC('month', l.data_uso)::date,
+    u.id_departamento,
+    u.id_cargo,
+    SUM(l.consumo_dados_gb),
+    COALESCE(SUM(l.custo_total), 0),
+    COUNT(*),
+    COUNT(DISTINCT l.data_uso::date)
+FROM log_uso_sim l
+JOIN usuario u ON l.id_usuario = u.id_usuario
+WHERE l.id_empresa = %(id_empresa)s AND l.data_uso < %(corte)s
+GROUP BY l.id_empresa, l.id_usuario, DATE_TRUNC('month', l.data_uso)::date, u.id_departamento, u.id_cargo
+ON CONFLICT (id_empresa, id_usuario, data_uso) DO UPDATE SET
+    consumo_dados_gb = log_uso_mensal.consumo_dados_gb + EXCLUDED.consumo_dados_gb,
+    custo_total = log_uso_mensal.custo_total + EXCLUDED.custo_total,
+    registros = log_uso_mensal.registros + EXCLUDED.registros,
+    dias_com_uso = GREATEST(log_uso_mensal.dias_com_uso, EXCLUDED.dias_com_uso);
+"""
+
+
+def month_start(d):
+    return d.replace(day=1)
+
+
+def cutoffs(cursor, retencao_dias=RETENCAO_DIAS, retencao_diario_dias=RETENCAO_DIARIO_DIAS):
+    """
+    (corte do bruto, corte do diário) a partir do último registro. O corte do bruto cai
+    sempre no início de um mês: o bruto nunca guarda um mês pela metade, e o faturamento
+    dos meses compactados continua valendo (faturamento.py só recalcula meses com bruto).
+    Levanta ValueError abaixo de RETENCAO_MINIMA_DIAS (inclusive via FULLTIME_RETENCAO_DIAS).
+    """
+    if retencao_dias < RETENCAO_MINIMA_DIAS:
+        raise ValueError(f"Retenção do bruto deve ser pelo menos {RETENCAO_MINIMA_DIAS} dias "
+                         f"(recebido {retencao_dias}): resumo por usuário, feature store e alertas leem só o bruto.")
+    cursor.execute("SELECT MAX(data_uso)::date FROM log_uso_sim;")
+    ultimo = cursor.fetchone()[0]
+    if ultimo is None:
+        return None, None
+    corte = month_start(ultimo - timedelta(days=retencao_dias))
+    corte_diario = month_start(ultimo - timedelta(days=retencao_diario_dias))
+    return corte, min(corte_diario, corte)
+
+
+def archive_rows(conn, id_empresa, corte, pasta):
+    """
+    Grava em Parquet os registros brutos que serão apagados, lidos com cursor server-side
+    na mesma transação do DELETE. Retorna o caminho do arquivo.
+    """
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    os.makedirs(pasta, exist_ok=True)
+    caminho = os.path.join(pasta, f"log_uso_sim_empresa_{id_empresa}_ate_{corte:%Y%m}_{datetime.now():%Y%m%d%H%M%S}.parquet")
+    cur = conn.cursor(name=f"arquivo_{id_empresa}")
+    cur.itersize = ARQUIVO_LOTE
+    cur.execute("SELECT * FROM log_uso_sim WHERE id_empresa = %s AND data_uso < %s ORDER BY id_log;",
+                (id_empresa, corte))
+    writer = None
+    try:
+        while True:
+            rows = cur.fetchmany(ARQUIVO_LOTE)
+            if not rows:
+                break
+            if writer is None:
+                colunas = [c[0] for c in cur.description]
+            table = pa.Table.from_pandas(pd.DataFrame(rows, columns=colunas), preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(caminho, table.schema)
+            writer.write_table(table.cast(writer.schema))
+    finally:
+        cur.close()
+        if writer is not None:
+            writer.close()
+    return caminho if writer is not None else None
+
+
+def compact_company(conn, id_empresa, corte, corte_diario, pasta_arquivo=None, simular=False):
+    """
+    Uma empresa (partição) por transação: grava os resumos diário e mensal dos registros
+    anteriores a `corte`, arquiva (opcional) e apaga esses registros, e remove as linhas
+    diárias anteriores a `corte_diario`. Retorna (registros compactados, diários removidos).
+    """
+    cursor = conn.cursor()
+    params = {"id_empresa": id_empresa, "corte": corte}
+    if simular:
+        cursor.execute("SELECT COUNT(*) FROM log_uso_sim WHERE id_empresa = %(id_empresa)s AND data_uso < %(corte)s;",
+                       params)
+        brutos = cursor.fetchone()[0]
+        cursor.execute("SELECT COUNT(*) FROM log_uso_diario WHERE id_empresa = %s AND data_uso < %s;",
+                       (id_empresa, corte_diario))
+        diarios = cursor.fetchone()[0]
+        conn.rollback()
+        cursor.close()
+        return brutos, diarios
+
+    cursor.execute(ROLLUP_DIARIO_QUERY, params)
+    cursor.execute(ROLLUP_MENSAL_QUERY, params)
+    if pasta_arquivo:
+        caminho = archive_rows(conn, id_empresa, corte, pasta_arquivo)
+        if caminho:
+            print(f"[OK] Empresa {id_empresa}: registros arquivados em {caminho}.")
+    cursor.execute("DELETE FROM log_uso_sim WHERE id_empresa = %(id_empresa)s AND data_uso < %(corte)s;", params)
+    brutos = cursor.rowcount
+    cursor.execute("DELETE FROM log_uso_diario WHERE id_empresa = %s AND data_uso < %s;", (id_empresa, corte_diario))
+    diarios = cursor.rowcount
+    conn.commit()
+    cursor.close()
+    return brutos, diarios
+
+
+def compact(conn, retencao_dias=RETENCAO_DIAS, retencao_diario_dias=RETENCAO_DIARIO_DIAS,
+            pasta_arquivo=None, simular=False):
+    # Resumos, arquivo e DELETE veem o mesmo snapshot: um registro antigo inserido durante
+    # a compactação não é apagado sem ter entrado nos resumos
+    conn.set_session(isolation_level="REPEATABLE READ")
+    cursor = conn.cursor()
+    corte, corte_diario = cutoffs(cursor, retencao_dias, retencao_diario_dias)
+    if corte is None:
+        print("[OK] log_uso_sim vazio, nada a compactar.")
+        cursor.close()
+        return 0
+    cursor.execute("SELECT id_empresa FROM empresas ORDER BY id_empresa;")
+    empresas = [r[0] for r in cursor.fetchall()]
+    cursor.close()
+    conn.rollback()
+
+    acao = "seriam compactados" if simular else "compactados"
+    total = 0
+    for id_empresa in empresas:
+        brutos, diarios = compact_company(conn, id_empresa, corte, corte_diario, pasta_arquivo, simular)
+        total += brutos
+        if brutos or diarios:
+            print(f"[OK] Empresa {id_empresa}: {brutos} registros {acao} (antes de {corte:%d/%m/%Y}), "
+                  f"{diarios} linhas diárias anteriores a {corte_diario:%d/%m/%Y}.")
+    print(f"[OK] {total} registros {acao} no total.")
+    print(f"[OK] Histórico diário (ML, treino, exportação) disponível a partir de {corte_diario:%d/%m/%Y}; "
+          "antes disso, só totais mensais.")
+    if total and not simular:
+        # O resumo lê log_uso_sim: sai atualizado depois da compactação
+        refresh_summary(conn)
+        print("[OK] Resumo por usuário atualizado.")
+        print("[OK] O espaço é reaproveitado pelo autovacuum; VACUUM (FULL) log_uso_sim devolve ao disco.")
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compacta o histórico antigo de log_uso_sim em resumos diário e mensal.")
+    parser.add_argument("--retencao-dias", type=int, default=RETENCAO_DIAS,
+                        help="Dias de registros brutos mantidos (arredondado para o início do mês).")
+    parser.add_argument("--retencao-diario-dias", type=int, default=RETENCAO_DIARIO_DIAS,
+                        help="Dias de resumo diário mantidos; o mensal nunca é apagado.")
+    parser.add_argument("--arquivo", metavar="PASTA",
+                        help="Grava os registros brutos apagados em Parquet nesta pasta.")
+    parser.add_argument("--simular", action="store_true", help="Só conta o que seria compactado.")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**DB_PARAMS)
+    try:
+        compact(conn, args.retencao_dias, args.retencao_diario_dias, args.arquivo, args.simular)
+    except ValueError as e:
+        print("[ERRO]", e)
+    except Exception as e:
+        conn.rollback()
+        print("[ERRO] Falha na compactação:", e)
+        raise
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
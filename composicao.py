@@ -0,0 +1,111 @@
+# composicao.py
+import numpy as np
+import pandas as pd
+
+from compactacao import uso_diario
+
+# Dimensões da análise de composição do consumo
+DIMENSOES = ["usuario", "dispositivo", "situacao", "evento", "dia_semana", "localizacao"]
+
+FIM_DE_SEMANA = "Fim de semana"
+DIA_UTIL = "Dia útil"
+
+# Todas as quebras numa única consulta (uma passada pelos dados no banco).
+# Nos dias compactados, o volume do dia vai para os atributos do último registro.
+COMPOSITION_QUERY = f"""
+WITH base AS (
+    SELECT
+        u.nome AS usuario,
+        disp.nome_dispositivo AS dispositivo,
+        s.situacao AS situacao,
+        evt.nome_eventos AS evento,
+        CASE WHEN EXTRACT(ISODOW FROM l.data_uso) >= 6 THEN 'Fim de semana' ELSE 'Dia útil' END AS dia_semana,
+        l.id_localizacao,
+        l.consumo_dados_gb
+    FROM {uso_diario("id_empresa = %(id_empresa)s")} l
+    JOIN usuario u ON l.id_usuario = u.id_usuario
+    JOIN departamentos dep ON u.id_departamento = dep.id_departamento
+    JOIN cargos c ON u.id_cargo = c.id_cargo
+    JOIN eventos_especiais evt ON l.id_evento = evt.id_evento
+    JOIN dispositivos disp ON l.id_dispositivo = disp.id_dispositivo
+    JOIN situacao s ON l.id_situacao = s.id_situacao
+    WHERE c.nome = %(cargo)s AND dep.nome = ANY(%(departamentos)s)
+)
+SELECT
+    CASE
+        WHEN GROUPING(usuario) = 0 THEN 'usuario'
+        WHEN GROUPING(dispositivo) = 0 THEN 'dispositivo'
+        WHEN GROUPING(situacao) = 0 THEN 'situacao'
+        WHEN GROUPING(evento) = 0 THEN 'evento'
+        WHEN GROUPING(dia_semana) = 0 THEN 'dia_semana'
+        WHEN GROUPING(id_localizacao) = 0 THEN 'localizacao'
+        ELSE 'total'
+    END AS dimensao,
+    -- Localização agrupada pela chave inteira; o nome só é buscado para as linhas do resultado
+    COALESCE(usuario, dispositivo, situacao, evento, dia_semana,
+             (SELECT loc.nome FROM localizacoes loc WHERE loc.id_localizacao = base.id_localizacao)) AS valor,
+    SUM(consumo_dados_gb)::float AS consumo
+FROM base
+GROUP BY GROUPING SETS ((usuario), (dispositivo), (situacao), (evento), (dia_semana), (id_localizacao), ());
+"""
+
+
+def composition_from_rows(df_rows):
+    """
+    Monta a composição a partir do resultado de COMPOSITION_QUERY (dimensao, valor, consumo).
+    """
+    total_rows = df_rows[df_rows['dimensao'] == 'total']
+    composition = {
+        "total": float(total_rows['consumo'].sum()) if not total_rows.empty else 0.0,
+        "dimensoes": {},
+    }
+    for dim in DIMENSOES:
+        part = df_rows[(df_rows['dimensao'] == dim) & df_rows['valor'].notna()]
+        composition["dimensoes"][dim] = (
+            part.set_index('valor')['consumo'].astype(float).sort_values(ascending=False)
+        )
+    return composition
+
+
+def compute_composition(df, value_col='consumo'):
+    """
+    Mesma composição calculada em memória, sem copiar nem alterar `df`: cada dimensão vira
+    um vetor de códigos inteiros e um único bincount soma o volume de todas as quebras.
+    """
+    weights = df[value_col].to_numpy(dtype=float)
+    composition = {"total": float(weights.sum()), "dimensoes": {}}
+
+    codes_all, weights_all, spans = [], [], []
+    offset = 0
+    for dim in DIMENSOES:
+        if dim == 'dia_semana':
+            if 'data_uso' not in df.columns: continue
+            weekend = pd.to_datetime(df['data_uso']).dt.dayofweek.to_numpy() >= 5
+            codes, labels = weekend.astype(np.int64), np.array([DIA_UTIL, FIM_DE_SEMANA], dtype=object)
+        else:
+            if dim not in df.columns: continue
+            codes, labels = pd.factorize(df[dim], sort=False)
+        valid = codes >= 0
+        codes_all.append(codes[valid] + offset)
+        weights_all.append(weights[valid])
+        spans.append((dim, offset, labels))
+        offset += len(labels)
+
+    if not spans:
+        return composition
+
+    sums = np.bincount(np.concatenate(codes_all), weights=np.concatenate(weights_all), minlength=offset)
+    for dim, start, labels in spans:
+        volumes = pd.Series(sums[start:start + len(labels)], index=pd.Index(labels, name='valor'))
+        composition["dimensoes"][dim] = volumes[volumes > 0].sort_values(ascending=False)
+    return composition
+
+
+def top_contributors(composition, dim, n=5):
+    """
+    Top-N de uma dimensão com volume e participação (%) no total.
+    """
+    volumes = composition["dimensoes"].get(dim, pd.Series(dtype=float)).head(n)
+    total = composition["total"] or 1.0
+    return pd.DataFrame({"valor": volumes.index, "consumo": volumes.values,
+                         "participacao": volumes.values / total * 100})
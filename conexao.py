@@ -0,0 +1,18 @@
+# conexao.py
+import os
+
+# --- CONFIGURAÇÕES DO BANCO ---
+# Valores padrão do ambiente de desenvolvimento; sobrescreva via variáveis de ambiente.
+DB_PARAMS = {
+    "database": os.getenv("FULLTIME_DB_NAME", "ANALISE"),
+    "user": os.getenv("FULLTIME_DB_USER", "postgres"),
+    "password": os.getenv("FULLTIME_DB_PASSWORD", "1234"),
+    "host": os.getenv("FULLTIME_DB_HOST", "localhost"),
+    "port": os.getenv("FULLTIME_DB_PORT", "5433")
+}
+
+# Perfil SQL (perfil_sql.py): com FULLTIME_SQL_PERFIL=1 toda conexão aberta com DB_PARAMS
+# usa o cursor que mede tempo, linhas e amostra o plano das consultas lentas.
+if os.getenv("FULLTIME_SQL_PERFIL", "0") == "1":
+    from perfil_sql import ProfilingCursor
+    DB_PARAMS["cursor_factory"] = ProfilingCursor
@@ -0,0 +1,84 @@
+# consultas_paralelas.py
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+
+from conexao import DB_PARAMS
+
+# --- CONFIGURAÇÃO ---
+POOL_MAX = int(os.getenv("FULLTIME_QUERY_POOL_MAX", "8"))
+QUERY_TIMEOUT_S = float(os.getenv("FULLTIME_QUERY_TIMEOUT_S", "30"))
+# Folga do lado do cliente além do statement_timeout do servidor
+TIMEOUT_FOLGA_S = 2.0
+
+_pool = None
+_pool_lock = threading.Lock()
+_pool_slots = threading.BoundedSemaphore(POOL_MAX)
+_executor = ThreadPoolExecutor(max_workers=POOL_MAX, thread_name_prefix="consulta")
+
+
+def get_pool():
+    # Pool único por processo: sobrevive às reexecuções do script do Streamlit
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.closed:
+            _pool = ThreadedConnectionPool(1, POOL_MAX, connect_timeout=5, **DB_PARAMS)
+    return _pool
+
+
+def run_with_conn(task, timeout=QUERY_TIMEOUT_S):
+    """
+    Executa task(conn) numa conexão do pool, dentro de uma transação com
+    statement_timeout próprio. A transação é sempre encerrada com rollback:
+    as tarefas são leituras e a conexão volta limpa ao pool.
+    """
+    with _pool_slots:
+        pool = get_pool()
+        conn = pool.getconn()
+        broken = False
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SET LOCAL statement_timeout = %s;", (int(timeout * 1000),))
+            return task(conn)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = conn.closed != 0
+            raise
+        finally:
+            if not conn.closed:
+                conn.rollback()
+            pool.putconn(conn, close=broken or conn.closed != 0)
+
+
+def run_concurrent(tasks, timeout=QUERY_TIMEOUT_S):
+    """
+    Executa em paralelo as tarefas independentes de uma página.
+    `tasks` é um dict nome -> função(conn). Retorna (resultados, erros): as tarefas que
+    falharam ou estouraram o tempo aparecem só em `erros`, com a mensagem, e as demais
+    continuam válidas. A latência total é a da tarefa mais lenta.
+    """
+    futures = {_executor.submit(run_with_conn, task, timeout): nome for nome, task in tasks.items()}
+    done, pending = wait(futures, timeout=timeout + TIMEOUT_FOLGA_S)
+
+    resultados, erros = {}, {}
+    for future in done:
+        nome = futures[future]
+        try:
+            resultados[nome] = future.result()
+        except Exception as e:
+            erros[nome] = str(e).strip() or type(e).__name__
+    for future in pending:
+        # O statement_timeout do servidor libera a conexão logo em seguida
+        erros[futures[future]] = f"tempo esgotado ({timeout:.0f}s)"
+    return resultados, erros
+
+
+def check_connection(timeout=3):
+    # Verificação de status reaproveitando o pool (sem abrir uma conexão nova a cada rerun)
+    try:
+        run_with_conn(lambda conn: conn.cursor().execute("SELECT 1;"), timeout=timeout)
+        return True
+    except Exception:
+        return False
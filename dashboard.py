@@ -1,23 +1,44 @@
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
 import psycopg2
 import pickle
+import json
+import os
+import tempfile
+import uuid
+from urllib.parse import urlencode
 import numpy as np
-from datetime import datetime, date
-import lightgbm as lgb 
-
-# --- CONFIGURAÇÕES DO BANCO ---
-DB_PARAMS = {
-    "database": "ANALISE",
-    "user": "postgres",
-    "password": "1234",
-    "host": "localhost",
-    "port": "5433"
-}
+
+from cache_compartilhado import get_cache, make_key, shared_cache
+from conexao import DB_PARAMS
+from consultas_paralelas import run_concurrent
+from compactacao import uso_diario, uso_mensal
+from composicao import (
+    COMPOSITION_QUERY, DIMENSOES, FIM_DE_SEMANA,
+    composition_from_rows, compute_composition, top_contributors
+)
+from detalhe_usuarios import ORDENACOES, PERIODOS, TAMANHO_PAGINA, count_users, fetch_user_page, summary_updated_at
+from exportacao import FORMATOS_EXPORTACAO, export_filename, stream_export
+from faturamento import fetch_billing, fetch_months
+from heavy_hitters import DIMENSOES_SKETCH, top_n
+from kpis import fetch_location_aggregate
+from memoria import memory_cache
+from metricas import incr, span, timed
+from previsao import (
+    MODO_RECURSIVO, MODO_DIRETO, MODO_HIERARQUICO,
+    forecast_recursive, forecast_direct, forecast_groups, reconcile_top_down
+)
+from treina_lightgbm_db import incomplete_month
 
 # --- FUNÇÕES DE CACHE E DADOS ---
+# Loaders por filtro usam st.cache_data (cópia por acesso, sem limite em bytes): o nº de
+# combinações guardadas é limitado para a memória não crescer com a variedade de filtros.
+CACHE_FILTROS_MAX = 64
+# Exportação: com a API (api.py) configurada, o download vem dela em streaming e não passa
+# pela memória desta réplica; sem ela, o arquivo é montado em disco e entregue pelo Streamlit
+API_URL = os.getenv("FULLTIME_API_URL", "").rstrip("/")
+# Registro dos modelos por segmento (treina_lightgbm_db.py --segmento)
+REGISTRY_FILE = 'registro_modelos.json'
 
 @st.cache_resource(ttl=900)
 def init_db_conn():
@@ -29,77 +50,505 @@ def init_db_conn():
         return None
 
 @st.cache_data(ttl=600)
-def load_main_data(_conn):
+def load_empresas(_conn):
+    if _conn is None: return pd.DataFrame()
+    try:
+        return pd.read_sql_query("SELECT id_empresa, nome FROM empresas ORDER BY id_empresa;", _conn)
+    except:
+        _conn.rollback()
+        return pd.DataFrame()
+
+def select_tenant(conn):
+    """
+    Empresa (tenant) da sessão: `?empresa=<id>` na URL ou, sem ele, escolha na barra lateral.
+    Todas as consultas e chaves de cache seguintes são restritas a ela. None se não houver empresas.
+    """
+    empresas = load_empresas(conn)
+    if empresas.empty: return None
+    ids = [int(i) for i in empresas['id_empresa']]
+    param = st.query_params.get("empresa", "")
+    if param.isdigit() and int(param) in ids:
+        return int(param)
+    if len(ids) == 1:
+        return ids[0]
+    nomes = dict(zip(ids, empresas['nome']))
+    return st.sidebar.selectbox("Empresa:", ids, format_func=nomes.get)
+
+# Consultas da página (também executadas pelo benchmark_escala.py)
+# Histórico compactado (compactacao.py) entra com resolução mensal no principal e diária no de ML
+MAIN_QUERY = f"""
+SELECT
+    l.data_uso,
+    l.consumo_dados_gb AS "Consumo (GB)",
+    u.nome AS "Nome",
+    dep.nome AS "Departamento",
+    c.nome AS "Cargo",
+    c.limite_gigas AS "Plano (GB)", 
+    emp.nome AS "Empresa"
+FROM {uso_mensal("id_empresa = %(id_empresa)s")} l
+JOIN usuario u ON l.id_usuario = u.id_usuario
+JOIN departamentos dep ON u.id_departamento = dep.id_departamento
+JOIN cargos c ON u.id_cargo = c.id_cargo
+JOIN empresas emp ON u.id_empresa = emp.id_empresa
+ORDER BY l.data_uso;
+"""
+
+# Resolução diária: cobre só a retenção do resumo diário (compactacao.RETENCAO_DIARIO_DIAS)
+ML_QUERY = f"""
+SELECT
+    l.data_uso,
+    l.consumo_dados_gb AS consumo,
+    u.id_usuario,
+    u.nome AS usuario,
+    dep.nome AS departamento,
+    c.nome AS cargo,
+    evt.nome_eventos AS evento,
+    disp.nome_dispositivo AS dispositivo,
+    s.situacao AS situacao
+FROM {uso_diario("id_empresa = %(id_empresa)s")} l
+JOIN usuario u ON l.id_usuario = u.id_usuario
+JOIN departamentos dep ON u.id_departamento = dep.id_departamento
+JOIN cargos c ON u.id_cargo = c.id_cargo
+JOIN eventos_especiais evt ON l.id_evento = evt.id_evento
+JOIN dispositivos disp ON l.id_dispositivo = disp.id_dispositivo
+JOIN situacao s ON l.id_situacao = s.id_situacao
+ORDER BY l.data_uso, l.consumo_dados_gb;
+"""
+
+def prepare_main_frame(df):
+    if not df.empty:
+        df['data_uso'] = pd.to_datetime(df['data_uso'])
+        df['Mês'] = df['data_uso'].dt.to_period('M').astype(str)
+    return df
+
+# Camada compartilhada entre réplicas (cache_compartilhado.py): só resultados bem-sucedidos
+# são gravados, por isso as consultas levantam exceção e o tratamento fica nos loaders.
+# No processo, os DataFrames grandes ficam no cache limitado em bytes (memoria.py), um só
+# objeto para todas as sessões em vez de uma cópia do st.cache_data a cada acesso.
+@memory_cache(ttl=600)
+@shared_cache(ttl=600)
+def fetch_main_data(_conn, id_empresa):
+    with span("carga.principal"):
+        df = prepare_main_frame(pd.read_sql_query(MAIN_QUERY, _conn, params={"id_empresa": id_empresa}))
+    incr("linhas_carregadas", len(df), consulta="principal")
+    return df
+
+def load_main_data(_conn, id_empresa):
+    if _conn is None: return pd.DataFrame()
+    try:
+        return fetch_main_data(_conn, id_empresa)
+    except:
+        return pd.DataFrame()
+
+@memory_cache(ttl=600)
+@shared_cache(ttl=600)
+def fetch_ml_data(_conn, id_empresa):
+    with span("carga.ml"):
+        df = pd.read_sql_query(ML_QUERY, _conn, params={"id_empresa": id_empresa})
+    incr("linhas_carregadas", len(df), consulta="ml")
+    return df
+
+def load_ml_data(_conn, id_empresa):
+    if _conn is None: return pd.DataFrame()
+    try:
+        return fetch_ml_data(_conn, id_empresa)
+    except:
+        return pd.DataFrame()
+
+def load_page_data(id_empresa):
+    """
+    Carrega os dados principais e os de ML da empresa em paralelo, cada um numa conexão do pool,
+    em vez de um depois do outro: a previsão já encontra o cache de ML aquecido.
+    Retorna o DataFrame principal (vazio se a consulta falhar).
+    """
+    with span("dashboard.carga_paralela"):
+        resultados, _ = run_concurrent({
+            "main": lambda conn: load_main_data(conn, id_empresa),
+            "ml": lambda conn: load_ml_data(conn, id_empresa),
+        })
+    return resultados.get("main", pd.DataFrame())
+
+@st.cache_data(ttl=600, max_entries=CACHE_FILTROS_MAX)
+def load_feature_seeds(_conn, id_empresa, departamentos, cargo, n_rows=60):
+    """
+    Últimos registros do feature store por usuário do filtro (mesma semântica por registro do
+    histórico bruto): o mais recente é o estado inicial da recursão, que recalcula os lags a
+    partir do consumo. Vazio se o feature store não existir/estiver vazio.
+    """
     if _conn is None: return pd.DataFrame()
     query = """
+    SELECT id_usuario, data, consumo_dados_gb, cargo, departamento, evento, dispositivo, situacao, atualizado_em
+    FROM (
+        SELECT f.*, ROW_NUMBER() OVER (PARTITION BY f.id_usuario ORDER BY f.data DESC, f.seq DESC) AS rn
+        FROM feature_store_consumo f
+        JOIN usuario u ON f.id_usuario = u.id_usuario
+        WHERE u.id_empresa = %(id_empresa)s
+          AND f.cargo = %(cargo)s AND f.departamento = ANY(%(departamentos)s)
+    ) t
+    WHERE rn <= %(n_rows)s
+    ORDER BY id_usuario, data, seq;
+    """
+    try:
+        df = pd.read_sql_query(query, _conn, params={
+            "id_empresa": id_empresa, "cargo": cargo, "departamentos": list(departamentos), "n_rows": n_rows
+        })
+        df['data'] = pd.to_datetime(df['data'])
+        return df
+    except:
+        _conn.rollback()
+        return pd.DataFrame()
+
+@st.cache_resource 
+def load_model():
+    try:
+        with open('modelo_lightgbm_consumo.pkl', 'rb') as f:
+            return pickle.load(f)
+    except:
+        return None
+
+@st.cache_data(ttl=600, max_entries=CACHE_FILTROS_MAX)
+def load_group_daily(_conn, id_empresa, departamentos, cargo):
+    """
+    Consumo diário já agregado por departamento x cargo: o tamanho não depende do nº de SIM cards.
+    """
+    if _conn is None: return pd.DataFrame()
+    query = f"""
     SELECT
-        l.data_uso,
-        l.consumo_dados_gb AS "Consumo (GB)",
-        u.nome AS "Nome",
-        dep.nome AS "Departamento",
-        c.nome AS "Cargo",
-        c.limite_gigas AS "Plano (GB)", 
-        emp.nome AS "Empresa"
-    FROM log_uso_sim l
+        l.data_uso::date AS data_uso,
+        dep.nome AS departamento,
+        c.nome AS cargo,
+        SUM(l.consumo_dados_gb)::float AS consumo
+    FROM {uso_diario("id_empresa = %(id_empresa)s")} l
     JOIN usuario u ON l.id_usuario = u.id_usuario
     JOIN departamentos dep ON u.id_departamento = dep.id_departamento
     JOIN cargos c ON u.id_cargo = c.id_cargo
-    JOIN empresas emp ON u.id_empresa = emp.id_empresa
-    ORDER BY l.data_uso;
+    WHERE c.nome = %(cargo)s AND dep.nome = ANY(%(departamentos)s)
+    GROUP BY 1, 2, 3
+    ORDER BY 1;
     """
     try:
-        df = pd.read_sql_query(query, _conn)
-        if not df.empty:
-            df['data_uso'] = pd.to_datetime(df['data_uso'])
-            df['Mês'] = df['data_uso'].dt.to_period('M').astype(str)
-        return df
+        return pd.read_sql_query(query, _conn, params={
+            "id_empresa": id_empresa, "cargo": cargo, "departamentos": list(departamentos)
+        })
     except:
+        _conn.rollback()
         return pd.DataFrame()
 
-@st.cache_data(ttl=600)
-def load_ml_data(_conn):
+@st.cache_data(ttl=600, max_entries=CACHE_FILTROS_MAX)
+def load_user_shares(_conn, id_empresa, departamentos, cargo, days=90):
+    # Volume recente de cada usuário do grupo: base das proporções top-down
     if _conn is None: return pd.DataFrame()
     query = """
     SELECT
-        l.data_uso,
-        l.consumo_dados_gb AS consumo,
         u.id_usuario,
         u.nome AS usuario,
         dep.nome AS departamento,
-        c.nome AS cargo,
-        evt.nome_eventos AS evento,
-        disp.nome_dispositivo AS dispositivo,
-        s.situacao AS situacao
-    FROM log_uso_sim l
-    JOIN usuario u ON l.id_usuario = u.id_usuario
+        COALESCE(SUM(l.consumo_dados_gb), 0)::float AS consumo
+    FROM usuario u
     JOIN departamentos dep ON u.id_departamento = dep.id_departamento
     JOIN cargos c ON u.id_cargo = c.id_cargo
-    JOIN eventos_especiais evt ON l.id_evento = evt.id_evento
-    JOIN dispositivos disp ON l.id_dispositivo = disp.id_dispositivo
-    JOIN situacao s ON l.id_situacao = s.id_situacao
-    ORDER BY l.data_uso;
+    LEFT JOIN log_uso_sim l ON l.id_usuario = u.id_usuario AND l.id_empresa = %(id_empresa)s
+        AND l.data_uso >= (
+            SELECT MAX(data_uso) FROM log_uso_sim WHERE id_empresa = %(id_empresa)s
+        ) - make_interval(days => %(days)s)
+    WHERE u.id_empresa = %(id_empresa)s
+      AND c.nome = %(cargo)s AND dep.nome = ANY(%(departamentos)s)
+    GROUP BY 1, 2, 3;
     """
     try:
-        return pd.read_sql_query(query, _conn)
+        return pd.read_sql_query(query, _conn, params={
+            "id_empresa": id_empresa, "cargo": cargo, "departamentos": list(departamentos), "days": days
+        })
     except:
+        _conn.rollback()
         return pd.DataFrame()
 
-@st.cache_resource 
-def load_model():
+@st.cache_data(ttl=60, max_entries=CACHE_FILTROS_MAX)
+def load_current_anomalies(_conn, id_empresa, departamentos, cargos, days=7):
+    """
+    Anomalias recentes gravadas pelo detector contínuo (detector_anomalias.py).
+    Não depende do modelo: só lê a tabela de eventos.
+    """
+    if _conn is None: return pd.DataFrame()
+    query = """
+    SELECT
+        a.data_uso AS "Data",
+        u.nome AS "Usuário",
+        c.nome AS "Cargo",
+        a.consumo_dados_gb AS "Consumo (GB)",
+        a.media_usuario AS "Média do Usuário (GB)",
+        a.zscore AS "Z-Score",
+        a.severidade AS "Severidade"
+    FROM eventos_anomalia a
+    JOIN usuario u ON a.id_usuario = u.id_usuario
+    JOIN departamentos dep ON u.id_departamento = dep.id_departamento
+    JOIN cargos c ON u.id_cargo = c.id_cargo
+    WHERE a.id_empresa = %(id_empresa)s
+      AND dep.nome = ANY(%(departamentos)s) AND c.nome = ANY(%(cargos)s)
+      AND a.data_uso >= (
+          SELECT MAX(data_uso) FROM eventos_anomalia WHERE id_empresa = %(id_empresa)s
+      ) - make_interval(days => %(days)s)
+    ORDER BY a.data_uso DESC;
+    """
     try:
-        with open('modelo_lightgbm_consumo.pkl', 'rb') as f:
+        return pd.read_sql_query(query, _conn, params={
+            "id_empresa": id_empresa, "departamentos": list(departamentos), "cargos": list(cargos), "days": days
+        })
+    except:
+        _conn.rollback()
+        return pd.DataFrame()
+
+@st.cache_data(ttl=300, max_entries=CACHE_FILTROS_MAX)
+def load_top_consumers(_conn, id_empresa, dimensao, dias, segmentos):
+    # Top N a partir dos sketches persistidos (heavy_hitters.py), sem varrer o log
+    if _conn is None: return None
+    try:
+        return top_n(_conn, dimensao, dias=dias, n=10, segmentos=segmentos, id_empresa=id_empresa)
+    except:
+        _conn.rollback()
+        return None
+
+@st.cache_data(ttl=60, max_entries=CACHE_FILTROS_MAX)
+def load_user_page(_conn, id_empresa, departamentos, cargos, periodo, ordenacao, busca, apos):
+    # Página do detalhamento por usuário (keyset); None se o resumo não existir
+    if _conn is None: return None
+    try:
+        return fetch_user_page(_conn, id_empresa, departamentos, cargos, periodo, ordenacao, busca, apos)
+    except:
+        _conn.rollback()
+        return None
+
+@st.cache_data(ttl=60, max_entries=CACHE_FILTROS_MAX)
+def load_user_count(_conn, id_empresa, departamentos, cargos, busca):
+    if _conn is None: return 0
+    try:
+        return count_users(_conn, id_empresa, departamentos, cargos, busca)
+    except:
+        _conn.rollback()
+        return 0
+
+@st.cache_data(ttl=60, max_entries=CACHE_FILTROS_MAX)
+def load_summary_updated_at(_conn, id_empresa):
+    if _conn is None: return None
+    try:
+        return summary_updated_at(_conn, id_empresa)
+    except:
+        _conn.rollback()
+        return None
+
+@st.cache_data(ttl=300, max_entries=CACHE_FILTROS_MAX)
+def load_billing_months(_conn, id_empresa):
+    if _conn is None: return []
+    try:
+        return fetch_months(_conn, id_empresa)
+    except:
+        _conn.rollback()
+        return []
+
+@st.cache_data(ttl=300, max_entries=CACHE_FILTROS_MAX)
+def load_billing(_conn, id_empresa, mes, departamentos, cargos):
+    # Excedentes por usuário já materializados (faturamento.py); None se a tabela não existir
+    if _conn is None: return None
+    try:
+        return fetch_billing(_conn, id_empresa, mes, "usuario", departamentos, cargos)
+    except:
+        _conn.rollback()
+        return None
+
+@st.cache_data(ttl=300, max_entries=CACHE_FILTROS_MAX)
+def load_locations(_conn, id_empresa, departamentos, cargos):
+    if _conn is None: return None
+    try:
+        return fetch_location_aggregate(_conn, id_empresa, departamentos=departamentos, cargos=cargos)
+    except:
+        _conn.rollback()
+        return None
+
+@st.cache_data(ttl=600, max_entries=CACHE_FILTROS_MAX)
+def load_composition(_conn, id_empresa, departamentos, cargo):
+    """
+    Composição do consumo do filtro (usuário, dispositivo, situação, evento, dia da semana,
+    localização) numa única consulta com GROUPING SETS. None se a consulta falhar.
+    """
+    if _conn is None: return None
+    try:
+        df_rows = pd.read_sql_query(COMPOSITION_QUERY, _conn, params={
+            "id_empresa": id_empresa, "cargo": cargo, "departamentos": list(departamentos)
+        })
+        return composition_from_rows(df_rows)
+    except:
+        _conn.rollback()
+        return None
+
+@st.cache_resource
+def load_group_model():
+    try:
+        with open('modelo_lightgbm_grupo.pkl', 'rb') as f:
             return pickle.load(f)
     except:
         return None
 
+@st.cache_resource
+def load_direct_model():
+    try:
+        with open('modelo_lightgbm_mensal.pkl', 'rb') as f:
+            return pickle.load(f)
+    except:
+        return None
+
+def registry_version():
+    # Data de modificação do registro: muda a cada treino por segmento (o arquivo é sempre regravado)
+    return os.path.getmtime(REGISTRY_FILE) if os.path.exists(REGISTRY_FILE) else None
+
+@st.cache_resource(max_entries=2)
+def load_model_registry(versao=None):
+    """
+    Modelos por segmento (departamento ou cargo) gerados com `treina_lightgbm_db.py --segmento`.
+    Retorna None se não houver registro. `versao` (registry_version()) entra na chave do cache:
+    um retreino é visto pela réplica em execução sem reiniciá-la.
+    """
+    try:
+        with open(REGISTRY_FILE, 'r', encoding='utf-8') as f:
+            registry = json.load(f)
+    except:
+        return None
+
+    models = {}
+    for segment, entry in registry.get("modelos", {}).items():
+        if not os.path.exists(entry["arquivo"]): continue
+        with open(entry["arquivo"], 'rb') as f:
+            models[segment] = pickle.load(f)
+    if not models: return None
+    return {"segmento": registry["segmento"], "modelos": models}
+
 def prepare_features(df):
     df = df.copy()
     df['data'] = pd.to_datetime(df['data_uso'])
     df.rename(columns={'consumo': 'consumo_dados_gb'}, inplace=True)
     return df
 
+# --- PREVISÃO ---
+MODEL_FILES = ['modelo_lightgbm_consumo.pkl', 'modelo_lightgbm_mensal.pkl',
+               'modelo_lightgbm_grupo.pkl', REGISTRY_FILE]
+
+class ForecastUnavailable(Exception):
+    # Falta de modelo ou de dados: mensagem exibida ao usuário, resultado não vai para o cache
+    pass
+
+def model_version():
+    # Datas de modificação dos modelos: retreinar invalida as previsões em cache
+    return tuple(os.path.getmtime(f) if os.path.exists(f) else None for f in MODEL_FILES)
+
+def compute_forecast(conn, id_empresa, departamentos, cargo, horizon, modo):
+    """
+    Previsão mensal do filtro (dentro da empresa) no modo escolhido, mais o histórico mensal e a composição
+    usados no diagnóstico. Levanta ForecastUnavailable se faltar modelo ou dados.
+    `estado_inicial` (recursivo) descreve o feature store: atualização, último dia e se estava defasado
+    em relação ao histórico (nesse caso a recursão parte do histórico bruto).
+    """
+    registry = None
+    estado_inicial = None
+    if modo == MODO_DIRETO:
+        modelo = load_direct_model()
+    elif modo == MODO_HIERARQUICO:
+        modelo = load_group_model()
+    else:
+        modelo = load_model()
+        registry = load_model_registry(registry_version())
+    if not modelo and not registry:
+        raise ForecastUnavailable("Modelo não encontrado.")
+
+    fc_groups = None
+    if modo == MODO_HIERARQUICO:
+        # Só séries já agregadas por grupo: nada aqui cresce com o nº de SIM cards
+        with span("previsao.load_group_daily"):
+            df_group = load_group_daily(conn, id_empresa, departamentos, cargo)
+        if df_group.empty:
+            raise ForecastUnavailable("Sem dados.")
+        with span("previsao.modelo_hierarquico"):
+            fc_groups = forecast_groups(df_group, horizon, modelo)
+        fc_series = fc_groups.sum(axis=1) if not fc_groups.empty else None
+        df_context = df_group
+        hist_daily = df_group.groupby(pd.to_datetime(df_group['data_uso']))['consumo'].sum()
+    else:
+        with span("previsao.load_ml_data"):
+            df_raw = load_ml_data(conn, id_empresa)
+        if df_raw.empty:
+            raise ForecastUnavailable("Sem dados.")
+        df_context = df_raw[
+            (df_raw['cargo'] == cargo) &
+            (df_raw['departamento'].isin(departamentos))
+        ]
+        if df_context.empty:
+            raise ForecastUnavailable("Sem dados.")
+
+        with span("previsao.prepare_features"):
+            df_fe = prepare_features(df_context)
+
+        if modo == MODO_DIRETO:
+            with span("previsao.modelo_direto"):
+                fc_series = forecast_direct(modelo, df_fe, horizon)
+        else:
+            # Estado inicial da recursão: feature store se disponível e em dia, senão histórico bruto
+            df_seeds = load_feature_seeds(conn, id_empresa, departamentos, cargo)
+            if df_seeds.empty:
+                df_seeds = df_fe
+            else:
+                defasado = df_seeds['data'].max() < df_fe['data'].max().normalize()
+                estado_inicial = {
+                    "atualizado_em": df_seeds['atualizado_em'].max(),
+                    "ultimo_dia": df_seeds['data'].max(),
+                    "defasado": defasado,
+                }
+                if defasado:
+                    df_seeds = df_fe
+            with span("previsao.modelo_recursivo"):
+                fc_series = forecast_recursive(df_seeds, horizon, modelo, registry)
+        hist_daily = df_fe.groupby('data')['consumo_dados_gb'].sum()
+
+    if fc_series is None:
+        raise ForecastUnavailable("Dados insuficientes.")
+
+    # Mês corrente incompleto: sai do histórico e a previsão começa nele. O modelo direto já
+    # prevê o mês inteiro (h=1); a recursão diária só cobre os dias restantes e recebe o já observado.
+    parcial = incomplete_month(hist_daily.index)
+    if parcial is not None:
+        if modo == MODO_HIERARQUICO and parcial in fc_groups.index:
+            df_parcial = df_group[pd.to_datetime(df_group['data_uso']) >= parcial]
+            observado = df_parcial.groupby('departamento')['consumo'].sum()
+            fc_groups.loc[parcial] += observado.reindex(fc_groups.columns, fill_value=0.0)
+            fc_series = fc_groups.sum(axis=1)
+        elif modo == MODO_RECURSIVO and parcial in fc_series.index:
+            fc_series.loc[parcial] += hist_daily[hist_daily.index >= parcial].sum()
+        hist_daily = hist_daily[hist_daily.index < parcial]
+
+    fc_monthly = fc_series.reset_index()
+    fc_monthly.columns = ['Data', 'Consumo']
+    fc_monthly['Tipo'] = 'Previsão'
+
+    with span("previsao.resample"):
+        hist_monthly = hist_daily.resample('MS').sum().reset_index()
+    hist_monthly.columns = ['Data', 'Consumo']
+    hist_monthly['Tipo'] = 'Histórico'
+
+    with span("previsao.composicao"):
+        composition = load_composition(conn, id_empresa, departamentos, cargo)
+        if composition is None:
+            # No hierárquico, só a composição por grupo e dia da semana
+            composition = compute_composition(df_context)
+
+    return {"fc_monthly": fc_monthly, "hist_monthly": hist_monthly,
+            "composition": composition, "fc_groups": fc_groups, "estado_inicial": estado_inicial}
+
+def cached_forecast(conn, id_empresa, departamentos, cargo, horizon, modo):
+    # Resultado compartilhado entre réplicas e com a API; a versão dos modelos entra na chave
+    chave = make_key("previsao", id_empresa, tuple(departamentos), cargo, horizon, modo, model_version())
+    return get_cache().get_or_load(
+        chave, lambda: compute_forecast(conn, id_empresa, tuple(departamentos), cargo, horizon, modo), ttl=600
+    )
+
 # --- FUNÇÃO: DETETIVE DE CAUSAS ---
-def analyze_root_cause(df_history, forecast_val, df_raw_context):
+def analyze_root_cause(df_history, forecast_val, composition):
     # 1. Análise Estatística
     recent_avg = df_history['Consumo'].mean()
     recent_std = df_history['Consumo'].std()
@@ -126,14 +575,15 @@ def analyze_root_cause(df_history, forecast_val, df_raw_context):
         color = "green"
         msg = "✅ Consumo Projetado dentro da Normalidade"
 
-    # 2. Composição
+    # 2. Composição (volumes já agregados por dimensão, ver composicao.py)
     causes = []
-    total_vol = df_raw_context['consumo'].sum()
+    total_vol = composition["total"]
+    dims = composition["dimensoes"]
     
     if total_vol == 0: return status, color, msg, causes
 
     # A. Top Usuários
-    top_users = df_raw_context.groupby('usuario')['consumo'].sum().sort_values(ascending=False).head(3)
+    top_users = dims.get('usuario', pd.Series(dtype=float)).head(3)
     for user, vol in top_users.items():
         share = (vol / total_vol) * 100
         if share > 99:
@@ -142,47 +592,483 @@ def analyze_root_cause(df_history, forecast_val, df_raw_context):
             causes.append(f"👤 **Principal Usuário:** *{user}* concentra **{share:.1f}%** do consumo histórico analisado.")
 
     # B. Dispositivos
-    if 'dispositivo' in df_raw_context.columns:
-        top_devices = df_raw_context.groupby('dispositivo')['consumo'].sum().sort_values(ascending=False).head(1)
+    if 'dispositivo' in dims:
+        top_devices = dims['dispositivo'].head(1)
         for dev, vol in top_devices.items():
             share = (vol / total_vol) * 100
             if share > 30:
                 causes.append(f"📱 **Perfil de Hardware:** A maior parte do tráfego vem de dispositivos tipo *{dev}* ({share:.0f}%).")
 
     # C. Roaming
-    if 'situacao' in df_raw_context.columns:
-        risky_situations = df_raw_context[
-            df_raw_context['situacao'].str.contains('Roaming|Excesso|Bloqueado', case=False, na=False)
-        ]
-        if not risky_situations.empty:
-            vol_risk = risky_situations['consumo'].sum()
+    if 'situacao' in dims:
+        situacoes = dims['situacao']
+        risky = situacoes[situacoes.index.to_series().str.contains('Roaming|Excesso|Bloqueado', case=False, na=False).values]
+        if not risky.empty:
+            vol_risk = risky.sum()
             share_risk = (vol_risk / total_vol) * 100
             if share_risk > 1: 
                 causes.append(f"🌍 **Atenção de Status:** Detectado consumo em *Roaming/Excesso* representando {share_risk:.1f}% do total.")
 
     # D. Eventos
-    if 'evento' in df_raw_context.columns:
-        event_days = df_raw_context[
-            (df_raw_context['evento'].notna()) & 
-            (df_raw_context['evento'] != 'Nenhum')
-        ]['consumo'].sum()
+    if 'evento' in dims:
+        eventos = dims['evento']
+        event_days = eventos[eventos.index != 'Nenhum'].sum()
         if event_days > 0:
             causes.append("📅 **Sazonalidade:** O histórico contém Eventos Especiais que influenciam o cálculo.")
 
     # E. Fim de Semana
-    df_raw_context['is_weekend'] = pd.to_datetime(df_raw_context['data_uso']).dt.dayofweek >= 5
-    if not df_raw_context[df_raw_context['is_weekend']].empty:
-        weekend_vol = df_raw_context[df_raw_context['is_weekend']]['consumo'].sum()
-        weekend_share = (weekend_vol / total_vol) * 100
-        if weekend_share > 20:
-            causes.append(f"📆 **Padrão Temporal:** {weekend_share:.0f}% do consumo ocorre aos finais de semana.")
+    if 'dia_semana' in dims:
+        weekend_vol = dims['dia_semana'].get(FIM_DE_SEMANA, 0.0)
+        if weekend_vol > 0:
+            weekend_share = (weekend_vol / total_vol) * 100
+            if weekend_share > 20:
+                causes.append(f"📆 **Padrão Temporal:** {weekend_share:.0f}% do consumo ocorre aos finais de semana.")
 
     if not causes:
         causes.append("📈 **Crescimento Orgânico:** Aumento de volume distribuído, sem um ofensor isolado.")
 
     return status, color, msg, causes
 
+# --- GRÁFICOS ---
+TIPOS_GRAFICO = ["Tendência Conectada", "Volumetria vs Média", "Variação % (MoM)"]
+
+def build_chart(tipo_grafico, fc_monthly, hist_monthly, cargo_label):
+    """
+    Monta a figura do tipo pedido. Retorna (figura, texto de apoio ou None).
+    """
+    # Plotly só é carregado quando há previsão para desenhar
+    import plotly.graph_objects as go
+
+    last_3_months = hist_monthly.tail(3).copy()
+    avg_hist = hist_monthly['Consumo'].mean()
+    texto_analise = None
+
+    # --- GRÁFICO 1: TENDÊNCIA CONECTADA ---
+    if tipo_grafico == "Tendência Conectada":
+        fig = go.Figure()
+
+        # Trace Histórico (com Hover personalizado)
+        fig.add_trace(go.Scatter(
+            x=last_3_months['Data'], 
+            y=last_3_months['Consumo'],
+            mode='lines+markers', 
+            name='Histórico Recente', 
+            line=dict(color='#1F77B4', width=3),
+            hovertemplate="<b>📅 Mês:</b> %{x|%b/%Y}<br><b>📼 Tipo:</b> Histórico Real<br><b>📉 Consumo:</b> %{y:.0f} GB<br><i>Dados reais do banco de dados.</i><extra></extra>"
+        ))
+
+        # Trace Previsão
+        connect_point = last_3_months.iloc[-1:]
+        fc_connected = pd.concat([connect_point, fc_monthly])
+
+        fig.add_trace(go.Scatter(
+            x=fc_connected['Data'], 
+            y=fc_connected['Consumo'],
+            mode='lines+markers', 
+            name='Projeção IA', 
+            line=dict(color='#E60000', width=3, dash='dot'),
+            hovertemplate="<b>📅 Mês:</b> %{x|%b/%Y}<br><b>🔮 Tipo:</b> Projeção IA<br><b>🚀 Estimativa:</b> %{y:.0f} GB<br><i>Valor calculado pelo algoritmo LightGBM.</i><extra></extra>"
+        ))
+
+        fig.update_layout(title=f"Trajetória: {cargo_label}", xaxis_title="Mês", yaxis_title="GB")
+
+    # --- GRÁFICO 2: VOLUMETRIA vs MÉDIA ---
+    elif tipo_grafico == "Volumetria vs Média":
+        fig = go.Figure()
+
+        # Dados customizados para o Hover (Cálculo da diferença)
+        diffs = fc_monthly['Consumo'] - avg_hist
+        status_text = ["Acima da média" if d > 0 else "Abaixo da média" for d in diffs]
+
+        fig.add_trace(go.Bar(
+            x=fc_monthly['Data'].dt.strftime('%b/%Y'), 
+            y=fc_monthly['Consumo'],
+            name='Previsão', 
+            marker_color='#E60000', 
+            text=fc_monthly['Consumo'],
+            texttemplate='%{text:.0f}',
+            textposition='auto',
+            # Passamos dados extras para o tooltip
+            customdata=np.stack((diffs, status_text), axis=-1),
+            hovertemplate="<b>📅 %{x}</b><br>📦 <b>Volume:</b> %{y:.0f} GB<br>📏 <b>Média Histórica:</b> " + f"{avg_hist:.0f} GB" + "<br>⚖️ <b>Análise:</b> %{customdata[0]:.0f} GB (%{customdata[1]})<extra></extra>"
+        ))
+
+        fig.add_hline(y=avg_hist, line_dash="dash", line_color="gray", annotation_text="Média Histórica")
+        fig.update_layout(title=f"Volume vs Média ({avg_hist:.0f} GB)")
+
+    # --- GRÁFICO 3: VARIAÇÃO % (MoM) ---
+    elif tipo_grafico == "Variação % (MoM)":
+        df_pct = fc_monthly.copy()
+        last_real = last_3_months.iloc[-1]['Consumo']
+        df_pct = pd.concat([pd.DataFrame({'Consumo': [last_real]}), df_pct], ignore_index=True)
+        df_pct['Variação %'] = df_pct['Consumo'].pct_change() * 100
+        df_pct = df_pct.dropna()
+        df_pct['Data'] = fc_monthly['Data'].values
+
+        # Cria texto explicativo para o hover
+        hover_texts = []
+        for val in df_pct['Variação %']:
+            trend = "Aumento" if val > 0 else "Redução"
+            hover_texts.append(f"{trend} projetada de {abs(val):.1f}% em relação ao mês anterior.")
+
+        fig = go.Figure()
+        fig.add_trace(go.Bar(
+            x=df_pct['Data'].dt.strftime('%b/%Y'), 
+            y=df_pct['Variação %'],
+            marker_color=df_pct['Variação %'].apply(lambda x: '#2ca02c' if x < 0 else '#d62728'),
+            # Texto visual na barra (limpo)
+            text=df_pct['Variação %'],
+            texttemplate='%{text:+.1f}%', 
+            textposition='outside',
+            # Texto explicativo no mouse (detalhado)
+            customdata=hover_texts,
+            hovertemplate="<b>📅 %{x}</b><br>📊 <b>Variação:</b> %{y:+.1f}%<br>📝 <b>Significado:</b> %{customdata}<extra></extra>"
+        ))
+
+        # Trava o zoom para não ficar "gigante" se houver outlier
+        max_val = df_pct['Variação %'].abs().max()
+        limit = max(50, max_val * 1.2) # Dá uma margem de respiro
+
+        fig.update_layout(
+            title="Variação Mensal (%) - Aceleração do Consumo",
+            yaxis_title="Variação vs Mês Anterior",
+            yaxis_range=[-limit, limit] # Centraliza o zero
+        )
+
+        # Texto de apoio abaixo
+        if not df_pct.empty:
+            max_increase = df_pct['Variação %'].max()
+            max_decrease = df_pct['Variação %'].min()
+            idx_max = df_pct['Variação %'].idxmax()
+            month_max = df_pct.loc[idx_max, 'Data'].strftime('%B')
+
+            texto_analise = "##### 📝 Análise de Tendência:\n"
+            if max_increase > 0:
+                texto_analise += f"- O pico de aceleração está previsto para **{month_max}**, com um salto de **+{max_increase:.1f}%**.\n"
+            else:
+                texto_analise += "- Tendência predominante de estabilidade ou queda.\n"
+
+            if max_decrease < -5:
+                texto_analise += f"- Nota-se uma redução significativa de **{max_decrease:.1f}%** em determinado momento."
+            elif max_increase < 1 and max_decrease > -1:
+                texto_analise += "- O consumo apresenta estabilidade quase total."
+
+    return fig, texto_analise
+
+def get_chart(tipo_grafico):
+    # Figuras memoizadas por (previsão, tipo): trocar o tipo não reconstrói as demais
+    figures = st.session_state.setdefault('figures', {})
+    key = (st.session_state['forecast_id'], tipo_grafico)
+    if key not in figures:
+        with span("dashboard.grafico"):
+            figures[key] = build_chart(
+                tipo_grafico,
+                st.session_state['fc_data'],
+                st.session_state['hist_data'],
+                st.session_state['target_cargo']
+            )
+    return figures[key]
+
+def get_diagnosis():
+    # Diagnóstico calculado uma vez por previsão
+    diagnosis = st.session_state.get('diagnosis')
+    if not diagnosis or diagnosis[0] != st.session_state['forecast_id']:
+        fc_monthly = st.session_state['fc_data']
+        with span("dashboard.diagnostico"):
+            result = analyze_root_cause(
+                st.session_state['hist_data'], fc_monthly['Consumo'].mean(), st.session_state['composition']
+            )
+        diagnosis = (st.session_state['forecast_id'], result)
+        st.session_state['diagnosis'] = diagnosis
+    return diagnosis[1]
+
 # --- UI PRINCIPAL ---
+# Cada seção é um fragmento: interagir com um widget reexecuta só a sua seção.
+def render_filters(df_main):
+    st.subheader("Filtros de Cenário")
+    c1, c2 = st.columns(2)
+    all_depts = sorted(df_main['Departamento'].unique())
+    selected_depts = c1.multiselect("1. Departamento(s):", all_depts, default=[])
+    
+    if selected_depts:
+        avail_cargos = sorted(df_main[df_main['Departamento'].isin(selected_depts)]['Cargo'].unique())
+    else:
+        avail_cargos = []
+    selected_cargos = c2.multiselect("2. Cargo (Alvo da IA):", avail_cargos, default=[])
+    return selected_depts, selected_cargos
+
+@st.fragment
+def render_top_consumers(conn, id_empresa, selected_depts, selected_cargos):
+    with st.expander("⚡ Maiores Consumidores Recentes"):
+        h1, h2 = st.columns(2)
+        dim_hh = h1.selectbox("Dimensão:", DIMENSOES_SKETCH, key="hh_dim")
+        dias_hh = h2.slider("Últimos dias:", 1, 90, 30, key="hh_dias")
+        segmentos = tuple(f"{d}|{c}" for d in selected_depts for c in selected_cargos)
+        resultado = load_top_consumers(conn, id_empresa, dim_hh, dias_hh, segmentos)
+        if not resultado or not resultado[0]:
+            st.info("Sketches indisponíveis — rode `heavy_hitters.py` para gerá-los.")
+        else:
+            top, volume_total = resultado
+            df_top = pd.DataFrame(top).rename(columns={
+                "item": "Item", "volume_estimado": "Consumo Estimado (GB)",
+                "volume_minimo": "Mínimo Garantido (GB)", "erro_cms": "Erro Máx. (GB)"
+            })
+            st.dataframe(df_top, use_container_width=True, hide_index=True)
+            st.caption(f"Estimativa por sketches sobre {volume_total:.0f} GB no período. "
+                       "O erro máximo vale com 98% de confiança.")
+
+@st.fragment
+def render_user_drilldown(conn, id_empresa, selected_depts, selected_cargos):
+    # Só consulta quando aberto: o corpo de um expander rodaria a cada rerun
+    if not st.checkbox("👥 Detalhar consumo por usuário", key="drill_on"):
+        return
+
+    c1, c2, c3 = st.columns([2, 1, 1])
+    busca = c1.text_input("Buscar usuário:", key="drill_busca")
+    ordenacao = c2.selectbox("Ordenar por:", list(ORDENACOES), key="drill_ordem")
+    periodo = c3.selectbox("Período (dias):", list(PERIODOS), index=1, key="drill_periodo")
+
+    # Filtro, busca ou ordenação diferentes: volta para a primeira página
+    assinatura = (id_empresa, tuple(selected_depts), tuple(selected_cargos), busca, ordenacao, periodo)
+    if st.session_state.get('drill_assinatura') != assinatura:
+        st.session_state['drill_assinatura'] = assinatura
+        st.session_state['drill_cursores'] = [None]
+    cursores = st.session_state['drill_cursores']
+
+    resultado = load_user_page(conn, id_empresa, tuple(selected_depts), tuple(selected_cargos),
+                               periodo, ordenacao, busca, cursores[-1])
+    if resultado is None:
+        st.info("Resumo por usuário indisponível — rode `detalhe_usuarios.py` para gerá-lo.")
+        return
+    df_page, proxima = resultado
+    total = load_user_count(conn, id_empresa, tuple(selected_depts), tuple(selected_cargos), busca)
+
+    if df_page.empty:
+        st.info("Nenhum usuário encontrado.")
+    else:
+        st.dataframe(pd.DataFrame({
+            "Usuário": df_page['nome'],
+            "Departamento": df_page['departamento'],
+            "Cargo": df_page['cargo'],
+            f"Consumo {periodo}d (GB)": df_page['consumo'].round(2),
+            "Plano (GB)": df_page['limite_gigas'],
+            "Uso do Plano (%)": (df_page['consumo'] / (df_page['limite_gigas'] * periodo / 30) * 100).round(1),
+            "Anomalia": np.where(df_page['anomalia'], "⚠️", ""),
+            "Último Uso": df_page['ultimo_uso'],
+        }), use_container_width=True, hide_index=True)
+
+    atualizado_em = load_summary_updated_at(conn, id_empresa)
+    if atualizado_em is not None:
+        defasagem = pd.Timestamp.now() - pd.Timestamp(atualizado_em)
+        texto = f"Resumo atualizado em {atualizado_em:%d/%m/%Y %H:%M}."
+        if defasagem > pd.Timedelta(days=1):
+            st.warning(f"{texto} Rode `detalhe_usuarios.py` ou o detector contínuo para atualizá-lo.")
+        else:
+            st.caption(texto)
+
+    n1, n2, n3 = st.columns([1, 3, 1])
+    if n1.button("◀ Anterior", key="drill_prev", disabled=len(cursores) == 1):
+        cursores.pop()
+        st.rerun(scope="fragment")
+    paginas = max(1, -(-total // TAMANHO_PAGINA))
+    n2.caption(f"Página {len(cursores)} de {paginas} · {total} usuário(s) no filtro")
+    if n3.button("Próxima ▶", key="drill_next", disabled=proxima is None):
+        cursores.append(proxima)
+        st.rerun(scope="fragment")
+
+@st.fragment
+def render_billing(conn, id_empresa, selected_depts, selected_cargos):
+    if not st.checkbox("💳 Excedentes de plano no mês", key="fat_on"):
+        return
+    meses = load_billing_months(conn, id_empresa)
+    if not meses:
+        st.info("Faturamento indisponível — rode `faturamento.py` para gerá-lo.")
+        return
+    mes = st.selectbox("Mês:", meses, format_func=lambda m: m.strftime("%m/%Y"), key="fat_mes")
+    df_fat = load_billing(conn, id_empresa, mes, tuple(selected_depts), tuple(selected_cargos))
+    if df_fat is None or df_fat.empty:
+        st.info("Nenhum faturamento no filtro para o mês.")
+        return
+
+    m1, m2, m3 = st.columns(3)
+    m1.metric("Usuários acima do plano", f"{int(df_fat['usuarios_acima'].sum())} de {int(df_fat['usuarios'].sum())}")
+    m2.metric("Excedente", f"{df_fat['excedente_gb'].sum():.2f} GB")
+    m3.metric("Custo do Excedente", f"R$ {df_fat['custo_excedente'].sum():,.2f}")
+    acima = df_fat[df_fat['excedente_gb'] > 0]
+    if not acima.empty:
+        st.dataframe(pd.DataFrame({
+            "Usuário": acima['usuario'],
+            "Consumo (GB)": acima['consumo_gb'].round(2),
+            "Plano (GB)": acima['limite_gb'],
+            "Excedente (GB)": acima['excedente_gb'].round(2),
+            "Custo Total": acima['custo_total'].round(2),
+            "Custo do Excedente": acima['custo_excedente'].round(2),
+            "Estourou em": acima['primeiro_estouro'],
+        }), use_container_width=True, hide_index=True)
+
+@st.fragment
+def render_locations(conn, id_empresa, selected_depts, selected_cargos):
+    if not st.checkbox("🗺️ Consumo por localização", key="loc_on"):
+        return
+    df_loc = load_locations(conn, id_empresa, tuple(selected_depts), tuple(selected_cargos))
+    if df_loc is None or df_loc.empty:
+        st.info("Nenhum consumo com localização no filtro.")
+        return
+
+    no_mapa = df_loc.dropna(subset=['latitude', 'longitude'])
+    if not no_mapa.empty:
+        # Raio do ponto (m) proporcional à raiz do consumo: áreas comparáveis entre cidades
+        raio = np.sqrt(no_mapa['consumo'] / no_mapa['consumo'].max()) * 60000
+        st.map(no_mapa.assign(raio=raio), latitude='latitude', longitude='longitude', size='raio')
+    st.dataframe(pd.DataFrame({
+        "Localização": df_loc['localizacao'],
+        "Consumo (GB)": df_loc['consumo'].round(2),
+        "Usuários": df_loc['usuarios'],
+        "Registros": df_loc['registros'],
+    }), use_container_width=True, hide_index=True)
+
+def build_export_file(id_empresa, formato, departamentos, cargos, inicio, fim):
+    """
+    Arquivo temporário com a exportação, escrito em pedaços a partir do cursor server-side,
+    numa conexão própria (roda na thread do download, fora do script da sessão).
+    """
+    arquivo = tempfile.TemporaryFile()
+    conn = psycopg2.connect(**DB_PARAMS)
+    try:
+        for pedaco in stream_export(conn, formato, id_empresa, departamentos, cargos, inicio, fim):
+            arquivo.write(pedaco)
+    finally:
+        conn.close()
+    arquivo.seek(0)
+    return arquivo
+
+@st.fragment
+def render_export(id_empresa, selected_depts, selected_cargos, periodo_total):
+    if not st.checkbox("📥 Exportar registros do filtro", key="exp_on"):
+        return
+    e1, e2 = st.columns([2, 1])
+    periodo = e1.date_input("Período:", value=periodo_total, min_value=periodo_total[0],
+                            max_value=periodo_total[1], key="exp_periodo")
+    formato = e2.radio("Formato:", list(FORMATOS_EXPORTACAO), horizontal=True, key="exp_formato")
+    if len(periodo) != 2:
+        st.info("Selecione a data final do período.")
+        return
+    inicio, fim = (d.isoformat() for d in periodo)
+    nome = export_filename(id_empresa, formato, inicio, fim)
+
+    if API_URL:
+        query = urlencode({"empresa": id_empresa, "formato": formato, "departamentos": ",".join(selected_depts),
+                           "cargos": ",".join(selected_cargos), "inicio": inicio, "fim": fim})
+        st.link_button("Baixar", f"{API_URL}/exportacao?{query}")
+    else:
+        # Gerado só no clique, fora do script; o Streamlit guarda o arquivo pronto em memória
+        st.download_button(
+            "Baixar", lambda: build_export_file(id_empresa, formato, tuple(selected_depts),
+                                                tuple(selected_cargos), inicio, fim),
+            file_name=nome, mime=FORMATOS_EXPORTACAO[formato][0], on_click="ignore", key="exp_baixar"
+        )
+        st.caption("Para exportações grandes, configure FULLTIME_API_URL: o download passa a vir da API "
+                   "em streaming, sem ocupar a memória do dashboard.")
+
+@st.fragment
+def render_forecast(conn, id_empresa, selected_depts, cargo_target):
+    col_in1, col_in2 = st.columns(2)
+    horizon = col_in1.slider("Projetar meses:", 1, 12, 6)
+    modo = col_in2.radio("Modo de previsão:", [MODO_RECURSIVO, MODO_DIRETO, MODO_HIERARQUICO], horizontal=True)
+
+    if st.session_state.pop('forecast_msg', False):
+        st.success("Previsão Gerada!")
+    estado = st.session_state.get('estado_inicial') if st.session_state.get('forecast_done') else None
+    if estado:
+        texto = (f"Feature store atualizado em {estado['atualizado_em']:%d/%m/%Y %H:%M}, "
+                 f"com registros até {estado['ultimo_dia']:%d/%m/%Y}.")
+        if estado['defasado']:
+            st.warning(f"{texto} Está atrás do histórico: a previsão partiu dos registros brutos. "
+                       "Rode `atualiza_feature_store.py`.")
+        else:
+            st.caption(texto)
+    
+    if st.button("Gerar Previsão", type="primary"):
+        with st.spinner("Processando algoritmos LightGBM..."):
+            try:
+                with span("dashboard.previsao"):
+                    result = cached_forecast(conn, id_empresa, tuple(selected_depts), cargo_target, horizon, modo)
+            except ForecastUnavailable as e:
+                st.error(str(e))
+                return
+
+            st.session_state['forecast_id'] = uuid.uuid4().hex
+            st.session_state['figures'] = {}
+            st.session_state['fc_data'] = result['fc_monthly']
+            st.session_state['hist_data'] = result['hist_monthly']
+            st.session_state['composition'] = result['composition']
+            st.session_state['target_empresa'] = id_empresa
+            st.session_state['target_cargo'] = cargo_target
+            st.session_state['target_depts'] = tuple(selected_depts)
+            st.session_state['fc_groups'] = result['fc_groups']
+            st.session_state['estado_inicial'] = result.get('estado_inicial')
+            st.session_state['forecast_done'] = True
+            st.session_state['forecast_msg'] = True
+        # Nova previsão: diagnóstico e gráficos precisam ser redesenhados
+        st.rerun()
+
+@st.fragment
+def render_diagnosis(conn):
+    composition = st.session_state['composition']
+    cargo_label = st.session_state['target_cargo']
+
+    st.markdown("### 🕵️ Diagnóstico e Composição")
+    status, color, msg, causes = get_diagnosis()
+    
+    if status == "NORMAL": st.success(msg, icon="✅")
+    elif status == "WARNING": st.warning(msg, icon="⚠️")
+    else: st.error(msg, icon="🚨")
+    
+    if causes:
+        with st.expander("🔍 Ver Detalhes da Composição (Dispositivos, Usuários, etc.)", expanded=True):
+            for cause in causes: st.markdown(f"- {cause}")
+            st.caption("Análise baseada nos padrões históricos associados a este cargo.")
+
+    with st.expander("🏆 Maiores Contribuintes por Dimensão"):
+        dim = st.selectbox("Dimensão:", DIMENSOES)
+        st.dataframe(
+            top_contributors(composition, dim, n=10).rename(columns={
+                "valor": "Item", "consumo": "Consumo (GB)", "participacao": "Participação (%)"
+            }),
+            use_container_width=True, hide_index=True
+        )
+
+    # Drill-down da previsão hierárquica: reconciliada sob demanda
+    fc_groups = st.session_state.get('fc_groups')
+    if fc_groups is not None:
+        if st.checkbox("👥 Detalhar previsão por usuário (top-down)"):
+            shares = load_user_shares(
+                conn, st.session_state['target_empresa'], st.session_state['target_depts'], cargo_label
+            )
+            if shares.empty:
+                st.info("Sem histórico recente para calcular as proporções.")
+            else:
+                st.dataframe(reconcile_top_down(fc_groups, shares), use_container_width=True, hide_index=True)
+                st.caption("Previsão de cada grupo distribuída pela participação do usuário nos últimos 90 dias.")
+
+@st.fragment
+def render_charts():
+    fc_monthly = st.session_state['fc_data']
+
+    st.markdown("#### Análise Gráfica")
+    c_vis1, c_vis2 = st.columns([1, 3])
+    with c_vis1:
+        tipo_grafico = st.radio("Visualização:", TIPOS_GRAFICO)
+        st.markdown("---")
+        st.metric("Total Previsto", f"{fc_monthly['Consumo'].sum():.0f} GB")
+
+    with c_vis2:
+        fig, texto_analise = get_chart(tipo_grafico)
+        st.plotly_chart(fig, use_container_width=True)
+        if texto_analise:
+            st.info(texto_analise)
+
+@timed("dashboard.pagina")
 def show_dashboard_ui():
     st.title("🔗 Dashboard de Previsão Inteligente")
 
@@ -191,22 +1077,21 @@ def show_dashboard_ui():
         st.error("Falha na conexão com o banco.")
         return
 
-    df_main = load_main_data(conn)
+    id_empresa = select_tenant(conn)
+    if id_empresa is None:
+        st.warning("Nenhuma empresa cadastrada.")
+        return
+    # Previsão de outra empresa não vale para a sessão atual
+    if st.session_state.get('target_empresa') not in (None, id_empresa):
+        st.session_state.pop('forecast_done', None)
+
+    df_main = load_page_data(id_empresa)
     if df_main.empty:
         st.warning("Banco de dados vazio ou inacessível.")
         return
 
     # --- FILTROS ---
-    st.subheader("Filtros de Cenário")
-    c1, c2 = st.columns(2)
-    all_depts = sorted(df_main['Departamento'].unique())
-    selected_depts = c1.multiselect("1. Departamento(s):", all_depts, default=[])
-    
-    if selected_depts:
-        avail_cargos = sorted(df_main[df_main['Departamento'].isin(selected_depts)]['Cargo'].unique())
-    else:
-        avail_cargos = []
-    selected_cargos = c2.multiselect("2. Cargo (Alvo da IA):", avail_cargos, default=[])
+    selected_depts, selected_cargos = render_filters(df_main)
 
     if not selected_depts or not selected_cargos:
         st.info("👆 Selecione Departamento e Cargo para habilitar a IA.")
@@ -218,6 +1103,20 @@ def show_dashboard_ui():
         (df_main['Cargo'].isin(selected_cargos))
     ]
     st.metric("Histórico Total do Filtro", f"{df_filtered['Consumo (GB)'].sum():.2f} GB")
+
+    render_top_consumers(conn, id_empresa, selected_depts, selected_cargos)
+    render_user_drilldown(conn, id_empresa, selected_depts, selected_cargos)
+    render_billing(conn, id_empresa, selected_depts, selected_cargos)
+    render_locations(conn, id_empresa, selected_depts, selected_cargos)
+    render_export(id_empresa, selected_depts, selected_cargos,
+                  (df_main['data_uso'].min().date(), df_main['data_uso'].max().date()))
+
+    # Anomalias correntes (detector contínuo, sem rodar o modelo)
+    df_anomalies = load_current_anomalies(conn, id_empresa, tuple(selected_depts), tuple(selected_cargos))
+    if not df_anomalies.empty:
+        n_crit = int((df_anomalies['Severidade'] == 'CRITICAL').sum())
+        with st.expander(f"🚨 {len(df_anomalies)} anomalia(s) nos últimos 7 dias ({n_crit} crítica(s))"):
+            st.dataframe(df_anomalies, use_container_width=True, hide_index=True)
     st.divider()
 
     # --- GERAÇÃO DE PREVISÃO ---
@@ -225,238 +1124,12 @@ def show_dashboard_ui():
     
     if len(selected_cargos) > 1:
         st.warning("⚠️ Selecione apenas **1 Cargo**.")
-    else:
-        cargo_target = selected_cargos[0]
-        col_in1, col_in2 = st.columns(2)
-        horizon = col_in1.slider("Projetar meses:", 1, 12, 6)
-        
-        if st.button("Gerar Previsão", type="primary"):
-            with st.spinner("Processando algoritmos LightGBM..."):
-                modelo = load_model()
-                if not modelo:
-                    st.error("Modelo não encontrado.")
-                    return
-
-                df_raw = load_ml_data(conn)
-                df_context = df_raw[
-                    (df_raw['cargo'] == cargo_target) &
-                    (df_raw['departamento'].isin(selected_depts))
-                ]
-                
-                if df_context.empty:
-                    st.error("Sem dados.")
-                    return
-
-                df_fe = prepare_features(df_context)
-                unique_users = df_fe['id_usuario'].unique()
-                last_date = df_fe['data'].max()
-                future_dates = pd.date_range(last_date + pd.Timedelta(days=1), periods=horizon*30)
-                
-                cols_model = ["year", "month", "day", "dayofweek", "weekofyear", "is_weekend",
-                              "lag_1", "lag_7", "lag_30", "rolling_7", "rolling_30",
-                              "cargo", "departamento", "evento", "dispositivo", "situacao"]
-                cat_cols = ["cargo", "departamento", "evento", "dispositivo", "situacao"]
-                
-                all_forecasts = []
-                for uid in unique_users:
-                    user_hist = df_fe[df_fe['id_usuario'] == uid].sort_values('data')
-                    if len(user_hist) < 15: continue
-                    hist_vals = user_hist['consumo_dados_gb'].tail(60).tolist()
-                    user_std = np.std(hist_vals) if len(hist_vals) > 1 else 1.0
-                    meta = user_hist.iloc[-1]
-                    preds = []
-                    for date_fc in future_dates:
-                        feat = {
-                            'year': date_fc.year, 'month': date_fc.month, 'day': date_fc.day,
-                            'dayofweek': date_fc.dayofweek, 'weekofyear': date_fc.isocalendar().week,
-                            'is_weekend': 1 if date_fc.dayofweek >= 5 else 0,
-                            'lag_1': hist_vals[-1],
-                            'lag_7': hist_vals[-7] if len(hist_vals)>=7 else hist_vals[-1],
-                            'lag_30': hist_vals[-30] if len(hist_vals)>=30 else hist_vals[-1],
-                            'rolling_7': np.mean(hist_vals[-7:]), 'rolling_30': np.mean(hist_vals[-30:]),
-                        }
-                        for c in cat_cols: feat[c] = meta[c]
-                        X = pd.DataFrame([feat])
-                        for c in cat_cols: X[c] = X[c].astype('category')
-                        base_pred = modelo.predict(X[cols_model])[0]
-                        noise = np.random.normal(0, user_std * 0.6) 
-                        val = max(0, (base_pred + noise) * 1.001)
-                        hist_vals.append(val)
-                        preds.append(val)
-                    all_forecasts.append(pd.Series(preds, index=future_dates))
-                
-                if all_forecasts:
-                    fc_daily = pd.concat(all_forecasts, axis=1).sum(axis=1)
-                    fc_monthly = fc_daily.resample('MS').sum().reset_index()
-                    fc_monthly.columns = ['Data', 'Consumo']
-                    fc_monthly['Tipo'] = 'Previsão'
-                    
-                    hist_daily = df_fe.groupby('data')['consumo_dados_gb'].sum()
-                    hist_monthly = hist_daily.resample('MS').sum().reset_index()
-                    hist_monthly.columns = ['Data', 'Consumo'] 
-                    hist_monthly['Tipo'] = 'Histórico'
-
-                    st.session_state['fc_data'] = fc_monthly
-                    st.session_state['hist_data'] = hist_monthly
-                    st.session_state['raw_context'] = df_context
-                    st.session_state['target_cargo'] = cargo_target
-                    st.session_state['forecast_done'] = True
-                    st.success("Previsão Gerada!")
-                else:
-                    st.error("Dados insuficientes.")
-
-        # --- VISUALIZAÇÃO ---
-        if st.session_state.get('forecast_done'):
-            
-            fc_monthly = st.session_state['fc_data']
-            hist_monthly = st.session_state['hist_data']
-            df_raw_context = st.session_state['raw_context']
-            cargo_label = st.session_state['target_cargo']
-
-            # Diagnóstico
-            st.markdown("### 🕵️ Diagnóstico e Composição")
-            forecast_avg_val = fc_monthly['Consumo'].mean()
-            status, color, msg, causes = analyze_root_cause(hist_monthly, forecast_avg_val, df_raw_context)
-            
-            if status == "NORMAL": st.success(msg, icon="✅")
-            elif status == "WARNING": st.warning(msg, icon="⚠️")
-            else: st.error(msg, icon="🚨")
-            
-            if causes:
-                with st.expander("🔍 Ver Detalhes da Composição (Dispositivos, Usuários, etc.)", expanded=True):
-                    for cause in causes: st.markdown(f"- {cause}")
-                    st.caption("Análise baseada nos padrões históricos associados a este cargo.")
-
-            st.divider()
-
-            # Gráficos
-            st.markdown("#### Análise Gráfica")
-            last_3_months = hist_monthly.tail(3).copy()
-            avg_hist = hist_monthly['Consumo'].mean()
-
-            c_vis1, c_vis2 = st.columns([1, 3])
-            with c_vis1:
-                tipo_grafico = st.radio(
-                    "Visualização:",
-                    ["Tendência Conectada", "Volumetria vs Média", "Variação % (MoM)"]
-                )
-                st.markdown("---")
-                st.metric("Total Previsto", f"{fc_monthly['Consumo'].sum():.0f} GB")
-
-            with c_vis2:
-                
-                # --- GRÁFICO 1: TENDÊNCIA CONECTADA ---
-                if tipo_grafico == "Tendência Conectada":
-                    fig = go.Figure()
-                    
-                    # Trace Histórico (com Hover personalizado)
-                    fig.add_trace(go.Scatter(
-                        x=last_3_months['Data'], 
-                        y=last_3_months['Consumo'],
-                        mode='lines+markers', 
-                        name='Histórico Recente', 
-                        line=dict(color='#1F77B4', width=3),
-                        hovertemplate="<b>📅 Mês:</b> %{x|%b/%Y}<br><b>📼 Tipo:</b> Histórico Real<br><b>📉 Consumo:</b> %{y:.0f} GB<br><i>Dados reais do banco de dados.</i><extra></extra>"
-                    ))
-                    
-                    # Trace Previsão
-                    connect_point = last_3_months.iloc[-1:]
-                    fc_connected = pd.concat([connect_point, fc_monthly])
-                    
-                    fig.add_trace(go.Scatter(
-                        x=fc_connected['Data'], 
-                        y=fc_connected['Consumo'],
-                        mode='lines+markers', 
-                        name='Projeção IA', 
-                        line=dict(color='#E60000', width=3, dash='dot'),
-                        hovertemplate="<b>📅 Mês:</b> %{x|%b/%Y}<br><b>🔮 Tipo:</b> Projeção IA<br><b>🚀 Estimativa:</b> %{y:.0f} GB<br><i>Valor calculado pelo algoritmo LightGBM.</i><extra></extra>"
-                    ))
-                    
-                    fig.update_layout(title=f"Trajetória: {cargo_label}", xaxis_title="Mês", yaxis_title="GB")
-                    st.plotly_chart(fig, use_container_width=True)
-                
-                # --- GRÁFICO 2: VOLUMETRIA vs MÉDIA ---
-                elif tipo_grafico == "Volumetria vs Média":
-                    fig = go.Figure()
-                    
-                    # Dados customizados para o Hover (Cálculo da diferença)
-                    diffs = fc_monthly['Consumo'] - avg_hist
-                    status_text = ["Acima da média" if d > 0 else "Abaixo da média" for d in diffs]
-                    
-                    fig.add_trace(go.Bar(
-                        x=fc_monthly['Data'].dt.strftime('%b/%Y'), 
-                        y=fc_monthly['Consumo'],
-                        name='Previsão', 
-                        marker_color='#E60000', 
-                        text=fc_monthly['Consumo'],
-                        texttemplate='%{text:.0f}',
-                        textposition='auto',
-                        # Passamos dados extras para o tooltip
-                        customdata=np.stack((diffs, status_text), axis=-1),
-                        hovertemplate="<b>📅 %{x}</b><br>📦 <b>Volume:</b> %{y:.0f} GB<br>📏 <b>Média Histórica:</b> " + f"{avg_hist:.0f} GB" + "<br>⚖️ <b>Análise:</b> %{customdata[0]:.0f} GB (%{customdata[1]})<extra></extra>"
-                    ))
-                    
-                    fig.add_hline(y=avg_hist, line_dash="dash", line_color="gray", annotation_text="Média Histórica")
-                    fig.update_layout(title=f"Volume vs Média ({avg_hist:.0f} GB)")
-                    st.plotly_chart(fig, use_container_width=True)
-                    
-                # --- GRÁFICO 3: VARIAÇÃO % (MoM) ---
-                elif tipo_grafico == "Variação % (MoM)":
-                    df_pct = fc_monthly.copy()
-                    last_real = last_3_months.iloc[-1]['Consumo']
-                    df_pct = pd.concat([pd.DataFrame({'Consumo': [last_real]}), df_pct], ignore_index=True)
-                    df_pct['Variação %'] = df_pct['Consumo'].pct_change() * 100
-                    df_pct = df_pct.dropna()
-                    df_pct['Data'] = fc_monthly['Data'].values
-                    
-                    # Cria texto explicativo para o hover
-                    hover_texts = []
-                    for val in df_pct['Variação %']:
-                        trend = "Aumento" if val > 0 else "Redução"
-                        hover_texts.append(f"{trend} projetada de {abs(val):.1f}% em relação ao mês anterior.")
-
-                    fig = go.Figure()
-                    fig.add_trace(go.Bar(
-                        x=df_pct['Data'].dt.strftime('%b/%Y'), 
-                        y=df_pct['Variação %'],
-                        marker_color=df_pct['Variação %'].apply(lambda x: '#2ca02c' if x < 0 else '#d62728'),
-                        # Texto visual na barra (limpo)
-                        text=df_pct['Variação %'],
-                        texttemplate='%{text:+.1f}%', 
-                        textposition='outside',
-                        # Texto explicativo no mouse (detalhado)
-                        customdata=hover_texts,
-                        hovertemplate="<b>📅 %{x}</b><br>📊 <b>Variação:</b> %{y:+.1f}%<br>📝 <b>Significado:</b> %{customdata}<extra></extra>"
-                    ))
-                    
-                    # Trava o zoom para não ficar "gigante" se houver outlier
-                    max_val = df_pct['Variação %'].abs().max()
-                    limit = max(50, max_val * 1.2) # Dá uma margem de respiro
-                    
-                    fig.update_layout(
-                        title="Variação Mensal (%) - Aceleração do Consumo",
-                        yaxis_title="Variação vs Mês Anterior",
-                        yaxis_range=[-limit, limit] # Centraliza o zero
-                    )
-                    
-                    st.plotly_chart(fig, use_container_width=True)
-
-                    # Texto de apoio abaixo
-                    if not df_pct.empty:
-                        max_increase = df_pct['Variação %'].max()
-                        max_decrease = df_pct['Variação %'].min()
-                        idx_max = df_pct['Variação %'].idxmax()
-                        month_max = df_pct.loc[idx_max, 'Data'].strftime('%B')
-                        
-                        texto_analise = "##### 📝 Análise de Tendência:\n"
-                        if max_increase > 0:
-                            texto_analise += f"- O pico de aceleração está previsto para **{month_max}**, com um salto de **+{max_increase:.1f}%**.\n"
-                        else:
-                            texto_analise += "- Tendência predominante de estabilidade ou queda.\n"
-                            
-                        if max_decrease < -5:
-                            texto_analise += f"- Nota-se uma redução significativa de **{max_decrease:.1f}%** em determinado momento."
-                        elif max_increase < 1 and max_decrease > -1:
-                            texto_analise += "- O consumo apresenta estabilidade quase total."
-                            
-                        st.info(texto_analise)
\ No newline at end of file
+        return
+
+    render_forecast(conn, id_empresa, selected_depts, selected_cargos[0])
+
+    # --- VISUALIZAÇÃO ---
+    if st.session_state.get('forecast_done'):
+        render_diagnosis(conn)
+        st.divider()
+        render_charts()
@@ -0,0 +1,151 @@
+# detalhe_usuarios.py
+import argparse
+import psycopg2
+import pandas as pd
+
+from conexao import DB_PARAMS
+
+# Janelas pré-calculadas em resumo_consumo_usuario (coluna indexada de cada uma)
+PERIODOS = {7: "consumo_7d", 30: "consumo_30d", 90: "consumo_90d"}
+ORDENACOES = {
+    "Maior consumo": ("consumo", True),
+    "Menor consumo": ("consumo", False),
+    "Nome (A-Z)": ("nome", False),
+}
+TAMANHO_PAGINA = 50
+
+PAGE_QUERY = """
+WITH pagina AS (
+    SELECT r.id_usuario, r.nome, r.id_departamento, r.id_cargo, r.{coluna} AS consumo, r.ultimo_uso
+    FROM resumo_consumo_usuario r
+    WHERE r.id_empresa = %(id_empresa)s
+      AND r.id_departamento IN (SELECT id_departamento FROM departamentos WHERE nome = ANY(%(departamentos)s))
+      AND r.id_cargo IN (SELECT id_cargo FROM cargos WHERE nome = ANY(%(cargos)s))
+      AND (%(busca)s::text IS NULL OR r.nome ILIKE %(busca)s)
+      {keyset}
+    ORDER BY r.{ordem} {direcao}, r.id_usuario {direcao}
+    LIMIT %(limite)s
+),
+ref_anomalia AS (
+    -- Referência da própria empresa: outra com dados mais novos não esconde estas anomalias
+    SELECT MAX(data_uso) - INTERVAL '7 days' AS desde FROM eventos_anomalia WHERE id_empresa = %(id_empresa)s
+)
+SELECT
+    p.id_usuario,
+    p.nome,
+    dep.nome AS departamento,
+    c.nome AS cargo,
+    p.consumo,
+    c.limite_gigas,
+    p.ultimo_uso,
+    EXISTS (
+        SELECT 1 FROM eventos_anomalia a, ref_anomalia ra
+        WHERE a.id_usuario = p.id_usuario AND a.data_uso >= ra.desde
+    ) AS anomalia
+FROM pagina p
+JOIN departamentos dep ON p.id_departamento = dep.id_departamento
+JOIN cargos c ON p.id_cargo = c.id_cargo
+ORDER BY p.{ordem_saida} {direcao}, p.id_usuario {direcao};
+"""
+
+COUNT_QUERY = """
+SELECT COUNT(*)
+FROM resumo_consumo_usuario r
+WHERE r.id_empresa = %(id_empresa)s
+  AND r.id_departamento IN (SELECT id_departamento FROM departamentos WHERE nome = ANY(%(departamentos)s))
+  AND r.id_cargo IN (SELECT id_cargo FROM cargos WHERE nome = ANY(%(cargos)s))
+  AND (%(busca)s::text IS NULL OR r.nome ILIKE %(busca)s);
+"""
+
+
+def search_pattern(texto):
+    # Busca por trecho do nome (índice trigram); escapa os curingas do LIKE
+    texto = (texto or "").strip()
+    if not texto:
+        return None
+    return "%" + texto.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+def fetch_user_page(conn, id_empresa, departamentos, cargos, periodo=30, ordenacao="Maior consumo",
+                    busca=None, apos=None, limite=TAMANHO_PAGINA):
+    """
+    Uma página do detalhamento por usuário com paginação keyset: `apos` é a chave
+    (valor da ordenação, id_usuario) da última linha da página anterior, então cada página
+    é uma leitura de índice a partir dessa posição, sem OFFSET.
+    Retorna (DataFrame, chave da próxima página ou None).
+    """
+    coluna = PERIODOS[periodo]
+    campo, desc = ORDENACOES[ordenacao]
+    ordem = coluna if campo == "consumo" else "nome"
+    direcao = "DESC" if desc else "ASC"
+    keyset = ""
+    if apos is not None:
+        keyset = f"AND (r.{ordem}, r.id_usuario) {'<' if desc else '>'} (%(apos_valor)s, %(apos_id)s)"
+
+    query = PAGE_QUERY.format(coluna=coluna, ordem=ordem, direcao=direcao, keyset=keyset,
+                              ordem_saida="consumo" if campo == "consumo" else "nome")
+    params = {
+        "id_empresa": id_empresa, "departamentos": list(departamentos), "cargos": list(cargos),
+        "busca": search_pattern(busca), "limite": limite + 1,
+    }
+    if apos is not None:
+        params["apos_valor"], params["apos_id"] = apos
+
+    df = pd.read_sql_query(query, conn, params=params)
+    proxima = None
+    if len(df) > limite:
+        df = df.iloc[:limite]
+        ultima = df.iloc[-1]
+        valor = float(ultima["consumo"]) if campo == "consumo" else ultima["nome"]
+        proxima = (valor, int(ultima["id_usuario"]))
+    return df, proxima
+
+
+def count_users(conn, id_empresa, departamentos, cargos, busca=None):
+    with conn.cursor() as cur:
+        cur.execute(COUNT_QUERY, {
+            "id_empresa": id_empresa, "departamentos": list(departamentos), "cargos": list(cargos),
+            "busca": search_pattern(busca),
+        })
+        return cur.fetchone()[0]
+
+
+def summary_updated_at(conn, id_empresa):
+    # Último REFRESH do resumo (None se a empresa não tiver linhas)
+    with conn.cursor() as cur:
+        cur.execute("SELECT MAX(atualizado_em) FROM resumo_consumo_usuario WHERE id_empresa = %s;", (id_empresa,))
+        return cur.fetchone()[0]
+
+
+def refresh_summary(conn):
+    """
+    Recalcula resumo_consumo_usuario. Chamado no fim de popula_banco.py e de compactacao.py,
+    periodicamente pelo detector de anomalias (modos contínuos) e por este script.
+    CONCURRENTLY: o dashboard continua lendo a versão anterior durante a atualização.
+    """
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY resumo_consumo_usuario;")
+    finally:
+        conn.autocommit = autocommit
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Atualiza o resumo de consumo por usuário (detalhamento do dashboard).")
+    parser.parse_args()
+
+    conn = psycopg2.connect(**DB_PARAMS)
+    try:
+        refresh_summary(conn)
+        print("[OK] resumo_consumo_usuario atualizado.")
+    except Exception as e:
+        print("[ERRO] Falha ao atualizar o resumo:", e)
+        raise
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+# detector_anomalias.py
+import argparse
+import math
+import select
+import time
+import psycopg2
+from psycopg2.extras import execute_values
+
+from conexao import DB_PARAMS
+from detalhe_usuarios import refresh_summary
+
+# --- PARÂMETROS DO DETECTOR ---
+EWMA_ALPHA = 0.1          # peso do valor novo na média móvel exponencial
+Z_LIMITE = 3.0            # desvios-padrão acima da média histórica do usuário
+Z_CRITICO = 4.0
+EWMA_LIMITE = 3.0         # desvios acima da EWMA (reage a mudanças recentes)
+MIN_AMOSTRAS = 10         # registros mínimos antes de começar a sinalizar
+BATCH_SIZE = 5000
+CANAL_NOTIFY = "log_uso_sim_novo"
+# Modos contínuos: intervalo mínimo entre atualizações do resumo por usuário (só com registros novos)
+RESUMO_INTERVALO_S = 300
+NOME_WATERMARK = "detector_anomalias"
+
+
+def new_state():
+    return {"n": 0, "media": 0.0, "m2": 0.0, "ewma": 0.0, "ewm_var": 0.0}
+
+
+def score(state, x):
+    """
+    Compara o valor novo com o estado atual (antes de incluí-lo).
+    Retorna (zscore, desvio_ewma) ou (None, None) se ainda não há amostras suficientes.
+    """
+    if state["n"] < MIN_AMOSTRAS:
+        return None, None
+    std = math.sqrt(state["m2"] / (state["n"] - 1)) if state["n"] > 1 else 0.0
+    ewm_std = math.sqrt(state["ewm_var"])
+    z = (x - state["media"]) / std if std > 0 else 0.0
+    ewma_dev = (x - state["ewma"]) / ewm_std if ewm_std > 0 else 0.0
+    return z, ewma_dev
+
+
+def update_state(state, x):
+    """
+    Atualização O(1): Welford para média/variância e EWMA (com variância exponencial).
+    """
+    n = state["n"] + 1
+    delta = x - state["media"]
+    media = state["media"] + delta / n
+    m2 = state["m2"] + delta * (x - media)
+
+    if state["n"] == 0:
+        ewma, ewm_var = x, 0.0
+    else:
+        diff = x - state["ewma"]
+        ewma = state["ewma"] + EWMA_ALPHA * diff
+        ewm_var = (1 - EWMA_ALPHA) * (state["ewm_var"] + EWMA_ALPHA * diff * diff)
+    return {"n": n, "media": media, "m2": m2, "ewma": ewma, "ewm_var": ewm_var}
+
+
+def classify(z, ewma_dev):
+    if z is None:
+        return None
+    if z >= Z_CRITICO:
+        return "CRITICAL"
+    if z >= Z_LIMITE or ewma_dev >= EWMA_LIMITE:
+        return "WARNING"
+    return None
+
+
+def apply_rows(rows, states):
+    """
+    Aplica um lote de registros (id_transacao, id_log, id_empresa, id_usuario, data_uso, consumo)
+    aos estados por usuário (`states` é atualizado no lugar) e retorna os eventos de anomalia.
+    O estado de cada usuário evolui na ordem do uso, não na de inserção.
+    """
+    events = []
+    for _, id_log, id_empresa, id_usuario, data_uso, consumo in sorted(rows, key=lambda r: (r[3], r[4])):
+        state = states.get(id_usuario) or new_state()
+        z, ewma_dev = score(state, consumo)
+        severidade = classify(z, ewma_dev)
+        if severidade:
+            events.append((id_empresa, id_usuario, id_log, data_uso, consumo, state["media"], z, ewma_dev, severidade))
+        states[id_usuario] = update_state(state, consumo)
+    return events
+
+
+def get_watermark(cursor):
+    # Cursor (id_transacao, id_log) do último registro processado
+    cursor.execute("""
+        SELECT ultimo_id_transacao::text, ultimo_id_log FROM watermark_detector WHERE nome = %s;
+    """, (NOME_WATERMARK,))
+    row = cursor.fetchone()
+    return row if row else ("0", 0)
+
+
+def load_states(cursor, user_ids):
+    cursor.execute("""
+        SELECT id_usuario, n, media, m2, ewma, ewm_var
+        FROM estado_anomalia_usuario
+        WHERE id_usuario = ANY(%s);
+    """, (list(user_ids),))
+    return {
+        row[0]: {"n": row[1], "media": row[2], "m2": row[3], "ewma": row[4], "ewm_var": row[5]}
+        for row in cursor.fetchall()
+    }
+
+
+def process_batch(conn, batch_size=BATCH_SIZE):
+    """
+    Processa os registros novos (acima do watermark) numa transação: atualiza o estado de
+    cada usuário, grava os eventos de anomalia e avança o watermark.
+    O cursor segue a transação que inseriu cada registro, não o id_log: só entram
+    transações anteriores à mais antiga ainda aberta (pg_snapshot_xmin), que não podem
+    mais gerar registros. Um id_log menor confirmado depois não é pulado; em troca, uma
+    transação longa aberta atrasa o detector até terminar.
+    """
+    cursor = conn.cursor()
+    ultimo_xid, ultimo_id_log = get_watermark(cursor)
+    cursor.execute("""
+        SELECT id_transacao::text, id_log, id_empresa, id_usuario, data_uso, consumo_dados_gb::float
+        FROM log_uso_sim
+        WHERE (id_transacao, id_log) > (%(xid)s::xid8, %(id_log)s)
+          AND id_transacao < pg_snapshot_xmin(pg_current_snapshot())
+        ORDER BY id_transacao, id_log
+        LIMIT %(limite)s;
+    """, {"xid": ultimo_xid, "id_log": ultimo_id_log, "limite": batch_size})
+    rows = cursor.fetchall()
+    if not rows:
+        conn.rollback()
+        cursor.close()
+        return 0
+
+    states = load_states(cursor, {r[3] for r in rows})
+    events = apply_rows(rows, states)
+
+    if events:
+        execute_values(cursor, """
+            INSERT INTO eventos_anomalia
+                (id_empresa, id_usuario, id_log, data_uso, consumo_dados_gb, media_usuario, zscore, desvio_ewma, severidade)
+            VALUES %s;
+        """, events)
+
+    execute_values(cursor, """
+        INSERT INTO estado_anomalia_usuario (id_usuario, n, media, m2, ewma, ewm_var)
+        VALUES %s
+        ON CONFLICT (id_usuario) DO UPDATE SET
+            n = EXCLUDED.n, media = EXCLUDED.media, m2 = EXCLUDED.m2,
+            ewma = EXCLUDED.ewma, ewm_var = EXCLUDED.ewm_var, atualizado_em = NOW();
+    """, [(uid, s["n"], s["media"], s["m2"], s["ewma"], s["ewm_var"]) for uid, s in states.items()])
+
+    cursor.execute("""
+        INSERT INTO watermark_detector (nome, ultimo_id_transacao, ultimo_id_log) VALUES (%s, %s::xid8, %s)
+        ON CONFLICT (nome) DO UPDATE SET
+            ultimo_id_transacao = EXCLUDED.ultimo_id_transacao,
+            ultimo_id_log = EXCLUDED.ultimo_id_log,
+            atualizado_em = NOW();
+    """, (NOME_WATERMARK, rows[-1][0], rows[-1][1]))
+    conn.commit()
+    cursor.close()
+    print(f"[OK] {len(rows)} registros processados, {len(events)} anomalias.")
+    return len(rows)
+
+
+def drain(conn, batch_size=BATCH_SIZE):
+    total = 0
+    while True:
+        n = process_batch(conn, batch_size)
+        total += n
+        if n < batch_size:
+            return total
+
+
+class SummaryRefresher:
+    # Atualiza resumo_consumo_usuario no máximo a cada RESUMO_INTERVALO_S, se chegou registro novo
+    def __init__(self, conn, intervalo=RESUMO_INTERVALO_S):
+        self.conn = conn
+        self.intervalo = intervalo
+        self.pendente = False
+        self.ultima = 0.0
+
+    def after_drain(self, processados):
+        self.pendente = self.pendente or processados > 0
+        if self.pendente and time.monotonic() - self.ultima >= self.intervalo:
+            try:
+                refresh_summary(self.conn)
+                self.pendente = False
+            except psycopg2.Error as e:
+                self.conn.rollback()
+                print("[ERRO] Falha ao atualizar o resumo por usuário:", e)
+            self.ultima = time.monotonic()
+
+
+def run_polling(conn, interval=30, batch_size=BATCH_SIZE):
+    # Modo simples: consulta o watermark periodicamente
+    resumo = SummaryRefresher(conn)
+    while True:
+        resumo.after_drain(drain(conn, batch_size))
+        time.sleep(interval)
+
+
+def run_listen(conn, timeout=60, batch_size=BATCH_SIZE):
+    """
+    Modo LISTEN/NOTIFY: o trigger de log_uso_sim avisa a cada comando INSERT.
+    O timeout garante uma varredura periódica mesmo se alguma notificação se perder.
+    """
+    listen_conn = psycopg2.connect(**DB_PARAMS)
+    listen_conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+    listen_conn.cursor().execute(f"LISTEN {CANAL_NOTIFY};")
+    print(f"[OK] Aguardando notificações em '{CANAL_NOTIFY}'.")
+    resumo = SummaryRefresher(conn)
+    try:
+        resumo.after_drain(drain(conn, batch_size))
+        while True:
+            select.select([listen_conn], [], [], timeout)
+            listen_conn.poll()
+            listen_conn.notifies.clear()
+            resumo.after_drain(drain(conn, batch_size))
+    finally:
+        listen_conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Detector contínuo de anomalias de consumo por usuário.")
+    parser.add_argument("--modo", choices=["uma-vez", "polling", "listen"], default="uma-vez",
+                        help="uma-vez: processa o que houver e sai; polling: consulta periódica; "
+                             "listen: acorda via LISTEN/NOTIFY.")
+    parser.add_argument("--intervalo", type=int, default=30, help="Segundos entre consultas no modo polling.")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**DB_PARAMS)
+    try:
+        if args.modo == "polling":
+            run_polling(conn, args.intervalo)
+        elif args.modo == "listen":
+            run_listen(conn)
+        else:
+            total = drain(conn)
+            print(f"[OK] {total} registros processados no total.")
+    except KeyboardInterrupt:
+        print("[OK] Detector encerrado.")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
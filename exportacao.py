@@ -0,0 +1,208 @@
+# exportacao.py
+import argparse
+import csv
+import io
+import os
+from datetime import datetime
+
+import psycopg2
+
+from compactacao import uso_diario
+from conexao import DB_PARAMS
+from kpis import FILTRO_USO
+
+# --- CONFIGURAÇÃO ---
+# Linhas por ida ao cursor server-side: a memória do processo fica limitada a um lote,
+# qualquer que seja o tamanho da exportação (também é o tamanho do row group do Parquet)
+EXPORTACAO_LOTE = int(os.getenv("FULLTIME_EXPORTACAO_LOTE", "20000"))
+
+# formato -> (media type, extensão)
+FORMATOS_EXPORTACAO = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+# Registros do filtro com os nomes das dimensões. Inclui o histórico compactado
+# (compactacao.py) em resolução diária: `registros` > 1 indica uma linha de resumo.
+EXPORT_QUERY = f"""
+SELECT
+    l.data_uso,
+    u.id_usuario,
+    u.nome AS usuario,
+    dep.nome AS departamento,
+    c.nome AS cargo,
+    l.consumo_dados_gb::float AS consumo_gb,
+    l.custo_total::float AS custo_total,
+    l.registros,
+    evt.nome_eventos AS evento,
+    disp.nome_dispositivo AS dispositivo,
+    s.situacao AS situacao,
+    loc.nome AS localizacao
+FROM {uso_diario(FILTRO_USO)} l
+JOIN usuario u ON l.id_usuario = u.id_usuario
+JOIN departamentos dep ON u.id_departamento = dep.id_departamento
+JOIN cargos c ON u.id_cargo = c.id_cargo
+LEFT JOIN eventos_especiais evt ON l.id_evento = evt.id_evento
+LEFT JOIN dispositivos disp ON l.id_dispositivo = disp.id_dispositivo
+LEFT JOIN situacao s ON l.id_situacao = s.id_situacao
+LEFT JOIN localizacoes loc ON l.id_localizacao = loc.id_localizacao
+WHERE (%(departamentos)s::text[] IS NULL OR dep.nome = ANY(%(departamentos)s::text[]))
+  AND (%(cargos)s::text[] IS NULL OR c.nome = ANY(%(cargos)s::text[]))
+ORDER BY l.data_uso;
+"""
+
+
+def export_schema():
+    # Esquema fixo: um lote só com nulos numa coluna não muda o tipo do arquivo
+    import pyarrow as pa
+
+    return pa.schema([
+        ("data_uso", pa.timestamp("us")),
+        ("id_usuario", pa.int64()),
+        ("usuario", pa.string()),
+        ("departamento", pa.string()),
+        ("cargo", pa.string()),
+        ("consumo_gb", pa.float64()),
+        ("custo_total", pa.float64()),
+        ("registros", pa.int64()),
+        ("evento", pa.string()),
+        ("dispositivo", pa.string()),
+        ("situacao", pa.string()),
+        ("localizacao", pa.string()),
+    ])
+
+
+def iter_batches(conn, id_empresa, departamentos=None, cargos=None, inicio=None, fim=None):
+    """
+    Lotes de até EXPORTACAO_LOTE linhas do filtro, lidos com cursor server-side.
+    O primeiro item é a lista de colunas. A transação (só leitura) termina junto com o
+    gerador, inclusive se o consumidor parar no meio (ex.: download cancelado).
+    """
+    cur = conn.cursor(name=f"exportacao_{id_empresa}")
+    cur.itersize = EXPORTACAO_LOTE
+    try:
+        cur.execute(EXPORT_QUERY, {
+            "id_empresa": id_empresa,
+            "inicio": inicio,
+            "fim": fim,
+            "departamentos": list(departamentos) if departamentos else None,
+            "cargos": list(cargos) if cargos else None,
+        })
+        # Cursor nomeado só tem description depois da primeira leitura
+        rows = cur.fetchmany(EXPORTACAO_LOTE)
+        yield [c[0] for c in cur.description]
+        while rows:
+            yield rows
+            rows = cur.fetchmany(EXPORTACAO_LOTE)
+    finally:
+        cur.close()
+        conn.rollback()
+
+
+def iter_csv(batches):
+    colunas = next(batches)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM: o Excel abre acentos corretamente
+    buffer.write("\ufeff")
+    writer.writerow(colunas)
+    for rows in batches:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+class _ChunkSink(io.RawIOBase):
+    # Destino do ParquetWriter que só acumula os bytes escritos até o próximo drain()
+    def __init__(self):
+        super().__init__()
+        self.partes = []
+        self.posicao = 0
+
+    def writable(self):
+        return True
+
+    def write(self, dados):
+        self.partes.append(bytes(dados))
+        self.posicao += len(dados)
+        return len(dados)
+
+    def tell(self):
+        return self.posicao
+
+    def drain(self):
+        dados = b"".join(self.partes)
+        self.partes = []
+        return dados
+
+
+def iter_parquet(batches):
+    # Um row group por lote, enviado assim que é escrito; o rodapé sai no fim
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    colunas = next(batches)
+    schema = export_schema()
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    try:
+        for rows in batches:
+            dados = {nome: [row[i] for row in rows] for i, nome in enumerate(colunas)}
+            writer.write_table(pa.Table.from_pydict(dados, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def stream_export(conn, formato, id_empresa, departamentos=None, cargos=None, inicio=None, fim=None):
+    """
+    Pedaços (bytes) do arquivo de exportação no `formato` (ver FORMATOS_EXPORTACAO).
+    A consulta só começa quando o primeiro pedaço é pedido.
+    """
+    if formato not in FORMATOS_EXPORTACAO:
+        raise ValueError(f"Formato inválido: {formato}")
+    batches = iter_batches(conn, id_empresa, departamentos, cargos, inicio, fim)
+    return iter_csv(batches) if formato == "csv" else iter_parquet(batches)
+
+
+def export_filename(id_empresa, formato, inicio=None, fim=None):
+    periodo = f"_{inicio or 'inicio'}_{fim or 'fim'}" if inicio or fim else ""
+    return f"uso_empresa_{id_empresa}{periodo}_{datetime.now():%Y%m%d%H%M}.{FORMATOS_EXPORTACAO[formato][1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exporta os registros de uso de um filtro para CSV ou Parquet.")
+    parser.add_argument("--empresa", type=int, required=True)
+    parser.add_argument("--formato", choices=list(FORMATOS_EXPORTACAO), default="csv")
+    parser.add_argument("--departamentos", help="Nomes separados por vírgula; padrão: todos.")
+    parser.add_argument("--cargos", help="Nomes separados por vírgula; padrão: todos.")
+    parser.add_argument("--inicio", help="Data inicial (AAAA-MM-DD).")
+    parser.add_argument("--fim", help="Data final, inclusive (AAAA-MM-DD).")
+    parser.add_argument("--saida", help="Arquivo de saída; padrão: nome gerado na pasta atual.")
+    args = parser.parse_args()
+
+    departamentos = [d for d in (args.departamentos or "").split(",") if d]
+    cargos = [c for c in (args.cargos or "").split(",") if c]
+    caminho = args.saida or export_filename(args.empresa, args.formato, args.inicio, args.fim)
+
+    conn = psycopg2.connect(**DB_PARAMS)
+    try:
+        tamanho = 0
+        with open(caminho, "wb") as f:
+            for pedaco in stream_export(conn, args.formato, args.empresa, departamentos, cargos, args.inicio, args.fim):
+                f.write(pedaco)
+                tamanho += len(pedaco)
+        print(f"[OK] Exportação gravada em {caminho} ({tamanho / 1024 ** 2:.1f} MB).")
+    except Exception as e:
+        print("[ERRO] Falha na exportação:", e)
+        raise
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
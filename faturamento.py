@@ -0,0 +1,222 @@
+# faturamento.py
+import argparse
+from datetime import datetime
+
+import pandas as pd
+import psycopg2
+
+from conexao import DB_PARAMS
+from kpis import FILTRO_EMPRESA
+
+# Níveis de leitura: nome público -> (expressão exibida, agrupamento)
+NIVEIS_FATURAMENTO = {
+    "usuario": ("u.nome", "f.id_usuario, u.nome"),
+    "departamento": ("dep.nome", "dep.nome"),
+    "cargo": ("c.nome", "c.nome"),
+}
+
+# Recalcula, numa única instrução, cada usuário-mês com registros das transações em
+# [desde, ate) (log_uso_sim.id_transacao).
+# O acumulado do mês por dia (janela) dá o dia do estouro e quanto de cada dia passou
+# do plano; o custo do excedente usa o custo médio por GB daquele dia.
+REFRESH_QUERY = """
+WITH afetados AS (
+    SELECT DISTINCT id_empresa, id_usuario, DATE_TRUNC('month', data_uso)::date AS mes
+    FROM log_uso_sim
+    WHERE id_transacao >= %(desde)s::xid8 AND id_transacao < %(ate)s::xid8
+),
+diario AS (
+    SELECT
+        a.id_empresa,
+        a.id_usuario,
+        a.mes,
+        l.data_uso::date AS dia,
+        SUM(l.consumo_dados_gb)::float AS consumo,
+        -- custo_total aceita NULL: conta como 0, como na compactação
+        COALESCE(SUM(l.custo_total), 0)::float AS custo,
+        COUNT(*) AS registros
+    FROM afetados a
+    JOIN log_uso_sim l ON l.id_empresa = a.id_empresa
+        AND l.id_usuario = a.id_usuario
+        AND l.data_uso >= a.mes
+        AND l.data_uso < a.mes + INTERVAL '1 month'
+    GROUP BY a.id_empresa, a.id_usuario, a.mes, l.data_uso::date
+),
+acumulado AS (
+    SELECT
+        d.*,
+        c.limite_gigas AS limite,
+        SUM(d.consumo) OVER (PARTITION BY d.id_empresa, d.id_usuario, d.mes ORDER BY d.dia) AS acum
+    FROM diario d
+    JOIN usuario u ON d.id_usuario = u.id_usuario
+    JOIN cargos c ON u.id_cargo = c.id_cargo
+),
+excesso AS (
+    -- Sem plano (limite NULL) o GREATEST devolve 0: nada de excedente
+    SELECT
+        a.*,
+        GREATEST(0, a.acum - a.limite) - GREATEST(0, a.acum - a.consumo - a.limite) AS excedente
+    FROM acumulado a
+)
+INSERT INTO faturamento_mensal
+    (id_empresa, id_usuario, mes, consumo_gb, limite_gb, excedente_gb,
+     custo_total, custo_excedente, dia_estouro, registros)
+SELECT
+    id_empresa,
+    id_usuario,
+    mes,
+    SUM(consumo),
+    MAX(limite),
+    SUM(excedente),
+    COALESCE(SUM(custo), 0),
+    COALESCE(SUM(CASE WHEN consumo > 0 THEN custo * excedente / consumo ELSE 0 END), 0),
+    MIN(dia) FILTER (WHERE acum > limite),
+    SUM(registros)
+FROM excesso
+GROUP BY id_empresa, id_usuario, mes
+ON CONFLICT (id_empresa, id_usuario, mes) DO UPDATE SET
+    consumo_gb = EXCLUDED.consumo_gb,
+    limite_gb = EXCLUDED.limite_gb,
+    excedente_gb = EXCLUDED.excedente_gb,
+    custo_total = EXCLUDED.custo_total,
+    custo_excedente = EXCLUDED.custo_excedente,
+    dia_estouro = EXCLUDED.dia_estouro,
+    registros = EXCLUDED.registros,
+    atualizado_em = NOW();
+"""
+
+MESES_QUERY = f"""
+SELECT DISTINCT mes FROM faturamento_mensal
+WHERE {FILTRO_EMPRESA.format(col='id_empresa')}
+ORDER BY mes DESC;
+"""
+
+
+def get_watermark(cursor):
+    cursor.execute("SELECT xid_limite::text FROM watermark_faturamento;")
+    row = cursor.fetchone()
+    return row[0] if row else "0"
+
+
+def refresh_billing(conn, full=False):
+    """
+    Atualiza faturamento_mensal com os registros acima do watermark, numa transação.
+    O limite superior é a transação mais antiga ainda aberta (pg_snapshot_xmin): as anteriores
+    não geram mais registros, então um id_log confirmado fora de ordem não fica sem faturar;
+    as abertas ficam para a próxima rodada.
+    Com `full`, recalcula todo o histórico ainda bruto (ex.: depois de mudar limite_gigas);
+    meses já compactados (compactacao.py) não têm mais os registros e são mantidos.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT pg_snapshot_xmin(pg_current_snapshot())::text;")
+    ate = cursor.fetchone()[0]
+    if full:
+        cursor.execute("""
+            DELETE FROM faturamento_mensal
+            WHERE mes >= (SELECT DATE_TRUNC('month', MIN(data_uso))::date FROM log_uso_sim);
+        """)
+        desde = "0"
+    else:
+        desde = get_watermark(cursor)
+    if int(ate) <= int(desde):
+        conn.rollback()
+        cursor.close()
+        print("[OK] Nenhum registro novo para o faturamento.")
+        return 0
+
+    cursor.execute(REFRESH_QUERY, {"desde": desde, "ate": ate})
+    atualizados = cursor.rowcount
+    cursor.execute("""
+        INSERT INTO watermark_faturamento (xid_limite) VALUES (%s::xid8)
+        ON CONFLICT (unica) DO UPDATE SET xid_limite = EXCLUDED.xid_limite, atualizado_em = NOW();
+    """, (ate,))
+    conn.commit()
+    cursor.close()
+    print(f"[OK] {atualizados} usuário-mês recalculados (transações {desde} -> {ate}).")
+    return atualizados
+
+
+def parse_month(texto):
+    # "AAAA-MM" (ou uma data) -> primeiro dia do mês; None/vazio = mês mais recente
+    if not texto:
+        return None
+    return datetime.strptime(str(texto)[:7], "%Y-%m").date()
+
+
+def fetch_months(conn, id_empresa=None):
+    with conn.cursor() as cur:
+        cur.execute(MESES_QUERY, {"id_empresa": id_empresa})
+        return [row[0] for row in cur.fetchall()]
+
+
+def fetch_billing(conn, id_empresa=None, mes=None, nivel="usuario", departamentos=None, cargos=None):
+    """
+    Faturamento já materializado de um mês (o mais recente se `mes` for None), por `nivel`
+    (ver NIVEIS_FATURAMENTO), opcionalmente restrito a departamentos/cargos.
+    Só lê faturamento_mensal: nada é recalculado a partir do log.
+    """
+    if nivel not in NIVEIS_FATURAMENTO:
+        raise ValueError(f"Nível inválido: {nivel}")
+    coluna, grupo = NIVEIS_FATURAMENTO[nivel]
+    query = f"""
+    SELECT
+        {coluna} AS {nivel},
+        TO_CHAR(MAX(f.mes), 'YYYY-MM') AS mes,
+        COUNT(*) AS usuarios,
+        COUNT(*) FILTER (WHERE f.excedente_gb > 0) AS usuarios_acima,
+        SUM(f.consumo_gb) AS consumo_gb,
+        SUM(f.limite_gb) AS limite_gb,
+        SUM(f.excedente_gb) AS excedente_gb,
+        SUM(f.custo_total) AS custo_total,
+        SUM(f.custo_excedente) AS custo_excedente,
+        MIN(f.dia_estouro) AS primeiro_estouro
+    FROM faturamento_mensal f
+    JOIN usuario u ON f.id_usuario = u.id_usuario
+    JOIN departamentos dep ON u.id_departamento = dep.id_departamento
+    JOIN cargos c ON u.id_cargo = c.id_cargo
+    WHERE {FILTRO_EMPRESA.format(col='f.id_empresa')}
+      AND f.mes = COALESCE(%(mes)s::date, (
+          SELECT MAX(mes) FROM faturamento_mensal WHERE {FILTRO_EMPRESA.format(col='id_empresa')}
+      ))
+      AND (%(departamentos)s::text[] IS NULL OR dep.nome = ANY(%(departamentos)s::text[]))
+      AND (%(cargos)s::text[] IS NULL OR c.nome = ANY(%(cargos)s::text[]))
+    GROUP BY {grupo}
+    ORDER BY excedente_gb DESC, consumo_gb DESC;
+    """
+    return pd.read_sql_query(query, conn, params={
+        "id_empresa": id_empresa,
+        "mes": mes,
+        "departamentos": list(departamentos) if departamentos else None,
+        "cargos": list(cargos) if cargos else None,
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Faturamento mensal: consumo contra o plano, excedente e custo.")
+    parser.add_argument("--completo", action="store_true",
+                        help="Recalcula todo o histórico em vez de só os registros novos.")
+    parser.add_argument("--resumo", choices=list(NIVEIS_FATURAMENTO),
+                        help="Depois de atualizar, mostra o faturamento do mês por este nível.")
+    parser.add_argument("--empresa", type=int, help="Restringe o resumo a uma empresa.")
+    parser.add_argument("--mes", help="Mês do resumo (AAAA-MM); padrão: o mais recente.")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**DB_PARAMS)
+    try:
+        refresh_billing(conn, full=args.completo)
+        if args.resumo:
+            df = fetch_billing(conn, args.empresa, parse_month(args.mes), args.resumo)
+            if df.empty:
+                print("[OK] Nenhum faturamento para o filtro.")
+            else:
+                print(df.to_string(index=False))
+    except Exception as e:
+        conn.rollback()
+        print("[ERRO] Falha ao atualizar o faturamento:", e)
+        raise
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
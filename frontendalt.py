@@ -1,7 +1,8 @@
 import streamlit as st
 import os
-import pandas as pd
-import psycopg2
+import memoria
+import metricas
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 from streamlit_option_menu import option_menu
 
 # --- 1. CONFIGURAÇÃO DA PÁGINA ---
@@ -19,14 +20,11 @@ def init_connection():
     Estabelece a conexão com o banco PostgreSQL.
     Retorna None se falhar.
     """
+    import psycopg2
+    from conexao import DB_PARAMS
+
     try:
-        return psycopg2.connect(
-            host="localhost",
-            port="5433",
-            user="postgres",
-            password="1234",
-            database="ANALISE"
-        )
+        return psycopg2.connect(**DB_PARAMS)
     except Exception:
         return None
 
@@ -34,58 +32,35 @@ def get_kpis_from_db():
     """
     Busca métricas reais. 
     Se falhar, retorna 0 (Zero). Não inventa dados.
+    As consultas rodam em paralelo (kpis.py); as que falharem ficam zeradas.
     """
-    conn = init_connection()
-
-    # Inicializa zerado
-    dados = {
-        "usuarios": 0,
-        "consumo_hoje": 0.0,
-        "alertas": 0,
-        "status": "Offline" 
-    }
-
-    if conn:
-        try:
-            cur = conn.cursor()
-
-            # 1. Total de Usuários
-            cur.execute("SELECT COUNT(*) FROM usuario;")
-            result_users = cur.fetchone()
-            if result_users:
-                dados["usuarios"] = result_users[0]
-
-            # 2. Consumo
-            cur.execute("""
-                SELECT SUM(consumo_dados_gb)
-                FROM log_uso_sim
-                WHERE data_referencia = (SELECT MAX(data_referencia) FROM log_uso_sim);
-            """)
-            result_consumo = cur.fetchone()
-            if result_consumo and result_consumo[0]:
-                dados["consumo_hoje"] = result_consumo[0]
-
-            # 3. Alertas
-            cur.execute("""
-                SELECT COUNT(*)
-                FROM log_uso_sim l
-                JOIN altera_excesso a ON l.id_alerta = a.id_alerta
-                WHERE a.nome_alerta = 'True';
-            """)
-            result_alertas = cur.fetchone()
-            if result_alertas:
-                dados["alertas"] = result_alertas[0]
-
-            dados["status"] = "Online"
-            cur.close()
-            conn.close()
-        except Exception as e:
-            st.error(f"Erro na query SQL: {e}")
-            if conn:
-                conn.close()
+    from kpis import fetch_kpis_concurrent
+
+    # Com ?empresa=<id> na URL os KPIs ficam restritos à empresa
+    empresa = st.query_params.get("empresa", "")
+    with metricas.span("home.kpis"):
+        dados, erros = fetch_kpis_concurrent(int(empresa) if empresa.isdigit() else None)
+    for nome, erro in erros.items():
+        if nome != "conexao":
+            st.error(f"Erro na query SQL ({nome}): {erro}")
 
     return dados
 
+def get_breach_alerts():
+    """
+    Alertas de estouro do plano mais urgentes (alertas_estouro.py), no mesmo pool dos KPIs.
+    DataFrame vazio se a consulta falhar.
+    """
+    import pandas as pd
+    from alertas_estouro import fetch_alerts
+    from consultas_paralelas import run_concurrent
+
+    empresa = st.query_params.get("empresa", "")
+    id_empresa = int(empresa) if empresa.isdigit() else None
+    with metricas.span("home.alertas"):
+        resultados, _ = run_concurrent({"alertas": lambda conn: fetch_alerts(conn, id_empresa)})
+    return resultados.get("alertas", pd.DataFrame())
+
 # --- 3. ESTILO CSS ---
 def local_css():
     st.markdown("""
@@ -151,6 +126,8 @@ def local_css():
     """, unsafe_allow_html=True)
 
 local_css()
+# Spans deste rerun (painel de depuração no fim da página)
+metricas.start_trace()
 
 # --- 4. BARRA LATERAL ---
 with st.sidebar:
@@ -178,15 +155,16 @@ with st.sidebar:
     st.markdown("---")
     st.caption("Versão 1.2.1 | Fulltime")
     
-    # Verificação de status na Sidebar
-    db_conn = init_connection()
-    if db_conn:
+    # Verificação de status na Sidebar (conexão do pool, sem connect/close a cada rerun)
+    from consultas_paralelas import check_connection
+    if check_connection():
         st.success("Conectado ao BD")
-        db_conn.close()
     else:
         st.error("BD desconectado")
 
 # --- 5. CONTEÚDO ---
+# Com FULLTIME_TRACEMALLOC=1, registra os maiores alocadores de cada página
+marca_memoria = memoria.start_page(selected)
 
 if selected == "Página Inicial":
     st.markdown("<h1 style='text-align: center;'>Bem-vindo ao <span class='red-highlight'>Fulltime Analytics</span></h1>", unsafe_allow_html=True)
@@ -203,6 +181,16 @@ if selected == "Página Inicial":
     
     if kpis['status'] == "Offline":
         st.warning("⚠️ O sistema não detectou conexão com o banco de dados 'ANALISE'. Os valores acima estão zerados.")
+    elif kpis['alertas']:
+        df_alertas = get_breach_alerts()
+        if not df_alertas.empty:
+            with st.expander("🚨 Próximos estouros de plano no mês"):
+                st.dataframe(df_alertas.rename(columns={
+                    "ranking": "#", "usuario": "Usuário", "departamento": "Departamento", "cargo": "Cargo",
+                    "severidade": "Severidade", "data_estouro": "Estouro em", "dias_para_estouro": "Dias",
+                    "consumo_mes_gb": "Consumo no Mês (GB)", "projecao_mes_gb": "Projeção (GB)",
+                    "limite_gb": "Plano (GB)", "excedente_projetado_gb": "Excedente Projetado (GB)",
+                }), use_container_width=True, hide_index=True)
 
     st.divider()
 
@@ -242,13 +230,17 @@ elif selected == "Dashboard":
         import dashboard
         dashboard.show_dashboard_ui()
     except ImportError:
+        import pandas as pd
+
         conn = init_connection()
         if conn:
             st.markdown("#### Consumo Real por Departamento")
             try:
-                query = """
+                from compactacao import uso_mensal
+
+                query = f"""
                 SELECT d.nome, SUM(l.consumo_dados_gb) as total
-                FROM log_uso_sim l
+                FROM {uso_mensal()} l
                 JOIN usuario u ON l.id_usuario = u.id_usuario
                 JOIN departamentos d ON u.id_departamento = d.id_departamento
                 GROUP BY d.nome
@@ -340,4 +332,11 @@ elif selected == "Sobre Nós":
                     Instagram 📸
                 </a>
             </div>
-            """, unsafe_allow_html=True)
\ No newline at end of file
+            """, unsafe_allow_html=True)
+
+# --- 6. MEMÓRIA E DEPURAÇÃO (painéis com ?debug=1) ---
+memoria.end_page(marca_memoria)
+tamanhos_sessao = memoria.account_session(get_script_run_ctx().session_id, st.session_state)
+memoria.render_memory_panel(tamanhos_sessao)
+metricas.render_debug_panel()
+metricas.export()
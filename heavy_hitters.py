@@ -0,0 +1,317 @@
+# heavy_hitters.py
+import argparse
+import hashlib
+import io
+import math
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+import numpy as np
+import psycopg2
+from psycopg2.extras import execute_values
+
+from conexao import DB_PARAMS
+
+# --- PARÂMETROS DOS SKETCHES ---
+SS_CAPACIDADE = 200       # contadores do Space-Saving por sketch
+CMS_LARGURA = 1024        # erro do Count-Min: e/largura * volume total
+CMS_PROFUNDIDADE = 4      # probabilidade de falha: e^-profundidade
+DIMENSOES_SKETCH = ["usuario", "dispositivo", "localizacao"]
+
+
+def _hash_pair(item):
+    # Hash estável entre processos (o hash() do Python muda a cada execução)
+    digest = hashlib.blake2b(str(item).encode("utf-8"), digest_size=16).digest()
+    return int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+
+
+class SpaceSaving:
+    """
+    Top-k com memória limitada (Metwally et al.): cada item guarda (contagem, erro máximo).
+    A contagem superestima o valor real em no máximo `erro`.
+    """
+
+    def __init__(self, capacidade=SS_CAPACIDADE):
+        self.capacidade = capacidade
+        self.contadores = {}
+
+    def update(self, item, peso=1.0):
+        if item in self.contadores:
+            self.contadores[item][0] += peso
+        elif len(self.contadores) < self.capacidade:
+            self.contadores[item] = [peso, 0.0]
+        else:
+            menor = min(self.contadores, key=lambda k: self.contadores[k][0])
+            contagem_min = self.contadores.pop(menor)[0]
+            self.contadores[item] = [contagem_min + peso, contagem_min]
+
+    def min_count(self):
+        if len(self.contadores) < self.capacidade:
+            return 0.0
+        return min(c[0] for c in self.contadores.values())
+
+    def merge(self, other):
+        """
+        União de dois resumos (Agarwal et al.): itens ausentes num resumo cheio recebem
+        a menor contagem dele como limite superior. Mantém os `capacidade` maiores.
+        """
+        min_a, min_b = self.min_count(), other.min_count()
+        merged = {}
+        for item in set(self.contadores) | set(other.contadores):
+            ca, ea = self.contadores.get(item, (min_a, min_a))
+            cb, eb = other.contadores.get(item, (min_b, min_b))
+            merged[item] = [ca + cb, ea + eb]
+        top = sorted(merged.items(), key=lambda kv: kv[1][0], reverse=True)[:self.capacidade]
+        result = SpaceSaving(self.capacidade)
+        result.contadores = {k: v for k, v in top}
+        return result
+
+    def top(self, n):
+        return sorted(self.contadores.items(), key=lambda kv: kv[1][0], reverse=True)[:n]
+
+
+class CountMinSketch:
+    """
+    Estimativa de volume por item: nunca subestima e superestima em no máximo
+    (e / largura) * total com probabilidade 1 - e^-profundidade.
+    """
+
+    def __init__(self, largura=CMS_LARGURA, profundidade=CMS_PROFUNDIDADE):
+        self.largura = largura
+        self.profundidade = profundidade
+        self.tabela = np.zeros((profundidade, largura), dtype=np.float64)
+        self.total = 0.0
+
+    def _colunas(self, item):
+        h1, h2 = _hash_pair(item)
+        return [(h1 + i * h2) % self.largura for i in range(self.profundidade)]
+
+    def update(self, item, peso=1.0):
+        self.tabela[np.arange(self.profundidade), self._colunas(item)] += peso
+        self.total += peso
+
+    def estimate(self, item):
+        return float(self.tabela[np.arange(self.profundidade), self._colunas(item)].min())
+
+    def error_bound(self):
+        return math.e / self.largura * self.total
+
+    def confidence(self):
+        return 1 - math.exp(-self.profundidade)
+
+    def merge(self, other):
+        if (self.largura, self.profundidade) != (other.largura, other.profundidade):
+            raise ValueError("Count-Min com dimensões diferentes não pode ser combinado.")
+        result = CountMinSketch(self.largura, self.profundidade)
+        result.tabela = self.tabela + other.tabela
+        result.total = self.total + other.total
+        return result
+
+
+class HeavyHitters:
+    # Par Space-Saving (quem são os maiores) + Count-Min (quanto consumiram)
+    def __init__(self):
+        self.ss = SpaceSaving()
+        self.cms = CountMinSketch()
+
+    def update(self, item, peso):
+        self.ss.update(item, peso)
+        self.cms.update(item, peso)
+
+    def merge(self, other):
+        result = HeavyHitters()
+        result.ss = self.ss.merge(other.ss)
+        result.cms = self.cms.merge(other.cms)
+        return result
+
+    def to_bytes(self):
+        # .npz só com arrays numéricos e de texto (nada de pickle): ler o banco não executa código.
+        # Buckets pequenos deixam a tabela do Count-Min quase toda zerada, e a compressão a reduz bastante.
+        itens = list(self.ss.contadores)
+        buffer = io.BytesIO()
+        np.savez_compressed(
+            buffer,
+            ss_capacidade=np.int64(self.ss.capacidade),
+            ss_itens=np.array(itens, dtype=np.str_),
+            ss_contadores=np.array([self.ss.contadores[i] for i in itens], dtype=np.float64).reshape(-1, 2),
+            cms_tabela=self.cms.tabela,
+            cms_total=np.float64(self.cms.total),
+        )
+        return buffer.getvalue()
+
+    @staticmethod
+    def from_bytes(data):
+        with np.load(io.BytesIO(data), allow_pickle=False) as raw:
+            result = HeavyHitters()
+            result.ss = SpaceSaving(int(raw["ss_capacidade"]))
+            result.ss.contadores = {
+                str(item): [float(contagem), float(erro)]
+                for item, (contagem, erro) in zip(raw["ss_itens"], raw["ss_contadores"])
+            }
+            tabela = raw["cms_tabela"].astype(np.float64)
+            profundidade, largura = tabela.shape
+            result.cms = CountMinSketch(largura, profundidade)
+            result.cms.tabela = tabela
+            result.cms.total = float(raw["cms_total"])
+        return result
+
+
+def merge_all(sketches):
+    result = None
+    for sketch in sketches:
+        result = sketch if result is None else result.merge(sketch)
+    return result
+
+
+# --- CONSTRUÇÃO (JOB) ---
+BUCKET_QUERY = """
+SELECT
+    l.data_uso::date AS bucket,
+    l.id_empresa,
+    dep.nome || '|' || c.nome AS segmento,
+    u.id_usuario::text || ' - ' || u.nome AS usuario,
+    disp.nome_dispositivo AS dispositivo,
+    loc.nome AS localizacao,
+    l.consumo_dados_gb::float
+FROM log_uso_sim l
+JOIN usuario u ON l.id_usuario = u.id_usuario
+JOIN departamentos dep ON u.id_departamento = dep.id_departamento
+JOIN cargos c ON u.id_cargo = c.id_cargo
+JOIN dispositivos disp ON l.id_dispositivo = disp.id_dispositivo
+LEFT JOIN localizacoes loc ON l.id_localizacao = loc.id_localizacao
+WHERE l.data_uso >= %(inicio)s AND l.data_uso < %(fim)s::date + 1;
+"""
+
+
+def build_sketches(conn_params, inicio, fim):
+    """
+    Lê os registros do intervalo com cursor server-side e monta um sketch por
+    (dia, empresa, segmento, dimensão). Executado em paralelo por processos de trabalho.
+    """
+    conn = psycopg2.connect(**conn_params)
+    sketches = defaultdict(HeavyHitters)
+    try:
+        cur = conn.cursor(name="sketches_stream")
+        cur.itersize = 20000
+        cur.execute(BUCKET_QUERY, {"inicio": inicio, "fim": fim})
+        for bucket, id_empresa, segmento, usuario, dispositivo, localizacao, consumo in cur:
+            for dim, item in zip(DIMENSOES_SKETCH, (usuario, dispositivo, localizacao)):
+                if item is not None:
+                    sketches[(bucket, id_empresa, segmento, dim)].update(item, consumo)
+        cur.close()
+    finally:
+        conn.close()
+    return dict(sketches)
+
+
+def update_sketches(conn, workers=1, full=False):
+    """
+    Gera os sketches dos dias novos: recomeça do último dia gravado da empresa mais atrasada
+    (ou do primeiro registro de uma empresa sem sketches); dias já gravados são sobrescritos.
+    Com workers > 1, o intervalo é dividido entre processos e os sketches parciais são combinados.
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT MIN(CASE WHEN %(full)s THEN l.primeiro ELSE COALESCE(s.ultimo, l.primeiro) END), MAX(l.ultimo)
+        FROM (
+            SELECT id_empresa, MIN(data_uso)::date AS primeiro, MAX(data_uso)::date AS ultimo
+            FROM log_uso_sim GROUP BY id_empresa
+        ) l
+        LEFT JOIN (
+            SELECT id_empresa, MAX(bucket) AS ultimo FROM sketches_consumo GROUP BY id_empresa
+        ) s USING (id_empresa);
+    """, {"full": full})
+    inicio, ultimo = cursor.fetchone()
+    if ultimo is None:
+        print("[AVISO] log_uso_sim vazio.")
+        return 0
+
+    dias = (ultimo - inicio).days + 1
+    workers = max(1, min(workers, dias))
+    passo = math.ceil(dias / workers)
+    intervalos = [
+        (date.fromordinal(inicio.toordinal() + i * passo),
+         date.fromordinal(min(ultimo.toordinal(), inicio.toordinal() + (i + 1) * passo - 1)))
+        for i in range(workers)
+    ]
+
+    merged = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for partial in pool.map(build_sketches, [DB_PARAMS] * workers, *zip(*intervalos)):
+            for key, sketch in partial.items():
+                merged[key] = merged[key].merge(sketch) if key in merged else sketch
+
+    rows = [
+        (bucket, id_empresa, segmento, dim, psycopg2.Binary(sketch.to_bytes()), sketch.cms.total)
+        for (bucket, id_empresa, segmento, dim), sketch in merged.items()
+    ]
+    execute_values(cursor, """
+        INSERT INTO sketches_consumo (bucket, id_empresa, segmento, dimensao, sketch, volume_total)
+        VALUES %s
+        ON CONFLICT (bucket, id_empresa, segmento, dimensao) DO UPDATE SET
+            sketch = EXCLUDED.sketch, volume_total = EXCLUDED.volume_total, atualizado_em = NOW();
+    """, rows)
+    conn.commit()
+    cursor.close()
+    print(f"[OK] {len(rows)} sketches gravados ({inicio} a {ultimo}).")
+    return len(rows)
+
+
+# --- CONSULTA ---
+def top_n(conn, dimensao, dias=30, n=10, segmentos=None, id_empresa=None):
+    """
+    Top N de `dimensao` nos últimos `dias`, combinando os sketches dos buckets
+    (só os da empresa `id_empresa`, se informada).
+    Retorna lista de dicts com volume estimado, limite inferior garantido e erro do Count-Min,
+    mais o volume total do período.
+    """
+    cursor = conn.cursor()
+    # O período termina no último bucket da própria empresa, não no de qualquer empresa
+    filtro_empresa = "" if id_empresa is None else " AND id_empresa = %(id_empresa)s"
+    query = f"""
+        SELECT sketch FROM sketches_consumo
+        WHERE dimensao = %(dimensao)s{filtro_empresa}
+          AND bucket > (SELECT MAX(bucket) FROM sketches_consumo WHERE TRUE{filtro_empresa}) - %(dias)s
+    """
+    params = {"dimensao": dimensao, "dias": dias, "id_empresa": id_empresa}
+    if segmentos is not None:
+        query += " AND segmento = ANY(%(segmentos)s)"
+        params["segmentos"] = list(segmentos)
+    cursor.execute(query, params)
+    sketch = merge_all(HeavyHitters.from_bytes(bytes(row[0])) for row in cursor.fetchall())
+    cursor.close()
+    if sketch is None:
+        return [], 0.0
+
+    cms_erro = sketch.cms.error_bound()
+    result = []
+    for item, (contagem, erro) in sketch.ss.top(n):
+        result.append({
+            "item": item,
+            "volume_estimado": min(contagem, sketch.cms.estimate(item)),
+            "volume_minimo": contagem - erro,
+            "erro_cms": cms_erro,
+        })
+    return result, sketch.cms.total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Atualiza os sketches de maiores consumidores.")
+    parser.add_argument("--workers", type=int, default=1, help="Processos paralelos na construção.")
+    parser.add_argument("--completo", action="store_true", help="Reconstrói todos os buckets.")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**DB_PARAMS)
+    try:
+        update_sketches(conn, workers=args.workers, full=args.completo)
+    except Exception as e:
+        conn.rollback()
+        print("[ERRO] Falha ao atualizar os sketches:", e)
+        raise
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+# kpis.py
+import pandas as pd
+
+from compactacao import uso_diario, uso_mensal
+from metricas import span
+
+# Filtro opcional por empresa: com id_empresa = None as consultas cobrem a plataforma toda
+FILTRO_EMPRESA = "(%(id_empresa)s IS NULL OR {col} = %(id_empresa)s)"
+# Empresa e intervalo [inicio, fim], aplicados ao bruto e ao histórico compactado
+FILTRO_USO = (FILTRO_EMPRESA.format(col="id_empresa") + """
+      AND (%(inicio)s::date IS NULL OR data_uso >= %(inicio)s::date)
+      AND (%(fim)s::date IS NULL OR data_uso < %(fim)s::date + 1)""")
+
+# Indicadores da página inicial (frontendalt.py) e da API (api.py)
+KPI_QUERIES = {
+    "usuarios": f"SELECT COUNT(*) FROM usuario WHERE {FILTRO_EMPRESA.format(col='id_empresa')};",
+    "consumo_hoje": f"""
+        SELECT SUM(consumo_dados_gb)
+        FROM log_uso_sim
+        WHERE {FILTRO_EMPRESA.format(col='id_empresa')}
+          AND data_referencia = (
+              SELECT MAX(data_referencia) FROM log_uso_sim
+              WHERE {FILTRO_EMPRESA.format(col='id_empresa')}
+          );
+    """,
+    # Linhas que já passaram ou devem passar do plano no mês (alertas_estouro.py)
+    "alertas": f"""
+        SELECT COUNT(*)
+        FROM alertas_estouro
+        WHERE {FILTRO_EMPRESA.format(col='id_empresa')}
+          AND mes = (SELECT MAX(mes) FROM alertas_estouro WHERE {FILTRO_EMPRESA.format(col='id_empresa')});
+    """,
+}
+
+# Dimensões aceitas em fetch_aggregate: nome público -> expressão SQL
+AGGREGATE_DIMENSIONS = {
+    "departamento": "dep.nome",
+    "cargo": "c.nome",
+    "empresa": "emp.nome",
+    "mes": "TO_CHAR(DATE_TRUNC('month', l.data_uso), 'YYYY-MM')",
+    "dia": "l.data_uso::date",
+}
+
+
+def empty_kpis():
+    return {"usuarios": 0, "consumo_hoje": 0.0, "alertas": 0, "status": "Offline"}
+
+
+def fetch_kpi(conn, nome, id_empresa=None):
+    with span(f"kpi.{nome}"), conn.cursor() as cur:
+        cur.execute(KPI_QUERIES[nome], {"id_empresa": id_empresa})
+        row = cur.fetchone()
+    if not row or row[0] is None:
+        return empty_kpis()[nome]
+    return float(row[0]) if nome == "consumo_hoje" else row[0]
+
+
+def fetch_kpis(conn, id_empresa=None):
+    """
+    Executa as consultas de KPI em sequência numa conexão aberta. Exceções de banco são propagadas.
+    """
+    dados = empty_kpis()
+    for nome in KPI_QUERIES:
+        dados[nome] = fetch_kpi(conn, nome, id_empresa)
+    dados["status"] = "Online"
+    return dados
+
+
+def fetch_kpis_concurrent(id_empresa=None, timeout=10):
+    """
+    Uma consulta por KPI, em paralelo em conexões do pool (consultas_paralelas.py).
+    Retorna (dados, erros): KPIs que falharem ficam zerados e o status vira "Parcial".
+    """
+    from consultas_paralelas import run_concurrent
+
+    dados = empty_kpis()
+    resultados, erros = run_concurrent(
+        {nome: (lambda conn, nome=nome: fetch_kpi(conn, nome, id_empresa)) for nome in KPI_QUERIES}, timeout=timeout
+    )
+    if not resultados:
+        # Nenhuma consulta respondeu: banco fora do ar, tratado como "Offline"
+        return dados, {"conexao": next(iter(erros.values()), "")}
+    dados.update(resultados)
+    dados["status"] = "Parcial" if erros else "Online"
+    return dados, erros
+
+
+def fetch_aggregate(conn, dimensao, inicio=None, fim=None, id_empresa=None):
+    """
+    Consumo total, nº de registros e de usuários por `dimensao` (ver AGGREGATE_DIMENSIONS),
+    opcionalmente restrito ao intervalo [inicio, fim] e a uma empresa.
+    O histórico compactado entra com resolução diária para "dia" e mensal para as demais
+    (nos meses compactados, o intervalo vale pelo primeiro dia do mês).
+    """
+    if dimensao not in AGGREGATE_DIMENSIONS:
+        raise ValueError(f"Dimensão inválida: {dimensao}")
+    uso = uso_diario(FILTRO_USO) if dimensao == "dia" else uso_mensal(FILTRO_USO)
+    query = f"""
+    SELECT
+        {AGGREGATE_DIMENSIONS[dimensao]} AS {dimensao},
+        SUM(l.consumo_dados_gb)::float AS consumo,
+        SUM(l.registros) AS registros,
+        COUNT(DISTINCT l.id_usuario) AS usuarios
+    FROM {uso} l
+    JOIN usuario u ON l.id_usuario = u.id_usuario
+    JOIN departamentos dep ON u.id_departamento = dep.id_departamento
+    JOIN cargos c ON u.id_cargo = c.id_cargo
+    JOIN empresas emp ON u.id_empresa = emp.id_empresa
+    GROUP BY 1
+    ORDER BY 1;
+    """
+    return pd.read_sql_query(query, conn, params={"inicio": inicio, "fim": fim, "id_empresa": id_empresa})
+
+
+# Agrega pela chave inteira da localização e só depois junta nome e coordenadas
+LOCATION_QUERY = f"""
+WITH por_local AS (
+    SELECT
+        l.id_localizacao,
+        SUM(l.consumo_dados_gb)::float AS consumo,
+        SUM(l.registros) AS registros,
+        COUNT(DISTINCT l.id_usuario) AS usuarios
+    FROM {uso_diario(FILTRO_USO)} l
+    WHERE l.id_localizacao IS NOT NULL
+      -- Cada lista filtra sozinha; sem nenhuma das duas, a subconsulta nem é avaliada
+      AND ((%(departamentos)s::text[] IS NULL AND %(cargos)s::text[] IS NULL) OR l.id_usuario IN (
+          SELECT u.id_usuario
+          FROM usuario u
+          JOIN departamentos dep ON u.id_departamento = dep.id_departamento
+          JOIN cargos c ON u.id_cargo = c.id_cargo
+          WHERE (%(departamentos)s::text[] IS NULL OR dep.nome = ANY(%(departamentos)s::text[]))
+            AND (%(cargos)s::text[] IS NULL OR c.nome = ANY(%(cargos)s::text[]))
+      ))
+    GROUP BY l.id_localizacao
+)
+SELECT
+    loc.id_localizacao,
+    loc.nome AS localizacao,
+    loc.latitude,
+    loc.longitude,
+    p.consumo,
+    p.registros,
+    p.usuarios
+FROM por_local p
+JOIN localizacoes loc ON p.id_localizacao = loc.id_localizacao
+ORDER BY p.consumo DESC;
+"""
+
+
+def fetch_location_aggregate(conn, id_empresa=None, inicio=None, fim=None, departamentos=None, cargos=None):
+    """
+    Consumo, registros e usuários por localização (com latitude/longitude para o mapa),
+    opcionalmente restrito a empresa, intervalo e departamentos x cargos.
+    """
+    return pd.read_sql_query(LOCATION_QUERY, conn, params={
+        "id_empresa": id_empresa, "inicio": inicio, "fim": fim,
+        "departamentos": list(departamentos) if departamentos else None,
+        "cargos": list(cargos) if cargos else None,
+    })
@@ -0,0 +1,272 @@
+# memoria.py
+import functools
+import inspect
+import os
+import pickle
+import sys
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from metricas import incr
+
+# --- CONFIGURAÇÃO ---
+# Limite do cache de DataFrames do processo (somado entre empresas e sessões)
+CACHE_MEMORIA_MAX_BYTES = int(float(os.getenv("FULLTIME_CACHE_MEMORIA_MB", "1024")) * 1024 * 1024)
+# Limite do que cada sessão guarda em st.session_state
+SESSAO_MAX_BYTES = int(float(os.getenv("FULLTIME_SESSAO_MAX_MB", "32")) * 1024 * 1024)
+# Itens da sessão que podem ser descartados e recalculados sob demanda, na ordem de descarte
+DESCARTAVEIS = ("figures", "diagnosis")
+# FULLTIME_TRACEMALLOC=1 liga o diagnóstico de alocações por página (custo alto: só para investigação)
+TRACEMALLOC = os.getenv("FULLTIME_TRACEMALLOC", "0") == "1"
+TRACEMALLOC_FRAMES = 10
+TOP_ALOCADORES = 15
+SESSAO_INATIVA_S = 3600
+
+
+def _leaf_bytes(obj):
+    if isinstance(obj, (pd.DataFrame, pd.Series, pd.Index)):
+        uso = obj.memory_usage(deep=True)
+        return int(uso.sum()) if isinstance(uso, pd.Series) else int(uso)
+    try:
+        return len(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return sys.getsizeof(obj)
+
+
+def estimate_bytes(obj, memo=None, _vistos=None):
+    """
+    Tamanho aproximado de um valor em memória: profundo para DataFrames/Series (inclui strings),
+    nbytes para arrays, recursivo para contêineres; demais objetos (ex.: figuras) pelo tamanho do pickle.
+    `memo` ({"anterior": {}, "atual": {}}) reaproveita as medições caras de objetos que já
+    existiam na chamada anterior (mesmo objeto, não só mesmo id).
+    """
+    if isinstance(obj, np.ndarray):
+        return int(obj.nbytes)
+    if isinstance(obj, (str, bytes, int, float, bool, type(None))):
+        return sys.getsizeof(obj)
+
+    _vistos = _vistos if _vistos is not None else set()
+    if id(obj) in _vistos:
+        return 0
+    _vistos.add(id(obj))
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(
+            estimate_bytes(k, memo, _vistos) + estimate_bytes(v, memo, _vistos) for k, v in obj.items()
+        )
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return sys.getsizeof(obj) + sum(estimate_bytes(v, memo, _vistos) for v in obj)
+
+    if memo is None:
+        return _leaf_bytes(obj)
+    anterior = memo["anterior"].get(id(obj))
+    tamanho = anterior[1] if anterior and anterior[0] is obj else _leaf_bytes(obj)
+    memo["atual"][id(obj)] = (obj, tamanho)
+    return tamanho
+
+
+class ByteBudgetCache:
+    """
+    Cache LRU em memória com limite em bytes (estimate_bytes) e TTL por entrada.
+    Diferente do st.cache_data, devolve o próprio objeto (sem cópia por acesso), então os
+    valores devem ser tratados como somente leitura. Carregamentos da mesma chave em
+    sessões simultâneas esperam um único cálculo.
+    """
+
+    def __init__(self, max_bytes=CACHE_MEMORIA_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.loading = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, chave):
+        with self.lock:
+            entry = self.entries.get(chave)
+            if entry is None:
+                return False, None
+            expira_em, valor, tamanho = entry
+            if expira_em <= time.monotonic():
+                del self.entries[chave]
+                self.total_bytes -= tamanho
+                return False, None
+            self.entries.move_to_end(chave)
+            return True, valor
+
+    def set(self, chave, valor, ttl):
+        tamanho = estimate_bytes(valor)
+        if tamanho > self.max_bytes:
+            # Maior que o cache inteiro: não guarda, para não despejar todo o resto
+            return
+        with self.lock:
+            antigo = self.entries.pop(chave, None)
+            if antigo:
+                self.total_bytes -= antigo[2]
+            while self.entries and self.total_bytes + tamanho > self.max_bytes:
+                _, (_, _, liberado) = self.entries.popitem(last=False)
+                self.total_bytes -= liberado
+                self.evictions += 1
+                incr("cache_memoria_despejos")
+            self.entries[chave] = (time.monotonic() + ttl, valor, tamanho)
+            self.total_bytes += tamanho
+
+    def get_or_load(self, chave, loader, ttl):
+        encontrado, valor = self.get(chave)
+        if encontrado:
+            self.hits += 1
+            incr("cache_memoria", resultado="acerto")
+            return valor
+        self.misses += 1
+        incr("cache_memoria", resultado="erro")
+
+        with self.lock:
+            lock_chave = self.loading.setdefault(chave, threading.Lock())
+        with lock_chave:
+            encontrado, valor = self.get(chave)
+            if not encontrado:
+                valor = loader()
+                self.set(chave, valor, ttl)
+        with self.lock:
+            self.loading.pop(chave, None)
+        return valor
+
+    def stats(self):
+        with self.lock:
+            return {"entradas": len(self.entries), "bytes": self.total_bytes, "limite_bytes": self.max_bytes,
+                    "acertos": self.hits, "erros": self.misses, "despejos": self.evictions}
+
+
+_frames = ByteBudgetCache()
+
+
+def get_memory_cache():
+    return _frames
+
+
+def memory_cache(ttl):
+    """
+    Decorador no estilo do st.cache_data sobre o ByteBudgetCache do processo: a chave usa
+    o nome da função e os argumentos, ignorando os que começam com "_". Exceções não são
+    guardadas (o próximo acesso tenta de novo).
+    """
+    def decorator(func):
+        assinatura = inspect.signature(func)
+        prefixo = f"{func.__module__}.{func.__qualname__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = assinatura.bind(*args, **kwargs)
+            bound.apply_defaults()
+            chave = (prefixo, tuple((k, v) for k, v in bound.arguments.items() if not k.startswith("_")))
+            return _frames.get_or_load(chave, lambda: func(*args, **kwargs), ttl)
+        return wrapper
+    return decorator
+
+
+# --- SESSÕES ---
+_sessoes = {}
+_sessoes_lock = threading.Lock()
+
+
+def account_session(session_id, session_state):
+    """
+    Mede o que a sessão guarda e aplica SESSAO_MAX_BYTES descartando primeiro os itens
+    recalculáveis (DESCARTAVEIS). DataFrames e figuras que continuam na sessão desde o
+    rerun anterior não são medidos de novo. Retorna {chave: bytes} do que ficou.
+    """
+    memo = {"anterior": session_state.get("_memoria_medidos", {}), "atual": {}}
+    tamanhos = {chave: estimate_bytes(session_state[chave], memo)
+                for chave in list(session_state.keys()) if chave != "_memoria_medidos"}
+
+    total = sum(tamanhos.values())
+    for chave in DESCARTAVEIS:
+        if total <= SESSAO_MAX_BYTES:
+            break
+        if chave in tamanhos:
+            total -= tamanhos.pop(chave)
+            del session_state[chave]
+            incr("sessao_descartes", item=chave)
+    session_state["_memoria_medidos"] = memo["atual"]
+
+    agora = time.monotonic()
+    with _sessoes_lock:
+        _sessoes[session_id] = (agora, total)
+        for sid in [s for s, (visto, _) in _sessoes.items() if agora - visto > SESSAO_INATIVA_S]:
+            del _sessoes[sid]
+    return tamanhos
+
+
+def sessions_summary():
+    with _sessoes_lock:
+        totais = [total for _, total in _sessoes.values()]
+    return {"sessoes": len(totais), "bytes": sum(totais), "maior": max(totais, default=0)}
+
+
+# --- DIAGNÓSTICO (TRACEMALLOC) ---
+_alocadores = {}
+
+
+def start_page(nome):
+    """
+    No modo de diagnóstico, marca o início da página `nome`: end_page() compara as alocações
+    contra este ponto e guarda os maiores alocadores (arquivo:linha) da página.
+    """
+    if not TRACEMALLOC:
+        return None
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    return (nome, tracemalloc.take_snapshot())
+
+
+def end_page(marca):
+    if marca is None:
+        return
+    nome, antes = marca
+    depois = tracemalloc.take_snapshot()
+    filtros = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap*>")]
+    diferencas = depois.filter_traces(filtros).compare_to(antes.filter_traces(filtros), "lineno")
+    _alocadores[nome] = {
+        "pico": tracemalloc.get_traced_memory()[1],
+        "top": [(str(d.traceback[0]), d.size_diff, d.count_diff) for d in diferencas[:TOP_ALOCADORES]],
+    }
+    tracemalloc.reset_peak()
+
+
+def render_memory_panel(tamanhos):
+    """
+    Painel lateral (?debug=1): bytes por item da sessão, cache de DataFrames do processo
+    e, no modo tracemalloc, os maiores alocadores de cada página.
+    """
+    import streamlit as st
+
+    if st.query_params.get("debug") != "1":
+        return
+    mb = 1024 ** 2
+    with st.sidebar.expander("🧠 Depuração (memória)", expanded=False):
+        st.caption(f"Sessão: {sum(tamanhos.values()) / mb:.2f} MB (limite {SESSAO_MAX_BYTES / mb:.0f} MB)")
+        if tamanhos:
+            st.dataframe(pd.DataFrame(
+                sorted(((k, round(v / mb, 3)) for k, v in tamanhos.items()), key=lambda item: -item[1])[:15],
+                columns=["Item", "MB"]
+            ), use_container_width=True, hide_index=True)
+
+        cache = _frames.stats()
+        sessoes = sessions_summary()
+        st.caption(f"Cache de DataFrames: {cache['entradas']} entrada(s), {cache['bytes'] / mb:.1f} de "
+                   f"{cache['limite_bytes'] / mb:.0f} MB · {cache['despejos']} despejo(s)")
+        st.caption(f"Sessões ativas: {sessoes['sessoes']} · {sessoes['bytes'] / mb:.1f} MB no total")
+
+        if TRACEMALLOC:
+            for pagina, dados in _alocadores.items():
+                st.markdown(f"**{pagina}** — pico {dados['pico'] / mb:.1f} MB")
+                st.dataframe(pd.DataFrame(
+                    [(linha, round(tamanho / 1024, 1), qtd) for linha, tamanho, qtd in dados["top"]],
+                    columns=["Alocador", "KB", "Blocos"]
+                ), use_container_width=True, hide_index=True)
@@ -0,0 +1,213 @@
+# metricas.py
+import argparse
+import functools
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+# --- CONFIGURAÇÃO ---
+# FULLTIME_METRICAS=1 liga a coleta; desligada, span() devolve um contexto nulo compartilhado
+# e incr() retorna na primeira linha (custo de uma verificação de flag).
+ENABLED = os.getenv("FULLTIME_METRICAS", "0") == "1"
+EXPORT_PATH = os.getenv("FULLTIME_METRICAS_ARQUIVO", os.path.join(os.path.dirname(os.path.abspath(__file__)), "metricas.prom"))
+EXPORT_INTERVALO_S = 10
+PREFIXO = "fulltime"
+# Limites (s) dos buckets do histograma de duração dos spans
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TRACE_MAX = 500
+
+_NULL_SPAN = nullcontext()
+
+
+class Registry:
+    """
+    Agregados do processo: histograma de duração por span e contadores com rótulos.
+    Thread-safe (os loaders rodam em threads do pool de consultas).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.spans = {}
+        self.counters = {}
+        self.ultimo_export = 0.0
+
+    def observe(self, nome, segundos):
+        with self.lock:
+            hist = self.spans.get(nome)
+            if hist is None:
+                hist = self.spans[nome] = {"buckets": [0] * len(BUCKETS), "count": 0, "sum": 0.0}
+            for i, limite in enumerate(BUCKETS):
+                if segundos <= limite:
+                    hist["buckets"][i] += 1
+            hist["count"] += 1
+            hist["sum"] += segundos
+
+    def incr(self, nome, n, rotulos):
+        chave = (nome, rotulos)
+        with self.lock:
+            self.counters[chave] = self.counters.get(chave, 0) + n
+
+    def reset(self):
+        with self.lock:
+            self.spans.clear()
+            self.counters.clear()
+
+    def prometheus_text(self):
+        with self.lock:
+            spans = {nome: {**h, "buckets": list(h["buckets"])} for nome, h in self.spans.items()}
+            counters = dict(self.counters)
+
+        linhas = []
+        if spans:
+            metrica = f"{PREFIXO}_span_segundos"
+            linhas += [f"# HELP {metrica} Duração das etapas instrumentadas.", f"# TYPE {metrica} histogram"]
+            for nome in sorted(spans):
+                h = spans[nome]
+                for limite, qtd in zip(BUCKETS, h["buckets"]):
+                    linhas.append(f'{metrica}_bucket{{span="{nome}",le="{limite}"}} {qtd}')
+                linhas.append(f'{metrica}_bucket{{span="{nome}",le="+Inf"}} {h["count"]}')
+                linhas.append(f'{metrica}_sum{{span="{nome}"}} {h["sum"]:.6f}')
+                linhas.append(f'{metrica}_count{{span="{nome}"}} {h["count"]}')
+
+        for nome in sorted({nome for nome, _ in counters}):
+            metrica = f"{PREFIXO}_{nome}_total"
+            linhas.append(f"# TYPE {metrica} counter")
+            for (n, rotulos), valor in sorted(counters.items()):
+                if n != nome:
+                    continue
+                texto = ",".join(f'{k}="{v}"' for k, v in rotulos)
+                linhas.append(f"{metrica}{{{texto}}} {valor}" if texto else f"{metrica} {valor}")
+        return "\n".join(linhas) + "\n"
+
+
+registry = Registry()
+_local = threading.local()
+
+
+class Span:
+    def __init__(self, nome):
+        self.nome = nome
+
+    def __enter__(self):
+        self.depth = getattr(_local, "depth", 0)
+        _local.depth = self.depth + 1
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        duracao = time.perf_counter() - self.inicio
+        _local.depth = self.depth
+        registry.observe(self.nome, duracao)
+        trace = getattr(_local, "trace", None)
+        if trace is not None and len(trace) < TRACE_MAX:
+            trace.append((self.nome, self.depth, duracao))
+        return False
+
+
+def span(nome):
+    """Mede a duração do bloco `with span("etapa"):` (sem custo quando a coleta está desligada)."""
+    return Span(nome) if ENABLED else _NULL_SPAN
+
+
+def timed(nome=None):
+    # Decorador equivalente a span() em volta da função inteira
+    def decorator(func):
+        rotulo = nome or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return func(*args, **kwargs)
+            with Span(rotulo):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def incr(nome, n=1, **rotulos):
+    if not ENABLED:
+        return
+    registry.incr(nome, n, tuple(sorted(rotulos.items())))
+
+
+def enable(ligado=True):
+    global ENABLED
+    ENABLED = ligado
+
+
+def start_trace():
+    """
+    Inicia a lista de spans da execução atual da thread (um rerun do Streamlit),
+    exibida no painel de depuração. Spans de outras threads só entram nos agregados.
+    """
+    _local.trace = []
+    _local.depth = 0
+    return _local.trace
+
+
+def current_trace():
+    return getattr(_local, "trace", None) or []
+
+
+def export(path=EXPORT_PATH, force=False):
+    """
+    Grava os agregados em formato texto do Prometheus (node_exporter textfile collector).
+    Sem `force`, no máximo uma gravação a cada EXPORT_INTERVALO_S.
+    """
+    if not ENABLED:
+        return False
+    agora = time.monotonic()
+    if not force and agora - registry.ultimo_export < EXPORT_INTERVALO_S:
+        return False
+    registry.ultimo_export = agora
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(registry.prometheus_text())
+    os.replace(tmp, path)
+    return True
+
+
+def render_debug_panel():
+    """
+    Painel lateral com os spans do último rerun e os contadores do processo.
+    Aparece com a coleta ligada e ?debug=1 na URL.
+    """
+    import pandas as pd
+    import streamlit as st
+
+    if not ENABLED or st.query_params.get("debug") != "1":
+        return
+    with st.sidebar.expander("🛠️ Depuração (tempos)", expanded=False):
+        trace = current_trace()
+        if trace:
+            st.dataframe(pd.DataFrame({
+                "Etapa": ["  " * depth + nome for nome, depth, _ in trace],
+                "ms": [round(duracao * 1000, 1) for _, _, duracao in trace],
+            }), use_container_width=True, hide_index=True)
+        else:
+            st.caption("Nenhum span neste rerun.")
+        with registry.lock:
+            counters = sorted(registry.counters.items())
+        if counters:
+            st.dataframe(pd.DataFrame({
+                "Contador": [nome + "".join(f" {k}={v}" for k, v in rotulos) for (nome, rotulos), _ in counters],
+                "Valor": [valor for _, valor in counters],
+            }), use_container_width=True, hide_index=True)
+        st.caption(f"Exportado em `{os.path.basename(EXPORT_PATH)}` (formato Prometheus).")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mostra o último arquivo de métricas exportado (formato Prometheus).")
+    parser.add_argument("--arquivo", default=EXPORT_PATH)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.arquivo):
+        print(f"[ERRO] {args.arquivo} não existe — rode a aplicação com FULLTIME_METRICAS=1.")
+        return
+    with open(args.arquivo, encoding="utf-8") as f:
+        print(f.read(), end="")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+-- migracao_detector_anomalias.sql
+-- Detector de anomalias: cursor (id_transacao, id_log) em vez de id_log, trigger de NOTIFY
+-- por comando em vez de por linha e empresa gravada em cada evento.
+-- Uma vez, em bancos criados antes da mudança (PostgreSQL 13+):
+--   psql -d ANALISE -f migracao_detector_anomalias.sql
+-- Pode ser executada de novo: cada passo verifica o que já foi feito.
+
+BEGIN;
+
+-- Default constante não reescreve a tabela: os registros existentes leem '1', abaixo de
+-- qualquer transação real; só os novos recebem a transação que os inseriu
+ALTER TABLE log_uso_sim ADD COLUMN IF NOT EXISTS id_transacao xid8 NOT NULL DEFAULT '1';
+ALTER TABLE log_uso_sim ALTER COLUMN id_transacao SET DEFAULT pg_current_xact_id();
+
+-- Watermarks existentes continuam no mesmo id_log, agora dentro da "transação" '1'
+ALTER TABLE watermark_detector ADD COLUMN IF NOT EXISTS ultimo_id_transacao xid8 NOT NULL DEFAULT '1';
+ALTER TABLE watermark_detector ALTER COLUMN ultimo_id_transacao SET DEFAULT '0';
+
+DROP INDEX IF EXISTS idx_log_uso_id_log;
+CREATE INDEX IF NOT EXISTS idx_log_uso_transacao ON log_uso_sim (id_transacao, id_log);
+
+CREATE OR REPLACE FUNCTION notifica_log_uso_sim() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('log_uso_sim_novo', '');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_notifica_log_uso_sim ON log_uso_sim;
+CREATE TRIGGER trg_notifica_log_uso_sim
+AFTER INSERT ON log_uso_sim
+FOR EACH STATEMENT EXECUTE FUNCTION notifica_log_uso_sim();
+
+ALTER TABLE eventos_anomalia ADD COLUMN IF NOT EXISTS id_empresa INT;
+UPDATE eventos_anomalia a SET id_empresa = u.id_empresa
+FROM usuario u
+WHERE a.id_usuario = u.id_usuario AND a.id_empresa IS NULL;
+ALTER TABLE eventos_anomalia ALTER COLUMN id_empresa SET NOT NULL;
+DROP INDEX IF EXISTS idx_eventos_anomalia_data;
+CREATE INDEX IF NOT EXISTS idx_eventos_anomalia_empresa_data ON eventos_anomalia (id_empresa, data_uso DESC);
+
+COMMIT;
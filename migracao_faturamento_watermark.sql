@@ -0,0 +1,18 @@
+-- migracao_faturamento_watermark.sql
+-- Move o watermark do faturamento para a tabela própria, pelo cursor de transações.
+-- Depois de migracao_detector_anomalias.sql, uma vez:
+--   psql -d ANALISE -f migracao_faturamento_watermark.sql
+-- Pode ser executada de novo. O próximo faturamento.py recalcula os meses ainda brutos
+-- uma vez (o watermark antigo, em id_log, não tem equivalente em transações).
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS watermark_faturamento (
+    unica BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (unica),
+    xid_limite xid8 NOT NULL,
+    atualizado_em TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+DELETE FROM watermark_detector WHERE nome = 'faturamento_mensal';
+
+COMMIT;
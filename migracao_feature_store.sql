@@ -0,0 +1,34 @@
+-- migracao_feature_store.sql
+-- Recria feature_store_consumo com uma linha por registro (lags por registro, como no treino),
+-- no lugar da linha diária agregada. Uma vez, em bancos criados antes da mudança:
+--   psql -d ANALISE -f migracao_feature_store.sql
+--   python atualiza_feature_store.py --completo
+-- As linhas antigas são descartadas: os lags diários não têm equivalente por registro.
+
+BEGIN;
+
+DROP TABLE IF EXISTS feature_store_consumo;
+
+CREATE TABLE feature_store_consumo (
+    id_usuario INT NOT NULL,
+    data DATE NOT NULL,
+    seq INT NOT NULL,  -- ordem do registro no dia
+    consumo_dados_gb DOUBLE PRECISION NOT NULL,
+    lag_1 DOUBLE PRECISION,
+    lag_7 DOUBLE PRECISION,
+    lag_30 DOUBLE PRECISION,
+    rolling_7 DOUBLE PRECISION,
+    rolling_30 DOUBLE PRECISION,
+    cargo VARCHAR(100),
+    departamento VARCHAR(100),
+    evento VARCHAR(100),
+    dispositivo VARCHAR(100),
+    situacao VARCHAR(100),
+    atualizado_em TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (id_usuario, data, seq),
+    FOREIGN KEY (id_usuario) REFERENCES usuario(id_usuario)
+);
+
+CREATE INDEX idx_feature_store_segmento ON feature_store_consumo (departamento, cargo, id_usuario, data);
+
+COMMIT;
@@ -0,0 +1,55 @@
+-- migracao_localizacoes.sql
+-- Converte log_uso_sim.localizacao (nome da cidade repetido em cada linha) para a
+-- dimensão localizacoes com chave inteira. Uma vez, em bancos criados antes da mudança:
+--   psql -d ANALISE -f migracao_localizacoes.sql
+-- Pode ser executada de novo: cada passo verifica o que já foi feito.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS localizacoes (
+    id_localizacao SERIAL PRIMARY KEY,
+    nome VARCHAR(255) NOT NULL UNIQUE,
+    latitude DOUBLE PRECISION,
+    longitude DOUBLE PRECISION
+);
+
+ALTER TABLE log_uso_sim ADD COLUMN IF NOT EXISTS id_localizacao INT;
+
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'log_uso_sim' AND column_name = 'localizacao'
+    ) THEN
+        -- Dicionário: um id por nome distinto
+        INSERT INTO localizacoes (nome)
+        SELECT DISTINCT localizacao FROM log_uso_sim WHERE localizacao IS NOT NULL
+        ON CONFLICT (nome) DO NOTHING;
+
+        UPDATE log_uso_sim l
+        SET id_localizacao = loc.id_localizacao
+        FROM localizacoes loc
+        WHERE loc.nome = l.localizacao AND l.id_localizacao IS NULL;
+
+        ALTER TABLE log_uso_sim DROP COLUMN localizacao;
+    END IF;
+
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint WHERE conname = 'log_uso_sim_id_localizacao_fkey'
+    ) THEN
+        ALTER TABLE log_uso_sim ADD CONSTRAINT log_uso_sim_id_localizacao_fkey
+            FOREIGN KEY (id_localizacao) REFERENCES localizacoes(id_localizacao);
+    END IF;
+END;
+$$;
+
+CREATE INDEX IF NOT EXISTS idx_log_uso_localizacao ON log_uso_sim (id_empresa, id_localizacao);
+
+COMMIT;
+
+-- Fora da transação (VACUUM não roda dentro de BEGIN/COMMIT). VACUUM simples passa por
+-- todas as partições sem bloquear leituras nem inserções: libera as versões antigas deixadas
+-- pelo UPDATE para reuso e atualiza as estatísticas. O espaço da coluna removida (DROP COLUMN
+-- só a marca) volta conforme as linhas são reescritas; para devolvê-lo ao disco de uma vez,
+-- VACUUM (FULL) partição por partição (log_uso_sim_empresa_N) numa janela de manutenção.
+VACUUM (ANALYZE) log_uso_sim;
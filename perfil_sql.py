@@ -0,0 +1,274 @@
+# perfil_sql.py
+import argparse
+import atexit
+import hashlib
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+
+import psycopg2.extensions
+
+from metricas import incr
+
+# --- CONFIGURAÇÃO ---
+# Ligado com FULLTIME_SQL_PERFIL=1: conexao.py passa ProfilingCursor como cursor_factory de
+# DB_PARAMS, então toda conexão da aplicação (pools, dashboard, treino, carga) é medida.
+PERFIL_PATH = os.getenv("FULLTIME_SQL_PERFIL_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "perfil_sql.db"))
+LIMITE_LENTA_MS = float(os.getenv("FULLTIME_SQL_LENTA_MS", "500"))
+# Fração das consultas lentas que ganham EXPLAIN (ANALYZE, BUFFERS): o ANALYZE executa a consulta de novo
+AMOSTRA_EXPLAIN = float(os.getenv("FULLTIME_SQL_EXPLAIN_AMOSTRA", "0.1"))
+FLUSH_INTERVALO_S = 30
+TEXTO_MAX = 4000
+
+_RE_COMENTARIO = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+_RE_STRING = re.compile(r"'(?:[^']|'')*'")
+_RE_PARAMETRO = re.compile(r"%\(\w+\)s|%s")
+_RE_NUMERO = re.compile(r"\b\d+(?:\.\d+)?\b")
+_RE_LISTA = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_RE_LISTAS = re.compile(r"\(\?\)(?:\s*,\s*\(\?\))+")
+_RE_ESPACO = re.compile(r"\s+")
+_RE_PONTUACAO = re.compile(r"\s*([=<>!,])\s*")
+_RE_PARENTESES = re.compile(r"(?<=\()\s+|\s+(?=\))")
+_RE_ESCRITA = re.compile(r"\b(insert|update|delete|merge|create|drop|alter|truncate|refresh|call)\b")
+
+
+def normalize(query):
+    """
+    Texto canônico da consulta: literais e parâmetros viram "?", listas IN/VALUES colapsam,
+    espaços e maiúsculas são uniformizados. Consultas que diferem só nos valores coincidem.
+    """
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", errors="replace")
+    texto = _RE_COMENTARIO.sub(" ", str(query))
+    texto = _RE_STRING.sub("?", texto)
+    texto = _RE_PARAMETRO.sub("?", texto)
+    texto = _RE_NUMERO.sub("?", texto)
+    texto = _RE_LISTA.sub("(?)", texto)
+    texto = _RE_LISTAS.sub("(?)", texto)
+    texto = _RE_PONTUACAO.sub(r"\1", _RE_ESPACO.sub(" ", texto))
+    texto = _RE_PARENTESES.sub("", texto)
+    return texto.strip().rstrip(";").strip().lower()
+
+
+def fingerprint(normalizada):
+    return hashlib.sha1(normalizada.encode("utf-8")).hexdigest()[:12]
+
+
+def is_read_only(normalizada):
+    return normalizada.startswith(("select", "with")) and not _RE_ESCRITA.search(normalizada)
+
+
+class Profiler:
+    """
+    Acumula, por impressão digital, chamadas, tempo total/máximo e linhas, mais as consultas
+    lentas com o plano. Os deltas vão para um SQLite compartilhado a cada FLUSH_INTERVALO_S
+    (e na saída do processo), para o relatório cobrir todas as réplicas e jobs.
+    """
+
+    def __init__(self, path=PERFIL_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.agregados = {}
+        self.lentas = []
+        self.ultimo_flush = time.monotonic()
+
+    def record(self, cursor, query, vars, segundos):
+        normalizada = normalize(query)
+        fp = fingerprint(normalizada)
+        linhas = max(cursor.rowcount, 0)
+        incr("consultas_sql")
+
+        with self.lock:
+            ag = self.agregados.get(fp)
+            if ag is None:
+                ag = self.agregados[fp] = {"texto": normalizada[:TEXTO_MAX], "chamadas": 0,
+                                           "total_ms": 0.0, "max_ms": 0.0, "linhas": 0, "lentas": 0}
+            ms = segundos * 1000
+            ag["chamadas"] += 1
+            ag["total_ms"] += ms
+            ag["max_ms"] = max(ag["max_ms"], ms)
+            ag["linhas"] += linhas
+            lenta = ms >= LIMITE_LENTA_MS
+            if lenta:
+                ag["lentas"] += 1
+
+        if lenta:
+            plano = None
+            # Cursor nomeado (server-side) já consumiu a consulta: não dá para repetir nele
+            if cursor.name is None and is_read_only(normalizada) and random.random() < AMOSTRA_EXPLAIN:
+                plano = explain(cursor.connection, query, vars)
+            texto = query.decode("utf-8", errors="replace") if isinstance(query, bytes) else str(query)
+            with self.lock:
+                self.lentas.append((time.time(), fp, ms, linhas, texto[:TEXTO_MAX], plano))
+
+        if time.monotonic() - self.ultimo_flush >= FLUSH_INTERVALO_S:
+            self.flush()
+
+    def _db(self):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL;")
+        db.executescript("""
+            CREATE TABLE IF NOT EXISTS consultas (
+                fingerprint TEXT PRIMARY KEY,
+                texto TEXT NOT NULL,
+                chamadas INTEGER NOT NULL,
+                total_ms REAL NOT NULL,
+                max_ms REAL NOT NULL,
+                linhas INTEGER NOT NULL,
+                lentas INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS consultas_lentas (
+                quando REAL NOT NULL,
+                fingerprint TEXT NOT NULL,
+                ms REAL NOT NULL,
+                linhas INTEGER NOT NULL,
+                consulta TEXT NOT NULL,
+                plano TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_lentas_quando ON consultas_lentas (quando);
+        """)
+        return db
+
+    def flush(self):
+        with self.lock:
+            agregados, self.agregados = self.agregados, {}
+            lentas, self.lentas = self.lentas, []
+            self.ultimo_flush = time.monotonic()
+        if not agregados and not lentas:
+            return
+        try:
+            db = self._db()
+            with db:
+                db.execute("BEGIN IMMEDIATE;")
+                db.executemany("""
+                    INSERT INTO consultas (fingerprint, texto, chamadas, total_ms, max_ms, linhas, lentas)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (fingerprint) DO UPDATE SET
+                        chamadas = chamadas + excluded.chamadas,
+                        total_ms = total_ms + excluded.total_ms,
+                        max_ms = MAX(max_ms, excluded.max_ms),
+                        linhas = linhas + excluded.linhas,
+                        lentas = lentas + excluded.lentas;
+                """, [(fp, a["texto"], a["chamadas"], a["total_ms"], a["max_ms"], a["linhas"], a["lentas"])
+                      for fp, a in agregados.items()])
+                db.executemany("INSERT INTO consultas_lentas VALUES (?, ?, ?, ?, ?, ?);", lentas)
+            db.close()
+        except sqlite3.Error as e:
+            # O perfil nunca derruba a aplicação; perde-se só este lote
+            print("[ERRO] Falha ao gravar o perfil SQL:", e)
+
+
+_profiler = Profiler()
+atexit.register(_profiler.flush)
+
+
+def explain(conn, query, vars):
+    """
+    EXPLAIN (ANALYZE, BUFFERS) da consulta num cursor comum, protegido por savepoint
+    para que uma falha no EXPLAIN não aborte a transação da aplicação.
+    """
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", errors="replace")
+    em_transacao = not conn.autocommit
+    try:
+        with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+            if em_transacao:
+                cur.execute("SAVEPOINT perfil_explain;")
+            try:
+                cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + query.strip().rstrip(";"), vars)
+                plano = "\n".join(row[0] for row in cur.fetchall())
+            except psycopg2.Error as e:
+                if em_transacao:
+                    cur.execute("ROLLBACK TO SAVEPOINT perfil_explain;")
+                return f"(EXPLAIN falhou: {str(e).strip()})"
+            if em_transacao:
+                cur.execute("RELEASE SAVEPOINT perfil_explain;")
+            return plano
+    except psycopg2.Error:
+        return None
+
+
+class ProfilingCursor(psycopg2.extensions.cursor):
+    """
+    Cursor que mede cada execute/executemany (tempo e linhas) e registra no Profiler.
+    Também vale para pd.read_sql_query, que usa conn.cursor().
+    """
+
+    def execute(self, query, vars=None):
+        inicio = time.perf_counter()
+        resultado = super().execute(query, vars)
+        _profiler.record(self, query, vars, time.perf_counter() - inicio)
+        return resultado
+
+    def executemany(self, query, vars_list):
+        inicio = time.perf_counter()
+        resultado = super().executemany(query, vars_list)
+        _profiler.record(self, query, None, time.perf_counter() - inicio)
+        return resultado
+
+
+def report(path=PERFIL_PATH, top=20, ordenar="total_ms"):
+    """
+    Resumo por impressão digital, ordenado por tempo total (o que mais pesa no banco),
+    tempo médio ou número de chamadas.
+    """
+    db = sqlite3.connect(path)
+    ordem = {"total_ms": "total_ms", "media_ms": "total_ms / chamadas", "chamadas": "chamadas"}[ordenar]
+    linhas = db.execute(f"""
+        SELECT fingerprint, chamadas, total_ms, total_ms / chamadas, max_ms, linhas * 1.0 / chamadas, lentas, texto
+        FROM consultas ORDER BY {ordem} DESC LIMIT ?;
+    """, (top,)).fetchall()
+    total_geral = db.execute("SELECT COALESCE(SUM(total_ms), 0) FROM consultas;").fetchone()[0]
+    db.close()
+    return linhas, total_geral
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Relatório do perfil SQL (rode a aplicação com FULLTIME_SQL_PERFIL=1).")
+    parser.add_argument("--top", type=int, default=20, help="Quantidade de consultas no relatório.")
+    parser.add_argument("--ordenar", choices=["total_ms", "media_ms", "chamadas"], default="total_ms")
+    parser.add_argument("--lentas", type=int, default=0, metavar="N",
+                        help="Mostra também as N consultas lentas mais recentes, com o plano quando amostrado.")
+    parser.add_argument("--limpar", action="store_true", help="Apaga o perfil acumulado.")
+    args = parser.parse_args()
+
+    if not os.path.exists(PERFIL_PATH):
+        print(f"[ERRO] {PERFIL_PATH} não existe — rode a aplicação com FULLTIME_SQL_PERFIL=1.")
+        return
+
+    if args.limpar:
+        db = _profiler._db()
+        db.execute("DELETE FROM consultas;")
+        db.execute("DELETE FROM consultas_lentas;")
+        db.close()
+        print("[OK] Perfil SQL apagado.")
+        return
+
+    linhas, total_geral = report(PERFIL_PATH, args.top, args.ordenar)
+    print(f"{'consulta':12s} {'chamadas':>9s} {'total ms':>11s} {'%':>6s} {'média ms':>9s} "
+          f"{'máx ms':>9s} {'linhas/ch':>10s} {'lentas':>7s}")
+    for fp, chamadas, total_ms, media_ms, max_ms, linhas_ch, lentas, texto in linhas:
+        pct = total_ms / total_geral * 100 if total_geral else 0
+        print(f"{fp:12s} {chamadas:9d} {total_ms:11.1f} {pct:6.1f} {media_ms:9.1f} {max_ms:9.1f} "
+              f"{linhas_ch:10.1f} {lentas:7d}")
+        print(f"    {texto[:160]}")
+
+    if args.lentas:
+        db = sqlite3.connect(PERFIL_PATH)
+        recentes = db.execute("""
+            SELECT quando, fingerprint, ms, linhas, consulta, plano
+            FROM consultas_lentas ORDER BY quando DESC LIMIT ?;
+        """, (args.lentas,)).fetchall()
+        db.close()
+        for quando, fp, ms, n, consulta, plano in recentes:
+            print(f"\n--- {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(quando))}  {fp}  {ms:.0f} ms  {n} linha(s)")
+            print(consulta.strip())
+            if plano:
+                print(plano)
+
+
+if __name__ == "__main__":
+    main()
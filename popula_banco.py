@@ -1,8 +1,12 @@
+import argparse
 import psycopg2
+from psycopg2.extras import execute_values
 from faker import Faker
 import random
 import numpy as np
 from datetime import timedelta, datetime
+from conexao import DB_PARAMS
+from detalhe_usuarios import refresh_summary
 
 fake = Faker("pt_BR")
 
@@ -79,12 +83,32 @@ def inserir_eventos(cursor):
     for e in EVENTOS:
         cursor.execute("INSERT INTO eventos_especiais (nome_eventos) VALUES (%s);", (fix_utf8(e),))
 
+def inserir_localizacoes(cursor, sorteios=200):
+    # Cidades reais com coordenadas (provedor geo do Faker), cada nome uma única vez
+    cidades = {}
+    for _ in range(sorteios):
+        lat, lon, cidade, _, _ = fake.local_latlng(country_code="BR")
+        cidades[fix_utf8(cidade)] = (float(lat), float(lon))
+    execute_values(
+        cursor,
+        "INSERT INTO localizacoes (nome, latitude, longitude) VALUES %s ON CONFLICT (nome) DO NOTHING;",
+        [(nome, lat, lon) for nome, (lat, lon) in cidades.items()]
+    )
+
 def inserir_alerta_excesso(cursor):
     for a in ALERTAS:
         cursor.execute("INSERT INTO altera_excesso (nome_alerta) VALUES (%s);", (fix_utf8(a),))
 
 
-def inserir_usuarios(cursor):
+def inserir_empresa(cursor, nome):
+    # Cada empresa (tenant) ganha a sua partição de log_uso_sim
+    cursor.execute("INSERT INTO empresas (nome) VALUES (%s) RETURNING id_empresa;", (fix_utf8(nome),))
+    id_empresa = cursor.fetchone()[0]
+    cursor.execute("SELECT cria_particao_empresa(%s);", (id_empresa,))
+    return id_empresa
+
+
+def inserir_usuarios(cursor, id_empresa=1, qtd_usuarios=50):
     # Busca IDs do banco para mapear
     cursor.execute("SELECT nome, id_departamento FROM departamentos;")
     # Cria dict: {'Vendas': 1, 'TI': 2}
@@ -93,7 +117,6 @@ def inserir_usuarios(cursor):
     cursor.execute("SELECT nome, id_cargo FROM cargos;")
     # Cria dict: {'Vendedor': 1, 'Gerente': 2}
     map_cargo = {row[0]: row[1] for row in cursor.fetchall()}
-    qtd_usuarios = 50 
 
     for _ in range(qtd_usuarios):
         nome = fix_utf8(fake.name())
@@ -107,14 +130,14 @@ def inserir_usuarios(cursor):
 
         cursor.execute(
             """INSERT INTO usuario (nome, id_departamento, id_cargo, id_empresa)
-               VALUES (%s, %s, %s, 1);""",
-            (nome, id_dep, id_cargo)
+               VALUES (%s, %s, %s, %s);""",
+            (nome, id_dep, id_cargo, id_empresa)
         )
 
 
 
-def inserir_log(cursor):
-    cursor.execute("SELECT id_usuario, id_departamento, id_cargo FROM usuario;")
+def inserir_log(cursor, id_empresa=1, qtd_logs=15000):
+    cursor.execute("SELECT id_usuario, id_departamento, id_cargo FROM usuario WHERE id_empresa = %s;", (id_empresa,))
     usuarios = cursor.fetchall()
 
     if not usuarios:
@@ -132,6 +155,9 @@ def inserir_log(cursor):
 
     cursor.execute("SELECT id_dispositivo FROM dispositivos;")
     dispositivos = [r[0] for r in cursor.fetchall()]
+
+    cursor.execute("SELECT id_localizacao FROM localizacoes;")
+    localizacoes = [r[0] for r in cursor.fetchall()]
     
     cursor.execute("SELECT id_departamento, nome FROM departamentos;")
     map_dep_nome = {r[0]: r[1] for r in cursor.fetchall()}
@@ -141,8 +167,9 @@ def inserir_log(cursor):
 
     data_inicio = datetime.now() - timedelta(days=540)
     historico_consumo = {}
+    linhas = []
 
-    for _ in range(15000):
+    for _ in range(qtd_logs):
 
         id_usuario, id_departamento, id_cargo = random.choice(usuarios)
 
@@ -174,14 +201,9 @@ def inserir_log(cursor):
 
         historico_consumo[(id_usuario, data_ref)] = consumo
 
-        cursor.execute(
-            """
-            INSERT INTO log_uso_sim (
-                id_usuario, id_situacao, id_alerta, id_evento, id_dispositivo,
-                data_uso, consumo_dados_gb, custo_total, localizacao, data_referencia
-            ) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s);
-            """,
+        linhas.append(
             (
+                id_empresa,
                 id_usuario,
                 random.choice(situacoes),
                 random.choice(alertas),
@@ -190,22 +212,49 @@ def inserir_log(cursor):
                 data_uso,
                 consumo,
                 custo_total,
-                fix_utf8(fake.city()),
+                random.choice(localizacoes),
                 data_ref
             )
         )
 
+    # Inserção em lotes: com muitas empresas o volume total cresce bastante
+    execute_values(
+        cursor,
+        """
+        INSERT INTO log_uso_sim (
+            id_empresa, id_usuario, id_situacao, id_alerta, id_evento, id_dispositivo,
+            data_uso, consumo_dados_gb, custo_total, id_localizacao, data_referencia
+        ) VALUES %s;
+        """,
+        linhas,
+        page_size=5000
+    )
+
+def tamanhos_empresas(qtd_empresas, usuarios, logs, variavel):
+    """
+    (usuários, logs) de cada empresa. Com `variavel`, o porte segue uma cauda longa
+    (poucos clientes grandes, muitos pequenos), como numa base real de clientes.
+    """
+    tamanhos = []
+    for i in range(qtd_empresas):
+        fator = 1.0 if not variavel or i == 0 else min(random.paretovariate(1.2) / 2, 10.0)
+        tamanhos.append((max(1, int(usuarios * fator)), max(1, int(logs * fator))))
+    return tamanhos
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Popula o banco ANALISE com dados sintéticos.")
+    parser.add_argument("--empresas", type=int, default=1, help="Quantidade de empresas (tenants) a gerar.")
+    parser.add_argument("--usuarios", type=int, default=50, help="Usuários por empresa.")
+    parser.add_argument("--logs", type=int, default=15000, help="Registros de uso por empresa.")
+    parser.add_argument("--tamanho-variavel", action="store_true",
+                        help="Varia o porte das empresas (cauda longa) em vez de todas iguais.")
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
 
     try:
-        conn = psycopg2.connect(
-            host="localhost",
-            port="5433",
-            user="postgres",
-            password="1234",
-            database="ANALISE",
-            client_encoding="UTF8"
-        )
+        conn = psycopg2.connect(**DB_PARAMS, client_encoding="UTF8")
 
         conn.set_client_encoding("UTF8")
         cursor = conn.cursor()
@@ -216,9 +265,6 @@ def main():
         return
 
     try:
-        cursor.execute("INSERT INTO empresas (nome) VALUES ('Empresa X');")
-        print("[OK] Empresa inserida.")
-
         inserir_departamentos(cursor)
         print("[OK] Departamentos inseridos.")
 
@@ -237,15 +283,24 @@ def main():
         inserir_alerta_excesso(cursor)
         print("[OK] Alertas inseridos.")
 
-        inserir_usuarios(cursor)
-        print("[OK] Usuários inseridos (Cargos respeitando Departamentos).")
+        inserir_localizacoes(cursor)
+        print("[OK] Localizações inseridas.")
 
-        inserir_log(cursor)
-        print("[OK] Logs de consumo inseridos.")
+        tamanhos = tamanhos_empresas(args.empresas, args.usuarios, args.logs, args.tamanho_variavel)
+        for i, (qtd_usuarios, qtd_logs) in enumerate(tamanhos):
+            nome = "Empresa X" if args.empresas == 1 else f"{fake.company()} ({i + 1})"
+            id_empresa = inserir_empresa(cursor, nome)
+
+            inserir_usuarios(cursor, id_empresa, qtd_usuarios)
+            inserir_log(cursor, id_empresa, qtd_logs)
+            print(f"[OK] Empresa {id_empresa}: {qtd_usuarios} usuários e {qtd_logs} logs inseridos.")
 
         conn.commit()
         print("\n[SUCESSO] Todos os dados foram salvos no banco!")
 
+        refresh_summary(conn)
+        print("[OK] Resumo por usuário atualizado.")
+
     except Exception as e:
         conn.rollback()
         print("\n[ERRO] Falha durante a execução:", e)
@@ -0,0 +1,131 @@
+# previsao.py
+import numpy as np
+import pandas as pd
+
+from metricas import incr
+from treina_lightgbm_db import (
+    FEATURES, CATEGORICAL_COLS, DIRECT_FEATURES, DIRECT_CATEGORICAL_COLS,
+    GROUP_FEATURES, GROUP_CATEGORICAL_COLS,
+    monthly_series, monthly_state_features, expand_horizons, group_daily_series
+)
+
+MODO_RECURSIVO = "Recursivo (diário)"
+MODO_DIRETO = "Direto (mensal)"
+MODO_HIERARQUICO = "Hierárquico (grupo)"
+
+
+def get_user_model(meta, registry, default_model):
+    # Roteia o usuário para o modelo do seu segmento; sem modelo próprio, usa o global
+    if registry:
+        segment_model = registry["modelos"].get(str(meta[registry["segmento"]]))
+        if segment_model is not None:
+            return segment_model
+    return default_model
+
+
+# --- PREVISÃO RECURSIVA POR USUÁRIO ---
+def forecast_user(modelo, user_hist, future_dates, features=FEATURES, categorical_cols=CATEGORICAL_COLS):
+    hist_vals = user_hist['consumo_dados_gb'].tail(60).tolist()
+    user_std = np.std(hist_vals) if len(hist_vals) > 1 else 1.0
+    meta = user_hist.iloc[-1]
+    preds = []
+    for date_fc in future_dates:
+        feat = {
+            'year': date_fc.year, 'month': date_fc.month, 'day': date_fc.day,
+            'dayofweek': date_fc.dayofweek, 'weekofyear': date_fc.isocalendar().week,
+            'is_weekend': 1 if date_fc.dayofweek >= 5 else 0,
+            'lag_1': hist_vals[-1],
+            'lag_7': hist_vals[-7] if len(hist_vals)>=7 else hist_vals[-1],
+            'lag_30': hist_vals[-30] if len(hist_vals)>=30 else hist_vals[-1],
+            'rolling_7': np.mean(hist_vals[-7:]), 'rolling_30': np.mean(hist_vals[-30:]),
+        }
+        for c in categorical_cols: feat[c] = meta[c]
+        X = pd.DataFrame([feat])
+        for c in categorical_cols: X[c] = X[c].astype('category')
+        base_pred = modelo.predict(X[features])[0]
+        incr("predict_chamadas", modo="recursivo")
+        noise = np.random.normal(0, user_std * 0.6) 
+        val = max(0, (base_pred + noise) * 1.001)
+        hist_vals.append(val)
+        preds.append(val)
+    return pd.Series(preds, index=future_dates)
+
+
+def forecast_recursive(df_seeds, horizon, default_model, registry=None, min_rows=15):
+    """
+    Previsão diária recursiva (horizon*30 passos) de cada usuário, agregada por mês.
+    Retorna uma Series mensal (início do mês -> GB) ou None se nenhum usuário tiver histórico.
+    """
+    last_date = df_seeds['data'].max()
+    future_dates = pd.date_range(last_date + pd.Timedelta(days=1), periods=horizon*30)
+
+    all_forecasts = []
+    for uid, user_hist in df_seeds.groupby('id_usuario'):
+        user_hist = user_hist.sort_values('data', kind='stable')
+        if len(user_hist) < min_rows: continue
+        user_model = get_user_model(user_hist.iloc[-1], registry, default_model)
+        if user_model is None: continue
+        all_forecasts.append(forecast_user(user_model, user_hist, future_dates))
+
+    if not all_forecasts:
+        return None
+    fc_daily = pd.concat(all_forecasts, axis=1).sum(axis=1)
+    return fc_daily.resample('MS').sum()
+
+
+# --- PREVISÃO DIRETA MULTI-HORIZONTE ---
+def forecast_direct(modelo, df_hist, horizon):
+    """
+    Previsão mensal direta: o estado atual de cada usuário é replicado para h=1..horizon
+    e todas as linhas são previstas numa única chamada ao modelo.
+    """
+    state = monthly_state_features(monthly_series(df_hist))
+    if state.empty:
+        return None
+    state = state.groupby('id_usuario').tail(1)
+
+    X = expand_horizons(state, range(1, horizon + 1))
+    for c in DIRECT_CATEGORICAL_COLS: X[c] = X[c].astype('category')
+    X['previsao'] = np.clip(modelo.predict(X[DIRECT_FEATURES]), 0, None)
+    incr("predict_chamadas", modo="direto")
+    incr("linhas_previstas", len(X), modo="direto")
+    return X.groupby('mes_alvo')['previsao'].sum().sort_index()
+
+
+# --- PREVISÃO HIERÁRQUICA (GRUPO -> USUÁRIO) ---
+def forecast_groups(df_group, horizon, modelo):
+    """
+    Uma recursão por série agregada (departamento x cargo), independente do nº de SIM cards.
+    Entrada: consumo diário por grupo (data_uso, consumo, departamento, cargo).
+    Retorna DataFrame mensal com uma coluna por departamento.
+    """
+    series = group_daily_series(df_group)
+    series = series.assign(data=series['data_uso']).rename(columns={'consumo': 'consumo_dados_gb'})
+    last_date = series['data'].max()
+    future_dates = pd.date_range(last_date + pd.Timedelta(days=1), periods=horizon*30)
+
+    forecasts = {}
+    for (dep, cargo), group_hist in series.groupby(['departamento', 'cargo']):
+        fc = forecast_user(modelo, group_hist.sort_values('data'), future_dates,
+                           GROUP_FEATURES, GROUP_CATEGORICAL_COLS)
+        forecasts[dep] = fc.resample('MS').sum()
+    return pd.DataFrame(forecasts)
+
+
+def reconcile_top_down(fc_groups, user_shares):
+    """
+    Reconciliação top-down: cada usuário recebe a previsão do seu grupo multiplicada
+    pela sua participação histórica no volume do grupo.
+    `user_shares`: id_usuario, usuario, departamento, consumo (volume recente).
+    """
+    shares = user_shares.copy()
+    totals = shares.groupby('departamento')['consumo'].transform('sum')
+    shares['participacao'] = np.where(totals > 0, shares['consumo'] / totals, 0.0)
+    shares = shares[shares['departamento'].isin(fc_groups.columns)]
+
+    fc_by_user = fc_groups[shares['departamento']].T.values * shares['participacao'].values[:, None]
+    drill = pd.DataFrame(fc_by_user, columns=fc_groups.index.strftime('%b/%Y'))
+    drill.insert(0, 'Participação (%)', shares['participacao'].values * 100)
+    drill.insert(0, 'Usuário', shares['usuario'].values)
+    drill.insert(0, 'Departamento', shares['departamento'].values)
+    return drill.sort_values(['Departamento', 'Participação (%)'], ascending=[True, False]).reset_index(drop=True)
@@ -0,0 +1,379 @@
+# teste_carga.py
+import argparse
+import json
+import logging
+import os
+import random
+import resource
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import numpy as np
+
+RESULTS_PATH = "teste_carga_resultados.json"
+ESCALA_PADRAO = "100000:1000"
+NIVEIS_PADRAO = "1,5,10,20"
+TIPOS_GRAFICO = ["Tendência Conectada", "Volumetria vs Média", "Variação % (MoM)"]
+
+# Página do dashboard isolada (o menu do frontendalt é um componente, que o AppTest não aciona),
+# com a mesma contabilidade de memória do frontendalt.py
+PAGINA_DASHBOARD = """
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+import dashboard
+import memoria
+
+dashboard.show_dashboard_ui()
+memoria.account_session(get_script_run_ctx().session_id, st.session_state)
+"""
+
+GRUPOS_QUERY = """
+SELECT d.nome AS departamento, c.nome AS cargo, COUNT(*) AS usuarios
+FROM usuario u
+JOIN departamentos d ON u.id_departamento = d.id_departamento
+JOIN cargos c ON u.id_cargo = c.id_cargo
+WHERE u.id_empresa = %(id_empresa)s
+GROUP BY d.nome, c.nome
+ORDER BY COUNT(*) DESC
+LIMIT 10;
+"""
+
+
+# --- BANCO SUBSTITUTO (SQLite) ---
+class StandinCursor:
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def execute(self, query, params=None):
+        from benchmark_escala import to_sqlite
+
+        query = to_sqlite(query).replace("%s", "?")
+        return self.cursor.execute(query, params if params is not None else ())
+
+    def __getattr__(self, nome):
+        return getattr(self.cursor, nome)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cursor.close()
+        return False
+
+
+class StandinConnection:
+    """
+    Conexão com a interface que o app usa do psycopg2 (cursor, commit, rollback, close) sobre
+    o SQLite do benchmark_escala.py. Consultas com sintaxe exclusiva do PostgreSQL falham e
+    caem no tratamento de erro de cada loader, como num banco sem a tabela correspondente.
+    """
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+
+    def cursor(self):
+        return StandinCursor(self.conn.cursor())
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+    def close(self):
+        self.conn.close()
+
+
+def install_standin(db_path):
+    """
+    Liga o app ao SQLite: conexão do dashboard, consultas paralelas (mesmo limite de
+    concorrência do pool de produção) e verificação de status da barra lateral.
+    """
+    import consultas_paralelas
+    import dashboard
+
+    executor = ThreadPoolExecutor(max_workers=consultas_paralelas.POOL_MAX, thread_name_prefix="consulta")
+
+    def run_concurrent(tasks, timeout=consultas_paralelas.QUERY_TIMEOUT_S):
+        def executar(task):
+            conn = StandinConnection(db_path)
+            try:
+                return task(conn)
+            finally:
+                conn.close()
+
+        futures = {executor.submit(executar, task): nome for nome, task in tasks.items()}
+        done, pending = wait(futures, timeout=timeout)
+        resultados, erros = {}, {}
+        for future in done:
+            try:
+                resultados[futures[future]] = future.result()
+            except Exception as e:
+                erros[futures[future]] = str(e) or type(e).__name__
+        for future in pending:
+            erros[futures[future]] = f"tempo esgotado ({timeout:.0f}s)"
+        return resultados, erros
+
+    consultas_paralelas.run_concurrent = run_concurrent
+    consultas_paralelas.check_connection = lambda timeout=3: True
+    dashboard.run_concurrent = run_concurrent
+    dashboard.init_db_conn = lambda: StandinConnection(db_path)
+
+
+def load_groups(conn, id_empresa=1):
+    # Departamento x cargo com mais usuários: os filtros que os gestores mais escolhem
+    cur = conn.cursor()
+    cur.execute(GRUPOS_QUERY, {"id_empresa": id_empresa})
+    return [(dep, cargo) for dep, cargo, _ in cur.fetchall()]
+
+
+# --- SESSÕES SIMULTÂNEAS ---
+def share_apptest_runtime():
+    """
+    O AppTest instala um Runtime falso global no início de cada run e o remove no fim, o que
+    quebra runs simultâneos. Aqui o primeiro run em andamento fornece o Runtime para todos
+    (como numa réplica real, com um só gerenciador de mídia e de cache) e ele só é removido
+    quando o último termina.
+    """
+    from streamlit.runtime import Runtime
+    from streamlit.testing.v1 import app_test
+
+    lock = threading.Lock()
+    ativos = [0]
+
+    class SharedInstance(type):
+        def __setattr__(cls, nome, valor):
+            if nome != "_instance":
+                return super().__setattr__(nome, valor)
+            with lock:
+                if valor is None:
+                    ativos[0] -= 1
+                    if ativos[0] == 0:
+                        Runtime._instance = None
+                else:
+                    ativos[0] += 1
+                    if Runtime._instance is None:
+                        Runtime._instance = valor
+
+    class SharedRuntime(Runtime, metaclass=SharedInstance):
+        pass
+
+    app_test.Runtime = SharedRuntime
+
+
+# --- MEDIÇÃO ---
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class RssSampler(threading.Thread):
+    # Pico de memória do processo (a réplica) durante um nível de carga
+    def __init__(self, intervalo=0.25):
+        super().__init__(daemon=True)
+        self.intervalo = intervalo
+        self.pico = rss_bytes()
+        self.parar = threading.Event()
+
+    def run(self):
+        while not self.parar.wait(self.intervalo):
+            self.pico = max(self.pico, rss_bytes())
+
+
+def percentiles(valores):
+    if not valores:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+    p50, p95, p99 = np.percentile(valores, [50, 95, 99])
+    return {"p50": float(p50), "p95": float(p95), "p99": float(p99), "max": float(max(valores))}
+
+
+def session_flow(sessao, grupos, args, registrar):
+    """
+    Fluxo de um gestor: página inicial (KPIs), dashboard, filtros, "Gerar Previsão" e troca
+    do tipo de gráfico. Cada passo é um rerun do script medido de ponta a ponta.
+    """
+    from streamlit.testing.v1 import AppTest
+
+    rng = random.Random(args.seed + sessao)
+
+    def passo(nome, acao):
+        time.sleep(rng.uniform(0, args.pausa))
+        inicio = time.perf_counter()
+        try:
+            at = acao()
+            erro = "; ".join(e.message for e in at.exception) or None
+        except Exception as e:
+            at, erro = None, str(e) or type(e).__name__
+        registrar(nome, time.perf_counter() - inicio, erro)
+        return at if erro is None else None
+
+    for _ in range(args.iteracoes):
+        inicio = AppTest.from_file("frontendalt.py", default_timeout=args.timeout)
+        passo("inicio", inicio.run)
+
+        at = AppTest.from_string(PAGINA_DASHBOARD, default_timeout=args.timeout)
+        if passo("dashboard", at.run) is None:
+            continue
+        departamento, cargo = rng.choice(grupos)
+        if passo("filtro_departamento", lambda: at.multiselect[0].set_value([departamento]).run()) is None:
+            continue
+        if passo("filtro_cargo", lambda: at.multiselect[1].set_value([cargo]).run()) is None:
+            continue
+
+        sliders = [s for s in at.slider if s.label == "Projetar meses:"]
+        botoes = [b for b in at.button if b.label == "Gerar Previsão"]
+        if not sliders or not botoes:
+            registrar("gerar_previsao", 0.0, "controles de previsão ausentes")
+            continue
+        sliders[0].set_value(args.horizonte)
+        if passo("gerar_previsao", lambda: botoes[0].click().run()) is None:
+            continue
+        if "forecast_done" not in at.session_state:
+            registrar("trocar_grafico", 0.0, "previsão não gerada")
+            continue
+
+        for tipo in TIPOS_GRAFICO[1:] + TIPOS_GRAFICO[:1]:
+            radios = [r for r in at.radio if r.label == "Visualização:"]
+            if not radios:
+                break
+            passo("trocar_grafico", lambda: radios[0].set_value(tipo).run())
+
+
+def run_level(n_sessoes, grupos, args):
+    import memoria
+
+    medicoes = []
+    lock = threading.Lock()
+
+    def registrar(passo, segundos, erro):
+        with lock:
+            medicoes.append((passo, segundos, erro))
+
+    amostrador = RssSampler()
+    amostrador.start()
+    inicio = time.perf_counter()
+    threads = [threading.Thread(target=session_flow, args=(i, grupos, args, registrar)) for i in range(n_sessoes)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    duracao = time.perf_counter() - inicio
+    amostrador.parar.set()
+    amostrador.join()
+
+    validas = [s for _, s, erro in medicoes if erro is None]
+    resultado = {
+        "sessoes": n_sessoes,
+        "duracao_s": duracao,
+        "reruns": len(medicoes),
+        "erros": len(medicoes) - len(validas),
+        "vazao_reruns_s": len(validas) / duracao if duracao > 0 else None,
+        "latencia": percentiles(validas),
+        "por_passo": {},
+        "rss_pico_mb": amostrador.pico / 1024 ** 2,
+        "rss_final_mb": rss_bytes() / 1024 ** 2,
+        "memoria_sessoes": memoria.sessions_summary(),
+        "exemplos_erro": sorted({erro for _, _, erro in medicoes if erro})[:5],
+    }
+    for passo in dict.fromkeys(p for p, _, _ in medicoes):
+        tempos = [s for p, s, erro in medicoes if p == passo and erro is None]
+        resultado["por_passo"][passo] = {"reruns": len(tempos), **percentiles(tempos)}
+    return resultado
+
+
+def print_level(r, limite_p95):
+    lat = r["latencia"]
+    fmt = lambda v: f"{v:7.2f}s" if v is not None else "      -"
+    saturado = lat["p95"] is not None and lat["p95"] > limite_p95
+    print(f"\n[{r['sessoes']:3d} sessão(ões)] {r['reruns']} reruns em {r['duracao_s']:.1f}s · "
+          f"{r['vazao_reruns_s'] or 0:.2f} reruns/s · {r['erros']} erro(s)"
+          + ("  << SATURADO" if saturado else ""))
+    print(f"  latência p50 {fmt(lat['p50'])}  p95 {fmt(lat['p95'])}  p99 {fmt(lat['p99'])}  "
+          f"· RSS pico {r['rss_pico_mb']:.0f} MB · sessões {r['memoria_sessoes']['bytes'] / 1024:.0f} KB")
+    for passo, p in r["por_passo"].items():
+        print(f"    {passo:20s} n={p['reruns']:4d}  p50 {fmt(p['p50'])}  p95 {fmt(p['p95'])}  p99 {fmt(p['p99'])}")
+    for erro in r["exemplos_erro"]:
+        print(f"  [ERRO] {erro[:200]}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Teste de carga: N sessões simuladas (AppTest) numa réplica, com latência p50/p95/p99."
+    )
+    parser.add_argument("--sessoes", default=NIVEIS_PADRAO,
+                        help="Níveis de sessões simultâneas, separados por vírgula (ex.: 1,5,10,20).")
+    parser.add_argument("--iteracoes", type=int, default=1, help="Repetições do fluxo completo por sessão.")
+    parser.add_argument("--banco", choices=["sqlite", "postgres"], default="sqlite",
+                        help="sqlite: banco substituto gerado pelo benchmark_escala.py; postgres: DB_PARAMS (conexao.py).")
+    parser.add_argument("--escala", default=ESCALA_PADRAO, help="logs:usuarios do banco substituto.")
+    parser.add_argument("--horizonte", type=int, default=1, help="Meses projetados em cada \"Gerar Previsão\".")
+    parser.add_argument("--pausa", type=float, default=0.5, help="Pausa máxima (s) entre as ações de uma sessão.")
+    parser.add_argument("--timeout", type=float, default=120, help="Tempo máximo (s) de um rerun.")
+    parser.add_argument("--limite-p95", type=float, default=5.0,
+                        help="p95 (s) acima do qual o nível é marcado como saturado.")
+    parser.add_argument("--cache-compartilhado", action="store_true",
+                        help="Usa o cache compartilhado configurado (padrão: um arquivo temporário vazio).")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--saida", default=RESULTS_PATH)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    niveis = [int(n) for n in args.sessoes.split(",") if n.strip()]
+
+    # Antes de importar o app: o cache compartilhado lê o caminho na importação
+    if not args.cache_compartilhado:
+        os.environ["FULLTIME_CACHE_PATH"] = os.path.join(tempfile.mkdtemp(prefix="teste_carga_"), "cache.db")
+    warnings.filterwarnings("ignore")
+    # Avisos de "missing ScriptRunContext" das threads que criam os AppTest
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    share_apptest_runtime()
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    if args.banco == "sqlite":
+        from benchmark_escala import build_standin, parse_escalas
+
+        (n_logs, n_usuarios), = parse_escalas(args.escala)
+        db_path = build_standin(n_logs, n_usuarios)
+        install_standin(db_path)
+        conn = StandinConnection(db_path)
+    else:
+        import psycopg2
+        from conexao import DB_PARAMS
+
+        conn = psycopg2.connect(**DB_PARAMS)
+    grupos = load_groups(conn)
+    conn.close()
+    if not grupos:
+        print("[ERRO] Nenhum departamento x cargo com usuários na empresa 1.")
+        sys.exit(1)
+
+    print(f"[OK] Banco: {args.banco} · {len(grupos)} filtro(s) departamento x cargo · níveis {niveis}")
+    resultados = []
+    for n in niveis:
+        resultado = run_level(n, grupos, args)
+        print_level(resultado, args.limite_p95)
+        resultados.append(resultado)
+
+    with open(args.saida, "w", encoding="utf-8") as f:
+        json.dump({"quando": time.strftime("%Y-%m-%dT%H:%M:%S"), "banco": args.banco,
+                   "escala": args.escala if args.banco == "sqlite" else None, "niveis": resultados},
+                  f, ensure_ascii=False, indent=2)
+    print(f"\n[OK] Resultados gravados em {args.saida}.")
+
+    saturados = [r["sessoes"] for r in resultados if r["latencia"]["p95"] and r["latencia"]["p95"] > args.limite_p95]
+    if saturados:
+        print(f"[AVISO] p95 acima de {args.limite_p95:.1f}s a partir de {saturados[0]} sessão(ões).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+# test_detector_anomalias.py
+import math
+import random
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from detector_anomalias import MIN_AMOSTRAS, apply_rows, classify, new_state, score, update_state
+
+
+def build_state(valores):
+    state = new_state()
+    for x in valores:
+        state = update_state(state, x)
+    return state
+
+
+def test_welford_matches_numpy():
+    rng = np.random.default_rng(42)
+    valores = rng.lognormal(0.4, 0.55, 500)
+    state = build_state(valores)
+    assert state["n"] == len(valores)
+    assert state["media"] == pytest.approx(np.mean(valores), rel=1e-12)
+    assert state["m2"] / (state["n"] - 1) == pytest.approx(np.var(valores, ddof=1), rel=1e-10)
+
+
+def test_nothing_flagged_before_min_amostras():
+    state = new_state()
+    for i in range(MIN_AMOSTRAS):
+        z, ewma_dev = score(state, 1000.0)
+        assert (z, ewma_dev) == (None, None)
+        assert classify(z, ewma_dev) is None
+        state = update_state(state, 1.0 + 0.1 * (i % 3))
+    assert score(state, 1000.0)[0] is not None
+
+
+def test_four_sigma_spike_is_critical():
+    valores = [1.0 + 0.1 * (i % 5) for i in range(50)]
+    state = build_state(valores)
+    std = math.sqrt(state["m2"] / (state["n"] - 1))
+    z, ewma_dev = score(state, state["media"] + 4 * std * 1.001)
+    assert z == pytest.approx(4.0, rel=1e-2)
+    assert classify(z, ewma_dev) == "CRITICAL"
+    assert classify(*score(state, state["media"])) is None
+
+
+def test_rows_applied_in_data_uso_order():
+    inicio = datetime(2026, 1, 1)
+    # (id_transacao, id_log, id_empresa, id_usuario, data_uso, consumo); pico no último dia
+    rows = [("1", i, 1, 7, inicio + timedelta(days=i), 1.0 + 0.1 * (i % 5)) for i in range(30)]
+    rows.append(("1", 30, 1, 7, inicio + timedelta(days=30), 50.0))
+    anteriores = rows[:-1]
+    random.Random(0).shuffle(anteriores)
+    fora_de_ordem = rows[-1:] + anteriores
+
+    estados_ordem, estados_fora = {}, {}
+    eventos_ordem = apply_rows(rows, estados_ordem)
+    eventos_fora = apply_rows(fora_de_ordem, estados_fora)
+
+    assert estados_fora == estados_ordem
+    assert eventos_fora == eventos_ordem
+    # O pico chegou primeiro no lote, mas é avaliado depois do histórico do usuário
+    assert [(e[2], e[-1]) for e in eventos_fora] == [(30, "CRITICAL")]
@@ -0,0 +1,69 @@
+# test_heavy_hitters.py
+from collections import Counter
+
+import numpy as np
+
+from heavy_hitters import SS_CAPACIDADE, HeavyHitters
+
+
+def zipf_stream(seed, n=20000, universo=5000):
+    # Itens inteiros com distribuição de cauda longa e pesos inteiros (somas exatas em float)
+    rng = np.random.default_rng(seed)
+    itens = np.minimum(rng.zipf(1.3, n), universo)
+    pesos = rng.integers(1, 5, n).astype(float)
+    return list(zip(itens.tolist(), pesos.tolist()))
+
+
+def sketch_of(stream):
+    sketch = HeavyHitters()
+    for item, peso in stream:
+        sketch.update(item, peso)
+    return sketch
+
+
+def assert_bounds(sketch, reais):
+    assert len(sketch.ss.contadores) <= SS_CAPACIDADE
+    for item, (contagem, erro) in sketch.ss.contadores.items():
+        real = reais[int(item)]
+        assert contagem - erro <= real <= contagem
+    for item, real in reais.items():
+        assert sketch.cms.estimate(item) >= real
+
+
+def test_merge_keeps_error_bounds():
+    stream = zipf_stream(1)
+    metade = len(stream) // 2
+    reais = Counter()
+    for item, peso in stream:
+        reais[item] += peso
+
+    a, b = sketch_of(stream[:metade]), sketch_of(stream[metade:])
+    assert len(a.ss.contadores) == len(b.ss.contadores) == SS_CAPACIDADE
+    merged = a.merge(b)
+
+    assert_bounds(merged, reais)
+    assert merged.cms.total == sum(reais.values())
+    # Os itens mais pesados da cauda longa sobrevivem à combinação
+    top_real = [item for item, _ in reais.most_common(5)]
+    assert top_real == [item for item, _ in merged.ss.top(5)]
+
+
+def test_npz_round_trip():
+    stream = zipf_stream(2)
+    reais = Counter()
+    for item, peso in stream:
+        reais[item] += peso
+    sketch = sketch_of(stream)
+
+    restored = HeavyHitters.from_bytes(sketch.to_bytes())
+
+    # Itens voltam como texto (o .npz não guarda objetos Python): a coluna sketch só tem texto
+    assert all(isinstance(item, str) for item in restored.ss.contadores)
+    assert restored.ss.contadores == {str(k): v for k, v in sketch.ss.contadores.items()}
+    assert restored.ss.capacidade == sketch.ss.capacidade
+    np.testing.assert_array_equal(restored.cms.tabela, sketch.cms.tabela)
+    assert restored.cms.total == sketch.cms.total
+    # O Count-Min usa str(item) no hash: estimativas iguais para o item inteiro ou em texto
+    for item in list(reais)[:50]:
+        assert restored.cms.estimate(str(item)) == sketch.cms.estimate(item)
+    assert_bounds(restored, reais)
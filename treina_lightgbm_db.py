@@ -1,14 +1,61 @@
 # treina_lightgbm_db.py
+import argparse
+import hashlib
+import json
+import os
 import psycopg2
 import pandas as pd
-import lightgbm as lgb
 import pickle
-from lightgbm import early_stopping, log_evaluation
-from datetime import timedelta
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from compactacao import uso_diario
+from conexao import DB_PARAMS
+import metricas
+from metricas import incr, timed
 
+FEATURES = [
+    "year", "month", "day", "dayofweek", "weekofyear", "is_weekend",
+    "lag_1", "lag_7", "lag_30",
+    "rolling_7", "rolling_30",
+    "cargo", "departamento", "evento", "dispositivo", "situacao"
+]
+TARGET = "consumo_dados_gb"
+CATEGORICAL_COLS = ["cargo", "departamento", "evento", "dispositivo", "situacao"]
+
+# --- MODELO DIRETO MENSAL ---
+DIRECT_MODEL_PATH = "modelo_lightgbm_mensal.pkl"
+DIRECT_HORIZONS = list(range(1, 13))
+DIRECT_FEATURES = [
+    "horizonte", "mes_origem", "mes_alvo_num",
+    "mes_lag_1", "mes_lag_2", "mes_lag_3",
+    "mes_media_3", "mes_media_6", "mes_media_12", "mes_std_6",
+    "cargo", "departamento"
+]
+DIRECT_TARGET = "consumo_mes_alvo"
+DIRECT_CATEGORICAL_COLS = ["cargo", "departamento"]
+
+# --- MODELO POR GRUPO (DEPARTAMENTO x CARGO) ---
+GROUP_MODEL_PATH = "modelo_lightgbm_grupo.pkl"
+GROUP_FEATURES = [
+    "year", "month", "day", "dayofweek", "weekofyear", "is_weekend",
+    "lag_1", "lag_7", "lag_30",
+    "rolling_7", "rolling_30",
+    "cargo", "departamento"
+]
+GROUP_CATEGORICAL_COLS = ["cargo", "departamento"]
+
+# --- MODELOS POR SEGMENTO ---
+SEGMENT_COLS = ["departamento", "cargo"]
+SEGMENT_MODELS_DIR = "modelos_segmento"
+REGISTRY_PATH = "registro_modelos.json"
+MIN_SEGMENT_ROWS = 200
+
+@timed("treino.load_data_from_db")
 def load_data_from_db(conn_params):
     conn = psycopg2.connect(**conn_params)
-    query = """
+    # Bruto + dias compactados (compactacao.py): o treino vê o histórico em resolução diária
+    # até RETENCAO_DIARIO_DIAS; meses mais antigos só existem no resumo mensal e ficam de fora
+    query = f"""
     SELECT
         l.data_uso,
         l.consumo_dados_gb AS consumo,
@@ -19,59 +66,290 @@ def load_data_from_db(conn_params):
         evt.nome_eventos AS evento,
         disp.nome_dispositivo AS dispositivo,
         s.situacao AS situacao,
-        l.localizacao
-    FROM log_uso_sim l
+        loc.nome AS localizacao
+    FROM {uso_diario()} l
     JOIN usuario u ON l.id_usuario = u.id_usuario
     JOIN departamentos dep ON u.id_departamento = dep.id_departamento
     JOIN cargos c ON u.id_cargo = c.id_cargo
     JOIN eventos_especiais evt ON l.id_evento = evt.id_evento
     JOIN dispositivos disp ON l.id_dispositivo = disp.id_dispositivo
     JOIN situacao s ON l.id_situacao = s.id_situacao
-    ORDER BY l.data_uso;
+    LEFT JOIN localizacoes loc ON l.id_localizacao = loc.id_localizacao
+    ORDER BY l.data_uso, l.consumo_dados_gb;
     """
     df = pd.read_sql_query(query, conn)
     conn.close()
+    incr("linhas_carregadas", len(df), consulta="treino")
     return df
 
-def feature_engineering(df):
-    df['data'] = pd.to_datetime(df['data_uso'])
-    df = df.sort_values(['id_usuario', 'data']).reset_index(drop=True)
-    df.rename(columns={'consumo': 'consumo_dados_gb'}, inplace=True)
+STREAM_QUERY = f"""
+SELECT
+    l.data_uso,
+    l.consumo_dados_gb AS consumo,
+    u.id_usuario,
+    u.nome AS usuario,
+    dep.nome AS departamento,
+    c.nome AS cargo,
+    evt.nome_eventos AS evento,
+    disp.nome_dispositivo AS dispositivo,
+    s.situacao AS situacao,
+    loc.nome AS localizacao
+FROM {uso_diario()} l
+JOIN usuario u ON l.id_usuario = u.id_usuario
+JOIN departamentos dep ON u.id_departamento = dep.id_departamento
+JOIN cargos c ON u.id_cargo = c.id_cargo
+JOIN eventos_especiais evt ON l.id_evento = evt.id_evento
+JOIN dispositivos disp ON l.id_dispositivo = disp.id_dispositivo
+JOIN situacao s ON l.id_situacao = s.id_situacao
+LEFT JOIN localizacoes loc ON l.id_localizacao = loc.id_localizacao
+ORDER BY l.id_usuario, l.data_uso, l.consumo_dados_gb;
+"""
+
+def iter_data_from_db(conn_params, users_per_chunk=500, itersize=20000):
+    """
+    Lê o histórico com cursor nomeado (server-side), em blocos de usuários completos.
+    Como a consulta vem ordenada por usuário, cada bloco tem todo o histórico dos seus
+    usuários e os lags/rolling podem ser calculados bloco a bloco.
+    """
+    conn = psycopg2.connect(**conn_params)
+    try:
+        cur = conn.cursor(name="treino_stream")
+        cur.itersize = itersize
+        cur.execute(STREAM_QUERY)
+
+        columns = None
+        rows = []
+        users_in_chunk = 0
+        last_user = None
+        for row in cur:
+            if columns is None:
+                columns = [d[0] for d in cur.description]
+            user = row[2]
+            if user != last_user:
+                if users_in_chunk >= users_per_chunk:
+                    yield _rows_to_frame(rows, columns)
+                    rows = []
+                    users_in_chunk = 0
+                users_in_chunk += 1
+                last_user = user
+            rows.append(row)
 
+        if rows:
+            yield _rows_to_frame(rows, columns)
+        cur.close()
+    finally:
+        conn.close()
+
+def _rows_to_frame(rows, columns):
+    df = pd.DataFrame(rows, columns=columns)
+    # NUMERIC chega como Decimal pelo cursor; read_sql_query fazia essa conversão
+    df['consumo'] = df['consumo'].astype(float)
+    return df
+
+@timed("treino.build_training_matrix")
+def build_training_matrix(conn_params, output_path="matriz_treino.parquet", users_per_chunk=500, itersize=20000):
+    """
+    Gera a matriz de treino em disco, incrementalmente (um row group por bloco de usuários).
+    O pico de memória fica limitado ao tamanho de um bloco.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    columns = ["id_usuario", "data"] + FEATURES + [TARGET]
+    writer = None
+    total = 0
+    try:
+        for chunk in iter_data_from_db(conn_params, users_per_chunk, itersize):
+            df_fe = feature_engineering(chunk)
+            if df_fe.empty: continue
+            table = pa.Table.from_pandas(df_fe[columns], preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(output_path, table.schema)
+            else:
+                table = table.cast(writer.schema)
+            writer.write_table(table)
+            total += len(df_fe)
+            print(f"[OK] {total} linhas gravadas em {output_path}")
+    finally:
+        if writer is not None:
+            writer.close()
+    return total
+
+@timed("treino.load_features_from_store")
+def load_features_from_store(conn_params):
+    """
+    Lê as linhas prontas do feature store (ver atualiza_feature_store.py): uma por registro,
+    com os mesmos lags por linha de feature_engineering.
+    """
+    conn = psycopg2.connect(**conn_params)
+    query = """
+    SELECT id_usuario, data, consumo_dados_gb,
+           lag_1, lag_7, lag_30, rolling_7, rolling_30,
+           cargo, departamento, evento, dispositivo, situacao
+    FROM feature_store_consumo
+    ORDER BY id_usuario, data, seq;
+    """
+    df = pd.read_sql_query(query, conn)
+    conn.close()
+    df['data'] = pd.to_datetime(df['data'])
+    return add_calendar_features(df)
+
+def load_training_matrix(path="matriz_treino.parquet"):
+    # Matriz inteira em memória (treino por segmento): só as colunas usadas, numéricas em float32
+    df = pd.read_parquet(path, columns=["data"] + FEATURES + [TARGET])
+    for c in df.columns:
+        if c in CATEGORICAL_COLS:
+            df[c] = df[c].astype('category')
+        elif c != "data":
+            df[c] = df[c].astype('float32')
+    return df
+
+@timed("treino.train_from_matrix")
+def train_from_matrix(path="matriz_treino.parquet", model_path="modelo_lightgbm_consumo.pkl", n_jobs=-1,
+                      log_period=100, test_days=30):
+    """
+    Treina o modelo global direto do Parquet gerado por build_training_matrix, sem carregar
+    a matriz: o lgb.Dataset é montado a partir de um lgb.Sequence que lê um row group por vez
+    (só as colunas de FEATURES, em float32). Em memória ficam o Dataset já discretizado
+    (bins, bem menor que a matriz), o alvo e um row group.
+    Mesmos hiperparâmetros e validação (últimos `test_days` dias) de train_and_save; grava um
+    lgb.Booster com o mapeamento das categorias, que prevê a partir de DataFrames como o modelo sklearn.
+    """
+    import lightgbm as lgb
+    import numpy as np
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    arquivo = pq.ParquetFile(path)
+    n_grupos = arquivo.num_row_groups
+
+    # 1ª passada (só colunas pequenas): categorias, data máxima e corte de validação
+    categorias = {c: set() for c in CATEGORICAL_COLS}
+    max_date = None
+    for i in range(n_grupos):
+        tabela = arquivo.read_row_group(i, columns=CATEGORICAL_COLS + ["data"])
+        for c in CATEGORICAL_COLS:
+            categorias[c].update(v for v in pc.unique(tabela[c]).to_pylist() if v is not None)
+        data_max = pc.max(tabela["data"]).as_py()
+        max_date = data_max if max_date is None or data_max > max_date else max_date
+    categorias = {c: sorted(v) for c, v in categorias.items()}
+    test_start = pd.Timestamp(max_date) - pd.Timedelta(days=test_days)
+
+    class RowGroupSequence(lgb.Sequence):
+        # Linhas de treino (validacao=False) ou validação de cada row group, lidas sob demanda
+        def __init__(self, validacao):
+            self.mascaras = []
+            for i in range(n_grupos):
+                datas = arquivo.read_row_group(i, columns=["data"])["data"].to_pandas()
+                self.mascaras.append(((datas >= test_start) == validacao).to_numpy())
+            contagens = [int(m.sum()) for m in self.mascaras]
+            self.inicios = np.concatenate([[0], np.cumsum(contagens)])
+            self.batch_size = max(contagens + [1])
+            self.cache = (None, None)
+
+        def __len__(self):
+            return int(self.inicios[-1])
+
+        def grupo(self, i):
+            if self.cache[0] != i:
+                df = arquivo.read_row_group(i, columns=FEATURES).to_pandas()[self.mascaras[i]]
+                for c in CATEGORICAL_COLS:
+                    df[c] = pd.Categorical(df[c], categories=categorias[c]).codes
+                self.cache = (i, df[FEATURES].to_numpy(dtype=np.float32))
+            return self.cache[1]
+
+        def __getitem__(self, idx):
+            if isinstance(idx, slice):
+                return self.faixa(*idx.indices(len(self))[:2])
+            if isinstance(idx, list):
+                return np.array([self[j] for j in idx])
+            i = int(np.searchsorted(self.inicios, idx, side="right") - 1)
+            # Linhas avulsas vão para a amostra de bins, que o LightGBM exige em float64
+            return self.grupo(i)[idx - self.inicios[i]].astype(np.float64)
+
+        def faixa(self, inicio, fim):
+            partes = [np.empty((0, len(FEATURES)), dtype=np.float32)]
+            while inicio < fim:
+                i = int(np.searchsorted(self.inicios, inicio, side="right") - 1)
+                ate = min(fim, int(self.inicios[i + 1]))
+                partes.append(self.grupo(i)[inicio - self.inicios[i]:ate - self.inicios[i]])
+                inicio = ate
+            return np.vstack(partes)
+
+        def alvo(self):
+            return np.concatenate([
+                arquivo.read_row_group(i, columns=[TARGET])[TARGET].to_numpy()[m].astype(np.float32)
+                for i, m in enumerate(self.mascaras)
+            ])
+
+    treino, validacao = RowGroupSequence(False), RowGroupSequence(True)
+    if len(treino) == 0 or len(validacao) == 0:
+        raise RuntimeError("Matriz sem linhas de treino ou de validação no corte por data.")
+    categoricas = [FEATURES.index(c) for c in CATEGORICAL_COLS]
+    ds_treino = lgb.Dataset(treino, label=treino.alvo(), feature_name=FEATURES, categorical_feature=categoricas)
+    ds_validacao = lgb.Dataset(validacao, label=validacao.alvo(), reference=ds_treino)
+
+    params = {
+        "objective": "regression", "metric": "mae", "learning_rate": 0.02, "max_depth": -1,
+        "feature_fraction": 0.9, "bagging_fraction": 0.8, "bagging_freq": 5,
+        "seed": 42, "num_threads": n_jobs, "verbose": -1,
+    }
+    callbacks = [lgb.early_stopping(stopping_rounds=100)]
+    if log_period:
+        callbacks.append(lgb.log_evaluation(period=log_period))
+    booster = lgb.train(params, ds_treino, num_boost_round=2000, valid_sets=[ds_validacao], callbacks=callbacks)
+    # Na previsão, as colunas category do DataFrame são recodificadas nesta ordem de categorias
+    booster.pandas_categorical = [categorias[c] for c in FEATURES if c in CATEGORICAL_COLS]
+
+    with open(model_path, "wb") as f:
+        pickle.dump(booster, f)
+    print(f"Modelo salvo em {model_path}")
+    return booster
+
+def add_calendar_features(df):
     df['year'] = df['data'].dt.year
     df['month'] = df['data'].dt.month
     df['day'] = df['data'].dt.day
     df['dayofweek'] = df['data'].dt.dayofweek
     df['weekofyear'] = df['data'].dt.isocalendar().week.astype(int)
     df['is_weekend'] = df['dayofweek'].isin([5,6]).astype(int)
+    return df
 
-    df['lag_1'] = df.groupby('id_usuario')['consumo_dados_gb'].shift(1)
-    df['lag_7'] = df.groupby('id_usuario')['consumo_dados_gb'].shift(7)
-    df['lag_30'] = df.groupby('id_usuario')['consumo_dados_gb'].shift(30)
+@timed("treino.feature_engineering")
+def feature_engineering(df, id_col='id_usuario'):
+    # Lags e médias por registro (linha), não por dia. Ordenação estável: registros do mesmo
+    # instante ficam na ordem da consulta (consumo crescente), igual no treino e no feature store
+    df['data'] = pd.to_datetime(df['data_uso'])
+    df = df.sort_values([id_col, 'data'], kind='stable').reset_index(drop=True)
+    df.rename(columns={'consumo': 'consumo_dados_gb'}, inplace=True)
+
+    df = add_calendar_features(df)
 
-    df['rolling_7'] = df.groupby('id_usuario')['consumo_dados_gb'].transform(lambda x: x.rolling(7, min_periods=1).mean())
-    df['rolling_30'] = df.groupby('id_usuario')['consumo_dados_gb'].transform(lambda x: x.rolling(30, min_periods=1).mean())
+    df['lag_1'] = df.groupby(id_col)['consumo_dados_gb'].shift(1)
+    df['lag_7'] = df.groupby(id_col)['consumo_dados_gb'].shift(7)
+    df['lag_30'] = df.groupby(id_col)['consumo_dados_gb'].shift(30)
+
+    df['rolling_7'] = df.groupby(id_col)['consumo_dados_gb'].transform(lambda x: x.rolling(7, min_periods=1).mean())
+    df['rolling_30'] = df.groupby(id_col)['consumo_dados_gb'].transform(lambda x: x.rolling(30, min_periods=1).mean())
 
     df = df.dropna().reset_index(drop=True)
     return df
 
-def train_and_save(df, model_path="modelo_lightgbm_consumo.pkl"):
-    features = [
-        "year", "month", "day", "dayofweek", "weekofyear", "is_weekend",
-        "lag_1", "lag_7", "lag_30",
-        "rolling_7", "rolling_30",
-        "cargo", "departamento", "evento", "dispositivo", "situacao"
-    ]
-    target = "consumo_dados_gb"
-    categorical_cols = ["cargo", "departamento", "evento", "dispositivo", "situacao"]
+@timed("treino.train_and_save")
+def train_and_save(df, model_path="modelo_lightgbm_consumo.pkl", n_jobs=-1, log_period=100,
+                   features=FEATURES, target=TARGET, categorical_cols=CATEGORICAL_COLS,
+                   date_col="data", test_days=30):
+    # Importado aqui: quem só usa as definições de features (dashboard, jobs) não carrega o LightGBM
+    import lightgbm as lgb
+    from lightgbm import early_stopping, log_evaluation
 
     for c in categorical_cols:
         df[c] = df[c].astype('category')
 
-    max_date = df['data'].max()
-    test_start = max_date - pd.Timedelta(days=30)
-    train_df = df[df['data'] < test_start].copy()
-    test_df = df[df['data'] >= test_start].copy()
+    max_date = df[date_col].max()
+    test_start = max_date - pd.Timedelta(days=test_days)
+    train_df = df[df[date_col] < test_start].copy()
+    test_df = df[df[date_col] >= test_start].copy()
     if train_df.empty or test_df.empty:
         cut = int(len(df) * 0.8)
         train_df = df.iloc[:cut].copy()
@@ -91,6 +369,7 @@ def train_and_save(df, model_path="modelo_lightgbm_consumo.pkl"):
         bagging_freq=5,
         objective="regression",
         random_state=42,
+        n_jobs=n_jobs,
     )
 
     model.fit(
@@ -101,33 +380,291 @@ def train_and_save(df, model_path="modelo_lightgbm_consumo.pkl"):
         eval_metric="mae",
         callbacks=[
             early_stopping(stopping_rounds=100),
-            log_evaluation(period=100)
+            log_evaluation(period=log_period)
         ]
     )
 
     with open(model_path, "wb") as f:
         pickle.dump(model, f)
     print(f"Modelo salvo em {model_path}")
+    return model
 
-def main():
-    conn_params = {
-        "database": "ANALISE",
-        "user": "postgres",
-        "password": "1234",
-        "host": "localhost",
-        "port": "5433"
-    }
+# --- MODELO DIRETO MENSAL (MULTI-HORIZONTE) ---
+def incomplete_month(dates):
+    # Início do último mês do histórico se ele ainda não terminou (último dia antes do fim do mês), senão None
+    ultimo = pd.Timestamp(dates.max())
+    return None if ultimo.is_month_end else ultimo.to_period('M').to_timestamp()
 
-    df = load_data_from_db(conn_params)
+def monthly_series(df):
+    """
+    Consumo mensal por usuário, com meses sem registro preenchidos com zero.
+    O último mês do histórico é descartado se estiver incompleto: o estado mais recente é o do
+    último mês completo, e h=1 é o mês seguinte a ele.
+    """
+    df = df.rename(columns={'consumo': 'consumo_dados_gb'})
+    datas = pd.to_datetime(df['data_uso'] if 'data_uso' in df.columns else df['data'])
+    df = df.assign(mes=datas.dt.to_period('M').dt.to_timestamp())
+    parcial = incomplete_month(datas) if not df.empty else None
+    if parcial is not None:
+        df = df[df['mes'] < parcial]
     if df.empty:
-        raise RuntimeError("DataFrame vazio — verifique população do banco.")
+        return pd.DataFrame(columns=['id_usuario', 'mes', 'consumo_mes', 'cargo', 'departamento'])
+
+    monthly = df.groupby(['id_usuario', 'mes'])['consumo_dados_gb'].sum()
+    months = pd.date_range(df['mes'].min(), df['mes'].max(), freq='MS')
+    users = monthly.index.get_level_values('id_usuario').unique()
+    monthly = monthly.reindex(pd.MultiIndex.from_product([users, months], names=['id_usuario', 'mes']), fill_value=0.0)
+    monthly = monthly.rename('consumo_mes').reset_index()
+
+    meta = df.sort_values('mes').groupby('id_usuario')[['cargo', 'departamento']].last()
+    return monthly.merge(meta, left_on='id_usuario', right_index=True)
+
+def monthly_state_features(monthly):
+    """
+    Estado de cada usuário ao fim de cada mês: base para prever os meses seguintes.
+    """
+    monthly = monthly.sort_values(['id_usuario', 'mes']).reset_index(drop=True)
+    grp = monthly.groupby('id_usuario')['consumo_mes']
+    monthly['mes_lag_1'] = monthly['consumo_mes']
+    monthly['mes_lag_2'] = grp.shift(1)
+    monthly['mes_lag_3'] = grp.shift(2)
+    monthly['mes_media_3'] = grp.transform(lambda x: x.rolling(3, min_periods=1).mean())
+    monthly['mes_media_6'] = grp.transform(lambda x: x.rolling(6, min_periods=1).mean())
+    monthly['mes_media_12'] = grp.transform(lambda x: x.rolling(12, min_periods=1).mean())
+    monthly['mes_std_6'] = grp.transform(lambda x: x.rolling(6, min_periods=2).std()).fillna(0.0)
+    monthly['mes_origem'] = monthly['mes'].dt.month
+    return monthly
+
+def expand_horizons(state, horizons):
+    """
+    Replica cada linha de estado para os horizontes pedidos (feature `horizonte`).
+    """
+    expanded = []
+    for h in horizons:
+        part = state.assign(horizonte=h)
+        part['mes_alvo'] = part['mes'] + pd.DateOffset(months=h)
+        part['mes_alvo_num'] = part['mes_alvo'].dt.month
+        expanded.append(part)
+    return pd.concat(expanded, ignore_index=True)
+
+def build_direct_dataset(df):
+    """
+    Uma linha por (usuário, mês de origem, horizonte h=1..12), com alvo = consumo do mês origem+h.
+    """
+    state = monthly_state_features(monthly_series(df))
+    state = state.dropna(subset=['mes_lag_3'])
+    targets = state[['id_usuario', 'mes', 'consumo_mes']].rename(columns={'mes': 'mes_alvo', 'consumo_mes': DIRECT_TARGET})
+    dataset = expand_horizons(state, DIRECT_HORIZONS)
+    return dataset.merge(targets, on=['id_usuario', 'mes_alvo'], how='inner')
+
+@timed("treino.train_direct_and_save")
+def train_direct_and_save(df, model_path=DIRECT_MODEL_PATH):
+    dataset = build_direct_dataset(df)
+    if dataset.empty:
+        raise RuntimeError("Histórico mensal insuficiente para o modelo direto.")
+    return train_and_save(
+        dataset, model_path=model_path,
+        features=DIRECT_FEATURES, target=DIRECT_TARGET, categorical_cols=DIRECT_CATEGORICAL_COLS,
+        date_col="mes_alvo", test_days=90
+    )
+
+# --- MODELO POR GRUPO ---
+def group_daily_series(df):
+    """
+    Série diária agregada por (departamento, cargo), com dias sem registro preenchidos com zero.
+    Entrada: linhas com data_uso, consumo, departamento e cargo (brutas ou já agregadas por dia).
+    """
+    df = df.assign(data_uso=pd.to_datetime(df['data_uso']).dt.normalize())
+    daily = df.groupby(['departamento', 'cargo', 'data_uso'])['consumo'].sum()
+    days = pd.date_range(df['data_uso'].min(), df['data_uso'].max(), freq='D')
 
-    df_fe = feature_engineering(df)
+    series = []
+    for (dep, cargo), group in daily.groupby(level=['departamento', 'cargo']):
+        group = group.droplevel(['departamento', 'cargo']).reindex(days, fill_value=0.0)
+        series.append(pd.DataFrame({
+            'id_grupo': f"{dep}|{cargo}", 'departamento': dep, 'cargo': cargo,
+            'data_uso': days, 'consumo': group.values
+        }))
+    return pd.concat(series, ignore_index=True)
+
+@timed("treino.train_group_and_save")
+def train_group_and_save(df, model_path=GROUP_MODEL_PATH):
+    df_fe = feature_engineering(group_daily_series(df), id_col='id_grupo')
     if df_fe.empty:
-        raise RuntimeError("DataFrame vazio após feature engineering — gere mais dados ou reduza lags.")
+        raise RuntimeError("Histórico insuficiente para o modelo por grupo.")
+    return train_and_save(
+        df_fe, model_path=model_path,
+        features=GROUP_FEATURES, categorical_cols=GROUP_CATEGORICAL_COLS
+    )
+
+def segment_signature(df_segment):
+    """
+    Assinatura dos dados de um segmento: muda só quando as linhas do segmento mudam.
+    """
+    cols = ["id_usuario", "data", TARGET] + CATEGORICAL_COLS
+    hashes = pd.util.hash_pandas_object(df_segment[cols].astype(str), index=False)
+    return hashlib.sha1(hashes.values.tobytes()).hexdigest()
+
+def segment_model_path(segment_col, segment, models_dir=SEGMENT_MODELS_DIR):
+    safe = "".join(ch if ch.isalnum() else "_" for ch in str(segment))
+    return os.path.join(models_dir, f"{segment_col}_{safe}.pkl")
+
+def load_registry(registry_path=REGISTRY_PATH):
+    if not os.path.exists(registry_path):
+        return None
+    with open(registry_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _train_segment(segment, df_segment, model_path, n_jobs):
+    # Executado em processo separado: treina e grava o modelo do segmento
+    train_and_save(df_segment, model_path=model_path, n_jobs=n_jobs, log_period=0)
+    return segment
+
+@timed("treino.train_segment_models")
+def train_segment_models(df, segment_col="departamento", models_dir=SEGMENT_MODELS_DIR,
+                         registry_path=REGISTRY_PATH, workers=None, force=False):
+    """
+    Treina um modelo por departamento (ou cargo) em processos paralelos.
+    Segmentos cuja assinatura de dados não mudou desde o último treino são pulados.
+    A falha de um segmento não descarta os outros: o registro é gravado com os que treinaram
+    (o que falhou mantém a entrada anterior, se houver, e é retreinado na próxima execução)
+    e só então é levantado RuntimeError com os segmentos que falharam.
+    """
+    if segment_col not in SEGMENT_COLS:
+        raise ValueError(f"Segmento inválido: {segment_col}. Use um de {SEGMENT_COLS}.")
+
+    os.makedirs(models_dir, exist_ok=True)
+    registry = load_registry(registry_path)
+    if not registry or registry.get("segmento") != segment_col:
+        registry = {"segmento": segment_col, "modelos": {}}
 
-    train_and_save(df_fe)
+    pending = {}
+    failed = {}
+    for segment, df_segment in df.groupby(segment_col, observed=True):
+        segment = str(segment)
+        if len(df_segment) < MIN_SEGMENT_ROWS:
+            print(f"[AVISO] Segmento '{segment}' com {len(df_segment)} linhas — usa o modelo global.")
+            registry["modelos"].pop(segment, None)
+            continue
 
+        signature = segment_signature(df_segment)
+        entry = registry["modelos"].get(segment)
+        model_path = segment_model_path(segment_col, segment, models_dir)
+        if not force and entry and entry.get("assinatura") == signature and os.path.exists(entry["arquivo"]):
+            print(f"[OK] Segmento '{segment}' sem mudanças — modelo mantido.")
+            continue
+
+        pending[segment] = (df_segment.reset_index(drop=True), model_path, signature)
+
+    if pending:
+        workers = workers or min(len(pending), os.cpu_count() or 1)
+        n_jobs = max(1, (os.cpu_count() or 1) // workers)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(_train_segment, segment, df_segment, model_path, n_jobs): segment
+                for segment, (df_segment, model_path, _) in pending.items()
+            }
+            for future in as_completed(futures):
+                segment = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    failed[segment] = e
+                    print(f"[ERRO] Segmento '{segment}' falhou:", e)
+                    continue
+                df_segment, model_path, signature = pending[segment]
+                registry["modelos"][segment] = {
+                    "arquivo": model_path,
+                    "assinatura": signature,
+                    "linhas": len(df_segment),
+                    "treinado_em": datetime.now().isoformat(timespec="seconds"),
+                }
+                print(f"[OK] Segmento '{segment}' treinado.")
+
+    # Arquivo temporário + rename: o dashboard nunca lê um registro pela metade
+    tmp_path = f"{registry_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(registry, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, registry_path)
+    print(f"Registro de modelos salvo em {registry_path}")
+    if failed:
+        raise RuntimeError(f"{len(failed)} segmento(s) falharam: {', '.join(sorted(failed))}.")
+    return registry
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Treino do modelo LightGBM de consumo.")
+    parser.add_argument("--tipo", choices=["diario", "mensal", "grupo"], default="diario",
+                        help="diario: modelo recursivo dia a dia; mensal: modelo direto multi-horizonte (h=1..12); "
+                             "grupo: modelo das séries agregadas por departamento x cargo.")
+    parser.add_argument("--segmento", choices=SEGMENT_COLS, default=None,
+                        help="Treina um modelo por departamento ou cargo em vez do modelo global.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Processos paralelos no treino por segmento (padrão: nº de CPUs).")
+    parser.add_argument("--forcar", action="store_true",
+                        help="Retreina todos os segmentos, mesmo sem mudança nos dados.")
+    parser.add_argument("--feature-store", action="store_true",
+                        help="Treina a partir das linhas prontas da tabela feature_store_consumo.")
+    parser.add_argument("--streaming", action="store_true",
+                        help="Lê o banco em blocos (cursor server-side), grava a matriz de treino em disco e "
+                             "treina a partir do arquivo, um row group por vez. Com --segmento a matriz "
+                             "ainda é carregada inteira (só as colunas usadas, em float32).")
+    parser.add_argument("--matriz", default="matriz_treino.parquet",
+                        help="Arquivo Parquet da matriz de treino no modo --streaming.")
+    parser.add_argument("--usuarios-por-bloco", type=int, default=500,
+                        help="Usuários por bloco no modo --streaming.")
+    parser.add_argument("--metricas", action="store_true",
+                        help="Mede o tempo de cada etapa e grava os totais em formato Prometheus (metricas.py).")
+    return parser.parse_args()
+
+def run(args):
+    conn_params = DB_PARAMS
+
+    if args.tipo in ("mensal", "grupo"):
+        df = load_data_from_db(conn_params)
+        if df.empty:
+            raise RuntimeError("DataFrame vazio — verifique população do banco.")
+        if args.tipo == "mensal":
+            train_direct_and_save(df)
+        else:
+            train_group_and_save(df)
+        return
+
+    if args.feature_store:
+        df_fe = load_features_from_store(conn_params)
+        if df_fe.empty:
+            raise RuntimeError("Feature store vazio — rode atualiza_feature_store.py.")
+    elif args.streaming:
+        total = build_training_matrix(conn_params, args.matriz, users_per_chunk=args.usuarios_por_bloco)
+        if total == 0:
+            raise RuntimeError("Matriz de treino vazia — verifique população do banco.")
+        if not args.segmento:
+            train_from_matrix(args.matriz)
+            return
+        df_fe = load_training_matrix(args.matriz)
+    else:
+        df = load_data_from_db(conn_params)
+        if df.empty:
+            raise RuntimeError("DataFrame vazio — verifique população do banco.")
+
+        df_fe = feature_engineering(df)
+        if df_fe.empty:
+            raise RuntimeError("DataFrame vazio após feature engineering — gere mais dados ou reduza lags.")
+
+    if args.segmento:
+        train_segment_models(df_fe, segment_col=args.segmento, workers=args.workers, force=args.forcar)
+    else:
+        train_and_save(df_fe)
+
+def main():
+    args = parse_args()
+    if args.metricas:
+        metricas.enable()
+    try:
+        run(args)
+    finally:
+        if metricas.export(force=True):
+            print(f"[OK] Métricas gravadas em {metricas.EXPORT_PATH}")
 
 
-main()
\ No newline at end of file
+if __name__ == "__main__":
+    main()